@@ -6,15 +6,117 @@ class Settings(BaseSettings):
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8", extra="ignore")
 
     database_url: str = "sqlite:///./leads.db"
+    # Пул соединений (и синхронного, и асинхронного движка).
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_pre_ping: bool = True
+    db_pool_recycle_seconds: int = 1800
+    # SQLite: сколько ждать снятия блокировки другим процессом (API и воркер делят один файл).
+    sqlite_busy_timeout_ms: int = 5000
+    # POST /leads/bulk: сколько строк пишем одним multi-row INSERT и одной транзакцией.
+    bulk_insert_batch_size: int = 1000
+    # Повторный вебхук или двойная отправка формы возвращают существующего лида.
+    idempotency_key_ttl_hours: int = 24
+    # Лид с тем же телефоном или username в этом окне считается дублем; 0 — не проверять.
+    lead_dedupe_window_hours: int = 24
+    # Отложенная запись заявок из Tilda: очередь в памяти и групповой коммит пачками.
+    ingest_queue_enabled: bool = True
+    ingest_queue_size: int = 10000
+    ingest_batch_size: int = 200
+    ingest_flush_interval: float = 0.05
+    # Префикс спула: каждый процесс дописывает заявку в свой файл до ответа вебхуку;
+    # спулы упавших процессов восстанавливаются при старте.
+    ingest_spool_path: str | None = None
 
     telegram_api_id: int
     telegram_api_hash: str
     telegram_bot_token: str | None = None
     telegram_session_name: str = "ai_assistant"
     telegram_session_dir: str = "."
+    # Дополнительные аккаунты для рассылки: имена сессий в TELEGRAM_SESSION_DIR (JSON-список).
+    telegram_extra_sessions: list[str] = []
+    # FloodWait дольше этого (в секундах) выводит аккаунт из пула на это время, его лиды переходят к другим.
+    telegram_account_flood_limit_seconds: int = 300
+
+    # Конвейер рассылки: сколько лидов обрабатываем одновременно и с какой скоростью пишем в Telegram.
+    outreach_batch_size: int = 50
+    outreach_concurrency: int = 5
+    # Воркер просыпается по NOTIFY/сигналу, опрос БД — только страховка.
+    outreach_poll_interval: float = 120.0
+    worker_signal_path: str = "./.worker.sock"
+    # Идентификатор воркера для аренды лидов; по умолчанию hostname:pid.
+    worker_id: str | None = None
+    lead_lease_seconds: int = 300
+    lease_reaper_interval: float = 60.0
+    # Порт HTTP-сервера воркера с метриками Prometheus (GET /metrics); 0 — не запускать.
+    worker_metrics_port: int = 9100
+    # Напоминания лидам, не ответившим на приветствие: задержка перед каждым (часы от предыдущего
+    # сообщения) и тексты; последний текст повторяется, если задержек больше. Пустой список — без напоминаний.
+    follow_up_enabled: bool = True
+    follow_up_delays_hours: list[float] = [24.0, 72.0]
+    follow_up_templates: list[str] = [
+        "{name}, добрый день! Напоминаем о заявке в GordovCode. "
+        "Выберите удобное время для короткого созвона: {calendly_link}",
+        "{name}, если задача ещё актуальна, будем рады обсудить её на созвоне: {calendly_link}\n\n"
+        "Если нет — просто напишите, и мы больше не побеспокоим.",
+    ]
+    # Через сколько часов после последнего напоминания лид без ответа закрывается как expired; 0 — никогда.
+    follow_up_expire_hours: float = 168.0
+    follow_up_batch_size: int = 100
+    # Исходящие сообщения пишутся в таблицу outbox вместе со статусом лида и отправляются отдельной
+    # задачей пачками: повторы с экспоненциальной задержкой, после последней попытки сообщение — failed.
+    outbox_batch_size: int = 50
+    outbox_max_attempts: int = 8
+    outbox_retry_base_seconds: float = 5.0
+    outbox_retry_max_seconds: float = 900.0
+    # Сколько часов хранить отправленные и неудавшиеся сообщения.
+    outbox_retention_hours: int = 168
+    telegram_rate_per_second: float = 0.5
+    telegram_max_rate_per_second: float = 2.0
+    telegram_rate_burst: int = 5
+    telegram_flood_retries: int = 3
+    # Приоритеты воркера: веса классов работы при дележе лимита Telegram-аккаунта и предел очереди
+    # класса (работа в процессе плюс неотправленные сообщения outbox), при котором класс не берёт новых лидов.
+    scheduler_weights: dict[str, int] = {"reply": 6, "follow_up": 3, "outreach": 1}
+    scheduler_queue_limits: dict[str, int] = {"follow_up": 100, "outreach": 100}
+    # Сколько ждём следующих сообщений лида, прежде чем отвечать на всю серию разом.
+    reply_debounce_seconds: float = 1.5
+    # Кэш телефон/username → Telegram id: сколько доверяем найденным и ненайденным контактам.
+    identity_cache_ttl_hours: int = 720
+    identity_negative_ttl_hours: int = 24
+    peer_cache_size: int = 10000
 
     openai_api_key: str
     openai_model: str = "gpt-4.1-mini"
+    # Прокси только для OpenAI, например socks5h://host.docker.internal:1082.
+    openai_proxy: str | None = None
+    # Другой endpoint, совместимый с Responses API (например, локальная заглушка для бенчмарков).
+    openai_base_url: str | None = None
+    # Потоковые ответы: первое сообщение после первого предложения, дальше правки не чаще раза в интервал.
+    openai_streaming: bool = True
+    stream_edit_interval: float = 1.5
+    openai_timeout_seconds: float = 20.0
+    openai_max_concurrency: int = 8
+    openai_requests_per_minute: int = 300
+    openai_max_retries: int = 2
+    openai_breaker_failures: int = 5
+    openai_breaker_reset_seconds: float = 30.0
+    # Ниже этой уверенности локального классификатора спрашиваем OpenAI.
+    intent_confidence_threshold: float = 0.6
+    # Неуверенные сообщения классифицируются пачками: копим до INTENT_BATCH_WINDOW секунд или
+    # INTENT_BATCH_SIZE сообщений и спрашиваем OpenAI одним запросом.
+    intent_batch_enabled: bool = False
+    intent_batch_size: int = 16
+    intent_batch_window: float = 0.02
+    # Кэш ответов LLM: сколько вариантов держим на один запрос, сколько живут и сколько всего записей.
+    llm_cache_enabled: bool = True
+    llm_cache_variants: int = 3
+    llm_cache_ttl_hours: int = 168
+    llm_cache_max_entries: int = 50000
+    llm_cache_memory_size: int = 2048
+    # История переписки в промпте ответа: бюджет в токенах (оценка по длине текста). Реплики сверх
+    # бюджета сворачиваются в краткое содержание и удаляются из БД; 0 — отвечать без истории.
+    conversation_history_tokens: int = 1200
     calendly_link: str
 
     greeting_template: str = (
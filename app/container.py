@@ -0,0 +1,57 @@
+"""
+Общие объекты API, создаваемые по первому обращению.
+
+Импорт main и роутеров ничего не подключает и не запускает: дедупликатор и
+очередь заявок появляются при первом использовании, а запускаются и
+закрываются в lifespan приложения. Сколько стоила инициализация каждого
+компонента, StartupReport пишет в лог при старте.
+"""
+import logging
+from functools import cached_property, lru_cache
+
+from sqlalchemy import text
+
+from .db import close_db, get_async_engine
+from .services.dedupe import LeadDeduplicator
+from .services.ingest import LeadIngestQueue
+from .startup import StartupReport
+
+# Как и роуты, пишем через uvicorn.error, чтобы отчёт о старте был виден в логах API.
+logger = logging.getLogger("uvicorn.error")
+
+
+class AppContainer:
+    def __init__(self) -> None:
+        self.report = StartupReport()
+
+    @cached_property
+    def deduplicator(self) -> LeadDeduplicator:
+        with self.report.measure("deduplicator"):
+            return LeadDeduplicator()
+
+    @cached_property
+    def ingest_queue(self) -> LeadIngestQueue:
+        deduplicator = self.deduplicator
+        with self.report.measure("ingest_queue"):
+            return LeadIngestQueue(deduplicator)
+
+    async def start(self) -> None:
+        # Первое соединение открываем здесь, а не на первом запросе: ошибка настроек БД видна сразу.
+        with self.report.measure("db_connect"):
+            async with get_async_engine().connect() as connection:
+                await connection.execute(text("SELECT 1"))
+        queue = self.ingest_queue
+        with self.report.measure("ingest_queue_start"):
+            await queue.start()
+        logger.info("API started: %s", self.report.render())
+
+    async def stop(self) -> None:
+        # Сначала дописываем очередь заявок, потом закрываем пул соединений.
+        if "ingest_queue" in self.__dict__:
+            await self.ingest_queue.stop()
+        await close_db()
+
+
+@lru_cache
+def get_container() -> AppContainer:
+    return AppContainer()
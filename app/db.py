@@ -1,20 +1,159 @@
-from contextlib import contextmanager
-from typing import Iterator
+from contextlib import asynccontextmanager, contextmanager
+from functools import lru_cache
+from typing import Any, AsyncIterator, Iterator
 
+from sqlalchemy import Engine, Enum, event, inspect, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from .config import get_settings
 
-settings = get_settings()
 
-engine = create_engine(settings.database_url, echo=False)
+# Асинхронные драйверы для тех же баз: psycopg 3 умеет оба режима, для SQLite — aiosqlite.
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+psycopg",
+}
+
+
+def _async_url(url: URL) -> URL:
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    return url.set(drivername=driver) if driver else url
+
+
+def _engine_options(url: URL, *, is_async: bool = False) -> dict[str, Any]:
+    settings = get_settings()
+    options: dict[str, Any] = {"echo": False, "pool_pre_ping": settings.db_pool_pre_ping}
+    if url.get_backend_name() == "sqlite":
+        if url.database in (None, "", ":memory:"):
+            # База в памяти живёт в единственном соединении — пул настраивать нечего.
+            return options
+        if is_async:
+            # Иначе aiosqlite (в части версий SQLAlchemy) получает NullPool и открывает файл на каждый запрос.
+            options["poolclass"] = AsyncAdaptedQueuePool
+    options.update(
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_recycle=settings.db_pool_recycle_seconds,
+    )
+    return options
+
+
+def _configure_sqlite(sync_engine: Engine) -> None:
+    if sync_engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection: Any, _record: Any) -> None:
+        # WAL: читатели не блокируют писателя, а busy_timeout ждёт блокировку вместо "database is locked".
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(get_settings().sqlite_busy_timeout_ms)}")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+
+# Движки создаются при первом обращении: импорт модуля не грузит драйвер БД и не подключается.
+@lru_cache
+def get_engine() -> Engine:
+    """Синхронный движок — для схемы (init_db) и утилит; всё в event loop идёт через get_async_engine()."""
+    url = make_url(get_settings().database_url)
+    engine = create_engine(url, **_engine_options(url))
+    _configure_sqlite(engine)
+    return engine
+
+
+@lru_cache
+def get_async_engine() -> AsyncEngine:
+    url = make_url(get_settings().database_url)
+    engine = create_async_engine(_async_url(url), **_engine_options(url, is_async=True))
+    _configure_sqlite(engine.sync_engine)
+    return engine
 
 
 def init_db() -> None:
-    SQLModel.metadata.create_all(engine)
+    """Создаёт и досоздаёт схему. Приложение само этого не делает: `python -m app.manage init-db`."""
+    # Таблицы попадают в metadata при импорте моделей; без него create_all создаст пустую схему.
+    from . import models  # noqa: F401
+
+    SQLModel.metadata.create_all(get_engine())
+    _upgrade_schema()
+
+
+def _upgrade_schema() -> None:
+    """
+    Лёгкая миграция поверх create_all, который не меняет существующие таблицы:
+    досоздаёт новые nullable-колонки, индексы и значения enum-типов. Шаги идемпотентны.
+    """
+    engine = get_engine()
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    with engine.begin() as connection:
+        for table in SQLModel.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(
+                    text(
+                        f"ALTER TABLE {preparer.format_table(table)} "
+                        f"ADD COLUMN {preparer.format_column(column)} {column_type}"
+                    )
+                )
+            if engine.dialect.name == "postgresql":
+                # Новые значения Python-enum (например, статуса лида) нужно добавить и в тип Postgres.
+                for column in table.columns:
+                    if isinstance(column.type, Enum) and column.type.native_enum:
+                        for value in column.type.enums:
+                            connection.execute(
+                                text(
+                                    f"ALTER TYPE {preparer.format_type(column.type)} "
+                                    f"ADD VALUE IF NOT EXISTS '{value}'"
+                                )
+                            )
+            existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(connection)
 
 
 @contextmanager
 def get_session() -> Iterator[Session]:
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
+        yield session
+
+
+@asynccontextmanager
+async def get_async_session() -> AsyncIterator[AsyncSession]:
+    # expire_on_commit=False: после коммита атрибуты читаются без неявного (и невозможного в async) запроса.
+    async with AsyncSession(get_async_engine(), expire_on_commit=False) as session:
         yield session
+
+
+def upsert(session: AsyncSession, model: type[SQLModel], rows: list[dict[str, Any]], *, keys: list[str]) -> Any:
+    """
+    INSERT ... ON CONFLICT (keys) DO UPDATE для SQLite и Postgres: строки с уже занятым
+    ключом перезаписываются, и параллельная запись того же ключа не падает на IntegrityError.
+    """
+    dialect = session.sync_session.get_bind().dialect.name
+    insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    statement = insert(model).values(rows)
+    return statement.on_conflict_do_update(
+        index_elements=keys,
+        set_={column: statement.excluded[column] for column in rows[0] if column not in keys},
+    )
+
+
+async def close_db() -> None:
+    # Соединения aiosqlite держат свои потоки: без dispose процесс не завершится.
+    if get_async_engine.cache_info().currsize:
+        await get_async_engine().dispose()
+    if get_engine.cache_info().currsize:
+        get_engine().dispose()
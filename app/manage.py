@@ -0,0 +1,69 @@
+"""
+Служебные команды: `python -m app.manage <команда>`.
+
+init-db         создать и досоздать схему БД; API и воркер сами схему не трогают
+startup-report  время импорта и инициализации компонентов API и воркера
+"""
+import argparse
+import asyncio
+import json
+
+# Модули приложения импортируются внутри команд: иначе startup-report не увидит стоимость их импорта.
+from .startup import StartupReport, measure_imports
+
+
+def init_db() -> None:
+    from .db import init_db as create_schema
+
+    create_schema()
+    print("Database schema is up to date")
+
+
+def startup_report(as_json: bool = False) -> None:
+    report = StartupReport()
+    measure_imports(report)
+
+    from .container import get_container
+    from .db import get_async_engine, get_engine
+    from .services.llm_gateway import LLMGateway
+
+    with report.measure("init:db_engines"):
+        get_engine()
+        get_async_engine()
+    with report.measure("init:api_container"):
+        get_container().ingest_queue
+    with report.measure("init:openai_client"):
+        LLMGateway().client
+
+    async def connect() -> None:
+        # Здесь же заводится очередь заявок: так стартует lifespan API.
+        try:
+            with report.measure("init:api_start"):
+                await get_container().start()
+        finally:
+            await get_container().stop()
+
+    asyncio.run(connect())
+    if as_json:
+        print(json.dumps({component: round(seconds * 1000, 1) for component, seconds in report.timings.items()}))
+        return
+    for component, seconds in report.timings.items():
+        print(f"{component:<24} {seconds * 1000:>9.1f} ms")
+    print(f"{'total':<24} {sum(report.timings.values()) * 1000:>9.1f} ms")
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.manage")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("init-db", help="создать и досоздать схему БД")
+    report = commands.add_parser("startup-report", help="время импорта и инициализации компонентов")
+    report.add_argument("--json", action="store_true", help="вывести результат одной JSON-строкой")
+    args = parser.parse_args(argv)
+    if args.command == "init-db":
+        init_db()
+    else:
+        startup_report(args.json)
+
+
+if __name__ == "__main__":
+    main()
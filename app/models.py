@@ -2,7 +2,7 @@ from datetime import datetime
 from enum import Enum
 from typing import Optional
 
-from sqlalchemy import BigInteger, Column, String
+from sqlalchemy import BigInteger, Column, Index, String, Text, UniqueConstraint, text
 from sqlmodel import Field, SQLModel
 
 
@@ -13,9 +13,35 @@ class LeadStatus(str, Enum):
     confirmed = "confirmed"
     rejected = "rejected"
     scheduled = "scheduled"
+    # Не ответил ни на приветствие, ни на напоминания.
+    expired = "expired"
 
 
 class Lead(SQLModel, table=True):
+    __table_args__ = (
+        # Листинг с фильтром по статусу и keyset-пагинацией по (created_at, id).
+        Index("ix_lead_status_created_at_id", "status", "created_at", "id"),
+        Index("ix_lead_created_at_id", "created_at", "id"),
+        # Поиск дубликатов заявки по контакту в окне времени.
+        Index("ix_lead_phone_created_at", "phone", "created_at"),
+        Index("ix_lead_telegram_username_created_at", "telegram_username", "created_at"),
+        # Очередь рассылки: WHERE status = 'pending' ORDER BY created_at. Частичный индекс
+        # содержит только ожидающих лидов и не растёт вместе с архивом обработанных.
+        Index(
+            "ix_lead_pending_created_at",
+            "created_at",
+            postgresql_where=text("status = 'pending'"),
+            sqlite_where=text("status = 'pending'"),
+        ),
+        # Расписание напоминаний: ближайший срок и пачка просроченных читаются по этому индексу.
+        Index(
+            "ix_lead_next_action_at",
+            "next_action_at",
+            postgresql_where=text("next_action_at IS NOT NULL"),
+            sqlite_where=text("next_action_at IS NOT NULL"),
+        ),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str
     phone: Optional[str] = Field(default=None)
@@ -32,11 +58,129 @@ class Lead(SQLModel, table=True):
         default=None,
         sa_column=Column(String(64), nullable=True, index=True),
     )
+    # Сессия Telegram-аккаунта, который ведёт переписку с лидом; пусто — основной аккаунт.
+    telegram_account: Optional[str] = Field(
+        default=None,
+        sa_column=Column(String(64), nullable=True),
+    )
+    # id нашего последнего сообщения лиду и когда оно ушло (записывает отправитель outbox).
     last_message_id: Optional[int] = None
     last_contacted_at: Optional[datetime] = None
+    # Аренда лида воркером: кто взял его в работу и до какого момента.
+    claimed_by: Optional[str] = Field(
+        default=None,
+        sa_column=Column(String(128), nullable=True),
+    )
+    lease_expires_at: Optional[datetime] = Field(default=None, index=True)
+    # Когда отправить следующее напоминание или закрыть лида; пусто — ничего не запланировано.
+    next_action_at: Optional[datetime] = None
+    # Сколько напоминаний уже отправлено.
+    follow_up_step: Optional[int] = Field(default=0)
+    # Краткое содержание ранней переписки, реплики которой уже удалены из conversationmessage.
+    conversation_summary: Optional[str] = Field(default=None, sa_column=Column(Text, nullable=True))
     created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
     updated_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
     notes: Optional[str] = None
 
     def mark_updated(self) -> None:
         self.updated_at = datetime.utcnow()
+
+    def release_claim(self) -> None:
+        self.claimed_by = None
+        self.lease_expires_at = None
+
+
+class TelegramIdentity(SQLModel, table=True):
+    """Кэш соответствий телефон/username → Telegram-пользователь (пустой user_id — не найден)."""
+
+    key: str = Field(sa_column=Column(String(80), primary_key=True))
+    telegram_user_id: Optional[int] = Field(
+        default=None,
+        sa_column=Column(BigInteger, nullable=True, index=True),
+    )
+    telegram_access_hash: Optional[int] = Field(
+        default=None,
+        sa_column=Column(BigInteger, nullable=True),
+    )
+    telegram_username: Optional[str] = Field(
+        default=None,
+        sa_column=Column(String(64), nullable=True),
+    )
+    resolved_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+
+
+class LLMCacheEntry(SQLModel, table=True):
+    """Один из нескольких закэшированных вариантов ответа LLM на нормализованный запрос."""
+
+    __table_args__ = (UniqueConstraint("key", "variant"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    key: str = Field(sa_column=Column(String(64), nullable=False, index=True))
+    variant: int = Field(default=0, nullable=False)
+    response: str = Field(sa_column=Column(Text, nullable=False))
+    created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False, index=True)
+
+
+class OutboxStatus(str, Enum):
+    pending = "pending"
+    sent = "sent"
+    failed = "failed"
+
+
+class OutboxMessage(SQLModel, table=True):
+    """
+    Исходящее сообщение лиду. Пишется в одной транзакции со сменой статуса лида,
+    отправляется отдельной задачей; dedupe_key защищает от повторной постановки и,
+    через random_id, от повторной отправки в Telegram.
+    """
+
+    __table_args__ = (
+        # Очередь отправки: только неотправленные сообщения в порядке срока следующей попытки.
+        Index(
+            "ix_outboxmessage_pending_next_attempt_at",
+            "next_attempt_at",
+            postgresql_where=text("status = 'pending'"),
+            sqlite_where=text("status = 'pending'"),
+        ),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    dedupe_key: str = Field(sa_column=Column(String(128), nullable=False, unique=True))
+    lead_id: int = Field(nullable=False)
+    # greeting, reply или reminder.
+    kind: str = Field(sa_column=Column(String(16), nullable=False))
+    telegram_account: Optional[str] = Field(default=None, sa_column=Column(String(64), nullable=True))
+    telegram_user_id: int = Field(sa_column=Column(BigInteger, nullable=False))
+    text: str = Field(sa_column=Column(Text, nullable=False))
+    status: OutboxStatus = Field(default=OutboxStatus.pending)
+    attempts: int = Field(default=0, nullable=False)
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    telegram_message_id: Optional[int] = None
+    last_error: Optional[str] = Field(default=None, sa_column=Column(Text, nullable=True))
+    created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False, index=True)
+    sent_at: Optional[datetime] = None
+
+
+class ConversationMessage(SQLModel, table=True):
+    """Реплика переписки с лидом: его сообщение (серия сообщений) или наш ответ."""
+
+    __table_args__ = (
+        # История лида читается одним range-запросом в порядке id.
+        Index("ix_conversationmessage_lead_id_id", "lead_id", "id"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    lead_id: int = Field(nullable=False)
+    # lead или assistant.
+    role: str = Field(sa_column=Column(String(16), nullable=False))
+    text: str = Field(sa_column=Column(Text, nullable=False))
+    created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+
+
+class IdempotencyKey(SQLModel, table=True):
+    """Ключ запроса на создание лида: повтор с тем же ключом возвращает уже созданного лида."""
+
+    key: str = Field(sa_column=Column(String(64), primary_key=True))
+    lead_id: int = Field(nullable=False)
+    # По индексу отсекаются и вычищаются ключи старше IDEMPOTENCY_KEY_TTL_HOURS.
+    created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False, index=True)
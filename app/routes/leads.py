@@ -1,21 +1,40 @@
 from __future__ import annotations
 
+import base64
+import binascii
+import json
 import logging
 import re
+from datetime import datetime
 from typing import Any, Dict, Iterable, Sequence
 from urllib.parse import parse_qs
 
-from fastapi import APIRouter, HTTPException, Request, status
-from pydantic import BaseModel
-
-from ..db import get_session
-from ..models import Lead
-from ..schemas import LeadCreate, LeadRead
+from fastapi import APIRouter, Header, HTTPException, Query, Request, Response, status
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import insert, tuple_
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlmodel import select
+
+from ..config import get_settings
+from ..container import get_container
+from ..db import get_async_session
+from ..models import Lead, LeadStatus
+from ..schemas import BulkImportResult, BulkRowResult, LeadCreate, LeadPage, LeadRead
+from ..services.ingest import PendingLead
+from ..services.lead_import import ImportFormatError, iter_rows
+from ..services.metrics import Counter
+from ..services.notify import notify_pending_leads
 
 router = APIRouter(prefix="/leads", tags=["leads"])
 # Логируем через uvicorn.error, чтобы сообщения было видно в docker-логах
 logger = logging.getLogger("uvicorn.error")
 
+LEADS_INGESTED = Counter(
+    "leads_ingested_total",
+    "Leads received by the API by endpoint and result (created, duplicate, queued, rejected).",
+    ("source", "result"),
+)
+
 
 class TildaField(BaseModel):
     name: str
@@ -31,13 +50,112 @@ class TildaWebhookPayload(BaseModel):
         extra = "allow"
 
 
-def _persist_lead(name: str, phone: str | None, telegram_username: str | None) -> LeadRead:
-    with get_session() as session:
+async def _persist_lead(
+    name: str,
+    phone: str | None,
+    telegram_username: str | None,
+    *,
+    idempotency_key: str | None = None,
+) -> tuple[LeadRead, bool]:
+    """Создаёт лида или возвращает уже существующий дубль. Второе значение — был ли лид создан."""
+    deduplicator = get_container().deduplicator
+    key = deduplicator.make_key(name, phone, telegram_username, client_key=idempotency_key)
+    async with get_async_session() as session:
+        existing = await deduplicator.find(session, key, phone, telegram_username)
+        if existing:
+            logger.info("Duplicate lead submission matched existing lead %s", existing.id)
+            return LeadRead.model_validate(existing), False
+
         lead = Lead(name=name, phone=phone, telegram_username=telegram_username)
         session.add(lead)
-        session.commit()
-        session.refresh(lead)
-        return LeadRead.model_validate(lead)
+        await session.flush()
+        await deduplicator.remember(session, key, lead.id)
+        await notify_pending_leads(session)
+        try:
+            await session.commit()
+        except IntegrityError:
+            # Такой же запрос параллельно успел создать лида первым.
+            await session.rollback()
+            existing = await deduplicator.find(session, key, phone, telegram_username)
+            if not existing:
+                raise
+            return LeadRead.model_validate(existing), False
+    await deduplicator.after_insert()
+    return LeadRead.model_validate(lead), True
+
+
+def _bulk_values(fields: Dict[str, Any]) -> Dict[str, Any]:
+    """Проверяет строку импорта так же, как POST /leads, и возвращает значения для INSERT."""
+    values = {
+        key.strip().lower(): str(value).strip()
+        for key, value in fields.items()
+        if value is not None and str(value).strip()
+    }
+    payload = LeadCreate.model_validate(
+        {
+            "name": values.get("name"),
+            "phone": values.get("phone"),
+            "telegram_username": values.get("telegram_username") or values.get("telegram") or values.get("tg-nickname"),
+        }
+    )
+    phone, username = _prepare_contact(payload.phone, payload.telegram_username)
+    return {"name": payload.name, "phone": phone, "telegram_username": username}
+
+
+def _format_validation_error(item: Dict[str, Any]) -> str:
+    message = str(item["msg"]).removeprefix("Value error, ")
+    location = ".".join(map(str, item["loc"]))
+    return f"{location}: {message}" if location else message
+
+
+async def _insert_batch(batch: list[tuple[int, Dict[str, Any]]]) -> list[BulkRowResult]:
+    """Пишет пачку multi-row INSERT … RETURNING в одной транзакции."""
+    now = datetime.utcnow()
+    rows = [
+        {**values, "status": LeadStatus.pending, "created_at": now, "updated_at": now}
+        for _, values in batch
+    ]
+    # Порядок RETURNING не гарантирован (а sort_by_parameter_order на SQLite вставляет по строке),
+    # поэтому id сопоставляем со строками по значениям: одинаковые строки взаимозаменяемы.
+    statement = insert(Lead).returning(Lead.id, Lead.name, Lead.phone, Lead.telegram_username)
+    try:
+        async with get_async_session() as session:
+            returned = (await session.execute(statement, rows)).all()
+            await notify_pending_leads(session)
+            await session.commit()
+    except SQLAlchemyError:
+        logger.exception("Bulk insert of %s leads failed", len(batch))
+        return [
+            BulkRowResult(row=number, status="rejected", error="Не удалось сохранить строку в БД.")
+            for number, _ in batch
+        ]
+    ids: dict[tuple[Any, ...], list[int]] = {}
+    for lead_id, *key in returned:
+        ids.setdefault(tuple(key), []).append(lead_id)
+    return [
+        BulkRowResult(
+            row=number,
+            status="created",
+            id=ids[(values["name"], values["phone"], values["telegram_username"])].pop(),
+        )
+        for number, values in batch
+    ]
+
+
+def _encode_cursor(lead: Lead) -> str:
+    raw = f"{lead.created_at.isoformat()}|{lead.id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        created_at, lead_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|")
+        return datetime.fromisoformat(created_at), int(lead_id)
+    except (binascii.Error, UnicodeError, ValueError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Некорректный курсор пагинации.",
+        ) from None
 
 
 def _normalize_phone(value: str) -> str | None:
@@ -113,10 +231,88 @@ def _match_field(values: Dict[str, str], candidates: Iterable[str]) -> str | Non
     return None
 
 
+@router.get("", response_model=LeadPage)
+async def list_leads(
+    status_filter: list[LeadStatus] | None = Query(default=None, alias="status"),
+    created_from: datetime | None = None,
+    created_to: datetime | None = None,
+    cursor: str | None = None,
+    limit: int = Query(default=50, ge=1, le=500),
+) -> LeadPage:
+    """
+    Лиды от новых к старым. Пагинация keyset по (created_at, id): следующая страница
+    продолжает с курсора по индексу, без OFFSET, сколько бы строк ни было в таблице.
+    """
+    statement = select(Lead).order_by(Lead.created_at.desc(), Lead.id.desc()).limit(limit + 1)
+    if status_filter:
+        statement = statement.where(Lead.status.in_(status_filter))
+    if created_from:
+        statement = statement.where(Lead.created_at >= created_from)
+    if created_to:
+        statement = statement.where(Lead.created_at < created_to)
+    if cursor:
+        statement = statement.where(tuple_(Lead.created_at, Lead.id) < _decode_cursor(cursor))
+
+    async with get_async_session() as session:
+        leads = list((await session.exec(statement)).all())
+
+    has_more = len(leads) > limit
+    leads = leads[:limit]
+    return LeadPage(
+        items=[LeadRead.model_validate(lead) for lead in leads],
+        next_cursor=_encode_cursor(leads[-1]) if has_more else None,
+    )
+
+
 @router.post("", response_model=LeadRead, status_code=status.HTTP_201_CREATED)
-def create_lead(payload: LeadCreate) -> LeadRead:
+async def create_lead(
+    payload: LeadCreate,
+    response: Response,
+    idempotency_key: str | None = Header(default=None, max_length=255),
+) -> LeadRead:
     phone, username = _prepare_contact(payload.phone, payload.telegram_username)
-    return _persist_lead(payload.name, phone, username)
+    lead, created = await _persist_lead(payload.name, phone, username, idempotency_key=idempotency_key)
+    LEADS_INGESTED.labels(source="api", result="created" if created else "duplicate").inc()
+    if not created:
+        response.status_code = status.HTTP_200_OK
+    return lead
+
+
+@router.post("/bulk", response_model=BulkImportResult)
+async def create_leads_bulk(request: Request) -> BulkImportResult:
+    """
+    Массовый импорт: JSON-массив, NDJSON или CSV с колонками name, phone, telegram_username.
+    Тело разбирается потоково и пишется пачками; отклонённые строки попадают
+    в ответ с причиной и не мешают сохранить остальные.
+    """
+    results: list[BulkRowResult] = []
+    batch: list[tuple[int, Dict[str, Any]]] = []
+    try:
+        async for row in iter_rows(request.stream(), request.headers.get("content-type")):
+            if row.fields is None:
+                results.append(BulkRowResult(row=row.number, status="rejected", error=row.error))
+                continue
+            try:
+                batch.append((row.number, _bulk_values(row.fields)))
+            except ValidationError as exc:
+                error = "; ".join(_format_validation_error(item) for item in exc.errors())
+                results.append(BulkRowResult(row=row.number, status="rejected", error=error))
+            except HTTPException as exc:
+                results.append(BulkRowResult(row=row.number, status="rejected", error=str(exc.detail)))
+            if len(batch) >= get_settings().bulk_insert_batch_size:
+                results.extend(await _insert_batch(batch))
+                batch = []
+    except ImportFormatError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from None
+    if batch:
+        results.extend(await _insert_batch(batch))
+
+    results.sort(key=lambda result: result.row)
+    created = sum(1 for result in results if result.status == "created")
+    LEADS_INGESTED.labels(source="bulk", result="created").inc(created)
+    LEADS_INGESTED.labels(source="bulk", result="rejected").inc(len(results) - created)
+    logger.info("Bulk import: %s leads created, %s rows rejected", created, len(results) - created)
+    return BulkImportResult(created=created, rejected=len(results) - created, rows=results)
 
 
 @router.post("/webhooks/tilda", status_code=status.HTTP_200_OK)
@@ -124,50 +320,46 @@ async def create_lead_from_tilda(request: Request) -> dict[str, str]:
     """
     Принимаем любые данные, которые пришли — JSON, FORM, RAW — чтобы Tilda всегда проходила.
     """
-    try:
-        # 1. Попытка прочитать JSON
-        payload = await request.json()
-    except Exception:
-        try:
-            # 2. Попытка прочитать как form-data (Tilda часто шлет form-data)
-            form = await request.form()
-            payload = dict(form)
-        except Exception:
-            # 3. Если ничего не сработало — читаем "сырое" тело
-            raw = await request.body()
-            payload = raw.decode("utf-8", errors="ignore")
+    payload = await _read_payload(request)
 
     client_addr = request.client.host if request.client else "unknown"
-    logger.info(
-        "Tilda webhook (%s) payload accepted from %s: %s",
-        request.url.path,
-        client_addr,
-        payload,
-    )
+    logger.info("Tilda webhook (%s) payload accepted from %s", request.url.path, client_addr)
+    logger.debug("Tilda webhook payload: %s", payload)
 
     # ВСЕГДА возвращаем 200 OK
     return {"status": "accepted"}
 
+
+async def _read_payload(request: Request) -> Any:
+    """Разбирает тело один раз, способом по Content-Type; нераспознанное тело возвращает строкой."""
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type == "multipart/form-data":
+        try:
+            form = await request.form()
+            return dict(form)
+        except Exception:
+            # Нет python-multipart или битое тело — отдаём как есть.
+            pass
+    # urlencoded-форму вызывающий код разбирает сам через parse_qs.
+    raw = (await request.body()).decode("utf-8", errors="ignore")
+    if content_type == "application/json" or raw.lstrip().startswith(("{", "[")):
+        try:
+            return json.loads(raw)
+        except ValueError:
+            pass
+    return raw
+
+
 @router.post("/tilda", status_code=status.HTTP_200_OK)
-async def create_lead_from_tilda_any(request: Request) -> LeadRead:
+async def create_lead_from_tilda_any(request: Request) -> LeadRead | dict[str, str]:
     """
     Упрощённый вебхук для Tilda:
     - парсим только имя, телефон и Telegram-ник;
     - нормализуем контакты;
-    - создаём Lead в БД (статус pending);
+    - ставим заявку в очередь на запись (или сразу создаём Lead, если очередь выключена/заполнена);
     - всегда возвращаем 2xx, чтобы Tilda не ретраила.
     """
-    try:
-        payload: Any = await request.json()
-    except Exception:
-        try:
-            form = await request.form()
-            payload = dict(form)
-        except Exception:
-            raw = await request.body()
-            payload = raw.decode("utf-8", errors="ignore")
-
-    raw_payload = payload
+    payload = await _read_payload(request)
 
     # Приводим к простому словарю строк: ключи в нижнем регистре.
     fields: Dict[str, str] = {}
@@ -195,15 +387,23 @@ async def create_lead_from_tilda_any(request: Request) -> LeadRead:
 
     phone, username = _prepare_contact(phone, username)
 
-    lead = _persist_lead(name, phone, username)
-
+    # Tilda не умеет слать заголовки, но передаёт id отправки формы (tranid) — он и есть ключ повтора.
+    idempotency_key = request.headers.get("idempotency-key") or fields.get("tranid")
     client_addr = request.client.host if request.client else "unknown"
+    logger.debug("Tilda endpoint %s payload from %s: %s", request.url.path, client_addr, payload)
+
+    pending = PendingLead(name=name, phone=phone, telegram_username=username, idempotency_key=idempotency_key)
+    if get_settings().ingest_queue_enabled and await get_container().ingest_queue.submit(pending):
+        LEADS_INGESTED.labels(source="tilda", result="queued").inc()
+        return {"status": "queued"}
+
+    lead, created = await _persist_lead(name, phone, username, idempotency_key=idempotency_key)
+    LEADS_INGESTED.labels(source="tilda", result="created" if created else "duplicate").inc()
     logger.info(
-        "Tilda endpoint %s created lead %s from %s: %s",
+        "Tilda endpoint %s %s lead %s from %s",
         request.url.path,
+        "created" if created else "matched existing",
         lead.id,
         client_addr,
-        raw_payload,
     )
-
     return lead
@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import Literal
 
 from pydantic import BaseModel, Field, model_validator
 
@@ -28,3 +29,22 @@ class LeadRead(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class LeadPage(BaseModel):
+    items: list[LeadRead]
+    # Курсор следующей страницы; None — это последняя страница.
+    next_cursor: str | None = None
+
+
+class BulkRowResult(BaseModel):
+    row: int
+    status: Literal["created", "rejected"]
+    id: int | None = None
+    error: str | None = None
+
+
+class BulkImportResult(BaseModel):
+    created: int
+    rejected: int
+    rows: list[BulkRowResult]
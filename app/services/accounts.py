@@ -0,0 +1,138 @@
+"""
+Пул Telegram-аккаунтов для рассылки.
+
+У каждого аккаунта свой клиент, свой rate limiter и свои кэши пиров: access_hash
+пользователя у разных аккаунтов разный. Лид закрепляется за аккаунтом
+rendezvous-хэшированием среди доступных: если аккаунт ограничен или отключён,
+на другие аккаунты переезжают только его лиды, остальные остаются на местах.
+"""
+import hashlib
+import logging
+import time
+from typing import Iterable, Iterator
+
+from pyrogram import Client
+
+from ..config import get_settings
+from . import scheduler
+from .identity import IdentityCache
+from .metrics import REGISTRY, Gauge
+from .peers import PeerCache
+from .ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+ACCOUNT_AVAILABLE = Gauge("telegram_account_available", "1 if the Telegram account can send right now.", ("account",))
+
+
+class AccountUnavailable(RuntimeError):
+    """Аккаунт ограничен Telegram или отключён — лида нужно передать другому аккаунту."""
+
+
+class TelegramAccount:
+    def __init__(self, name: str, client: Client, *, primary: bool = False) -> None:
+        settings = get_settings()
+        self.name = name
+        self.client = client
+        self.primary = primary
+        # Основной аккаунт читает и пишет кэш без префикса — как до появления пула.
+        self.identity_cache = IdentityCache(namespace=None if primary else name)
+        self.peers = PeerCache(self.identity_cache, account=name)
+        self.rate_limiter = TokenBucket(
+            settings.telegram_rate_per_second,
+            settings.telegram_rate_burst,
+            max_rate=settings.telegram_max_rate_per_second,
+            weights=scheduler.rate_weights(),
+        )
+        self.limited_until = 0.0
+        self.disabled_reason: str | None = None
+
+    @property
+    def available(self) -> bool:
+        return self.disabled_reason is None and time.monotonic() >= self.limited_until
+
+    def limit(self, seconds: float, reason: str) -> None:
+        self.limited_until = max(self.limited_until, time.monotonic() + seconds)
+        logger.warning("Telegram account %s limited for %.0fs: %s", self.name, seconds, reason)
+
+    def disable(self, reason: str) -> None:
+        self.disabled_reason = reason
+        logger.error("Telegram account %s disabled: %s", self.name, reason)
+
+
+class AccountPool:
+    def __init__(self, accounts: Iterable[TelegramAccount]) -> None:
+        self._accounts = {account.name: account for account in accounts}
+        if not self._accounts:
+            raise ValueError("Account pool needs at least one account")
+        self._primary = next((account for account in self._accounts.values() if account.primary), None)
+        self._started: list[TelegramAccount] = []
+        REGISTRY.add_collector(self._collect_metrics)
+
+    @classmethod
+    def from_settings(cls, client: Client | None = None) -> "AccountPool":
+        """Основной аккаунт — TELEGRAM_SESSION_NAME (или переданный клиент), остальные — TELEGRAM_EXTRA_SESSIONS."""
+        settings = get_settings()
+        primary = client or Client(
+            settings.telegram_session_name,
+            api_id=settings.telegram_api_id,
+            api_hash=settings.telegram_api_hash,
+            bot_token=settings.telegram_bot_token,
+            workdir=settings.telegram_session_dir,
+        )
+        accounts = [TelegramAccount(settings.telegram_session_name, primary, primary=True)]
+        for name in settings.telegram_extra_sessions:
+            if name == settings.telegram_session_name:
+                continue
+            client = Client(
+                name,
+                api_id=settings.telegram_api_id,
+                api_hash=settings.telegram_api_hash,
+                workdir=settings.telegram_session_dir,
+            )
+            accounts.append(TelegramAccount(name, client))
+        return cls(accounts)
+
+    def __iter__(self) -> Iterator[TelegramAccount]:
+        return iter(self._accounts.values())
+
+    def __len__(self) -> int:
+        return len(self._accounts)
+
+    def get(self, name: str | None) -> TelegramAccount | None:
+        """Аккаунт-владелец лида; у лидов, созданных до пула, владельца нет — это основной аккаунт."""
+        if name is None:
+            return self._primary
+        return self._accounts.get(name)
+
+    def available(self) -> list[TelegramAccount]:
+        return [account for account in self._accounts.values() if account.available]
+
+    @staticmethod
+    def pick(lead_id: int, candidates: list[TelegramAccount]) -> TelegramAccount:
+        # Rendezvous hashing: у каждого лида свой порядок аккаунтов, берём первый доступный.
+        def weight(account: TelegramAccount) -> bytes:
+            return hashlib.blake2b(f"{account.name}:{lead_id}".encode("utf-8"), digest_size=8).digest()
+
+        return max(candidates, key=weight)
+
+    async def start(self) -> None:
+        for account in self._accounts.values():
+            try:
+                await account.client.start()
+            except Exception as exc:
+                logger.exception("Failed to start Telegram account %s", account.name)
+                account.disable(f"start failed: {exc!r}")
+                continue
+            self._started.append(account)
+        if not self.available():
+            raise RuntimeError("No Telegram account could be started")
+
+    async def stop(self) -> None:
+        for account in self._started:
+            await account.client.stop()
+        self._started.clear()
+
+    async def _collect_metrics(self) -> None:
+        for account in self._accounts.values():
+            ACCOUNT_AVAILABLE.labels(account=account.name).set(1 if account.available else 0)
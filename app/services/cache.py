@@ -0,0 +1,47 @@
+import time
+from collections import OrderedDict
+from typing import Generic, Hashable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+_MISSING = object()
+
+
+class LRUCache(Generic[K, V]):
+    """Небольшой in-process LRU с необязательным TTL на записи."""
+
+    def __init__(self, capacity: int, ttl: float | None = None) -> None:
+        self._capacity = max(capacity, 1)
+        self._ttl = ttl
+        self._items: OrderedDict[K, tuple[float, V]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: K) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key: K, default: V | None = None) -> V | None:
+        item = self._items.get(key)
+        if item is None:
+            return default
+        stored_at, value = item
+        if self._ttl is not None and time.monotonic() - stored_at > self._ttl:
+            del self._items[key]
+            return default
+        self._items.move_to_end(key)
+        return value
+
+    def set(self, key: K, value: V) -> None:
+        self._items[key] = (time.monotonic(), value)
+        self._items.move_to_end(key)
+        while len(self._items) > self._capacity:
+            self._items.popitem(last=False)
+
+    def pop(self, key: K) -> V | None:
+        item = self._items.pop(key, None)
+        return item[1] if item else None
+
+    def clear(self) -> None:
+        self._items.clear()
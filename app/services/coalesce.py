@@ -0,0 +1,77 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+K = TypeVar("K", bound=Hashable)
+T = TypeVar("T")
+
+
+@dataclass
+class _Burst(Generic[T]):
+    items: list[T] = field(default_factory=list)
+    task: asyncio.Task[None] | None = None
+    committing: bool = False
+
+
+class MessageCoalescer(Generic[K, T]):
+    """
+    Склеивает серию сообщений одного лида в один вызов обработчика.
+
+    Каждое новое сообщение перезапускает окно ожидания и отменяет ещё не
+    отправленный ответ на предыдущие — следующий запуск получит их все.
+    Обработчик вызывает `begin_commit()` перед отправкой и записью статуса:
+    после этого задача уже не отменяется, а новые сообщения ждут её завершения.
+    Поэтому по каждому ключу одновременно коммитит не больше одной задачи.
+    """
+
+    def __init__(
+        self,
+        window: float,
+        handler: Callable[[K, list[T], Callable[[], None]], Awaitable[None]],
+    ) -> None:
+        self._window = window
+        self._handler = handler
+        self._bursts: dict[K, _Burst[T]] = {}
+
+    def submit(self, key: K, item: T) -> None:
+        burst = self._bursts.setdefault(key, _Burst())
+        burst.items.append(item)
+        if burst.committing:
+            return
+        if burst.task and not burst.task.done():
+            burst.task.cancel()
+        burst.task = asyncio.create_task(self._run(key, burst))
+
+    async def close(self) -> None:
+        tasks = [burst.task for burst in self._bursts.values() if burst.task and not burst.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._bursts.clear()
+
+    async def _run(self, key: K, burst: _Burst[T]) -> None:
+        await asyncio.sleep(self._window)
+        items = list(burst.items)
+
+        def begin_commit() -> None:
+            burst.committing = True
+
+        try:
+            await self._handler(key, items, begin_commit)
+        except asyncio.CancelledError:
+            if burst.committing:
+                raise
+            # Пришло новое сообщение: его задача уже запланирована и обработает всё заново.
+            return
+        except Exception:
+            logger.exception("Failed to handle message burst for %s", key)
+
+        burst.committing = False
+        del burst.items[: len(items)]
+        if burst.items:
+            burst.task = asyncio.create_task(self._run(key, burst))
+        elif self._bursts.get(key) is burst:
+            del self._bursts[key]
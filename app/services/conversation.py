@@ -0,0 +1,131 @@
+"""
+История переписки с лидом для промпта ответа.
+
+Храним только живые реплики: серию сообщений лида и ответ модели. Шаблонные
+приветствие и напоминания не пишем — о них модель знает из инструкций. История
+ограничена бюджетом токенов: когда он превышен, ранние реплики сворачиваются
+в краткое содержание (Lead.conversation_summary) и удаляются, поэтому на лида
+в БД лежит не больше бюджета текста и читается он одним range-запросом.
+"""
+import logging
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+from sqlalchemy import delete, update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from ..config import get_settings
+from ..db import get_async_session
+from ..models import ConversationMessage, Lead
+
+logger = logging.getLogger(__name__)
+
+ROLE_LEAD = "lead"
+ROLE_ASSISTANT = "assistant"
+# Грубая оценка без токенизатора: для смеси кириллицы и латиницы около трёх символов на токен.
+CHARS_PER_TOKEN = 3
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+@dataclass
+class Turn:
+    role: str
+    text: str
+    id: int | None = None
+
+
+@dataclass
+class History:
+    summary: str | None = None
+    turns: list[Turn] = field(default_factory=list)
+
+    @property
+    def empty(self) -> bool:
+        return not self.summary and not self.turns
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.summary or "") + sum(estimate_tokens(turn.text) for turn in self.turns)
+
+
+class ConversationLog:
+    def __init__(self, budget_tokens: int | None = None) -> None:
+        self._budget = get_settings().conversation_history_tokens if budget_tokens is None else budget_tokens
+
+    @property
+    def enabled(self) -> bool:
+        return self._budget > 0
+
+    async def load(self, lead: Lead) -> History:
+        if not self.enabled:
+            return History()
+        async with get_async_session() as session:
+            rows = (
+                await session.exec(
+                    select(ConversationMessage)
+                    .where(ConversationMessage.lead_id == lead.id)
+                    .order_by(ConversationMessage.id)
+                )
+            ).all()
+        history = History(
+            summary=lead.conversation_summary,
+            turns=[Turn(role=row.role, text=row.text, id=row.id) for row in rows],
+        )
+        # Если прошлое сворачивание не удалось, в промпт всё равно идёт не больше бюджета.
+        while len(history.turns) > 1 and history.tokens > self._budget:
+            history.turns.pop(0)
+        return history
+
+    def add(self, session: AsyncSession, lead_id: int, role: str, text: str | None) -> None:
+        """Добавляет реплику в транзакцию вызывающего кода — вместе с записью статуса лида."""
+        if self.enabled and text:
+            session.add(ConversationMessage(lead_id=lead_id, role=role, text=text))
+
+    def needs_compaction(self, history: History, *texts: str | None) -> bool:
+        added = sum(estimate_tokens(text) for text in texts if text)
+        return self.enabled and history.tokens + added > self._budget
+
+    async def compact(
+        self,
+        lead_id: int,
+        summarize: Callable[[str | None, list[Turn]], Awaitable[str]],
+    ) -> None:
+        """
+        Сворачивает ранние реплики: в истории остаются последние, укладывающиеся
+        в половину бюджета, — чтобы не сворачивать заново после каждого ответа.
+        """
+        async with get_async_session() as session:
+            lead = await session.get(Lead, lead_id)
+            if lead is None:
+                return
+            rows = (
+                await session.exec(
+                    select(ConversationMessage)
+                    .where(ConversationMessage.lead_id == lead_id)
+                    .order_by(ConversationMessage.id)
+                )
+            ).all()
+        turns = [Turn(role=row.role, text=row.text, id=row.id) for row in rows]
+        kept_tokens = 0
+        split = len(turns)
+        while split > 0 and kept_tokens + estimate_tokens(turns[split - 1].text) <= self._budget // 2:
+            split -= 1
+            kept_tokens += estimate_tokens(turns[split].text)
+        dropped = turns[:split]
+        if not dropped:
+            return
+        summary = await summarize(lead.conversation_summary, dropped)
+        async with get_async_session() as session:
+            await session.execute(
+                delete(ConversationMessage).where(
+                    ConversationMessage.lead_id == lead_id,
+                    ConversationMessage.id <= dropped[-1].id,
+                )
+            )
+            await session.execute(update(Lead).where(Lead.id == lead_id).values(conversation_summary=summary))
+            await session.commit()
+        logger.info("Folded %s turns of lead %s into the conversation summary", len(dropped), lead_id)
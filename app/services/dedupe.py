@@ -0,0 +1,104 @@
+import hashlib
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, or_
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from ..config import get_settings
+from ..db import get_async_session
+from ..models import IdempotencyKey, Lead
+
+logger = logging.getLogger(__name__)
+
+# Просроченные ключи вычищаем не на каждую вставку, а раз в столько новых лидов.
+PURGE_EVERY = 200
+
+
+class LeadDeduplicator:
+    """
+    Защита от повторного создания лида: ключ идемпотентности (заголовок
+    Idempotency-Key или хэш нормализованной заявки) и поиск лида с тем же
+    телефоном или username в окне `window`. Оба поиска идут по индексам.
+    """
+
+    def __init__(self, *, key_ttl: timedelta | None = None, window: timedelta | None = None) -> None:
+        settings = get_settings()
+        self._key_ttl = key_ttl or timedelta(hours=settings.idempotency_key_ttl_hours)
+        self._window = window if window is not None else timedelta(hours=settings.lead_dedupe_window_hours)
+        self._inserts = 0
+
+    @staticmethod
+    def make_key(
+        name: str,
+        phone: str | None,
+        telegram_username: str | None,
+        *,
+        client_key: str | None = None,
+    ) -> str:
+        if client_key:
+            raw = f"client\x00{client_key.strip()}"
+        else:
+            raw = f"payload\x00{name.strip().lower()}\x00{phone or ''}\x00{(telegram_username or '').lower()}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def find(
+        self,
+        session: AsyncSession,
+        key: str,
+        phone: str | None,
+        telegram_username: str | None,
+    ) -> Lead | None:
+        now = datetime.utcnow()
+        lead = (
+            await session.exec(
+                select(Lead)
+                .join(IdempotencyKey, IdempotencyKey.lead_id == Lead.id)
+                .where(IdempotencyKey.key == key, IdempotencyKey.created_at >= now - self._key_ttl)
+            )
+        ).first()
+        if lead or not self._window:
+            return lead
+
+        contacts = []
+        if phone:
+            contacts.append(Lead.phone == phone)
+        if telegram_username:
+            contacts.append(Lead.telegram_username == telegram_username)
+        if not contacts:
+            return None
+        return (
+            await session.exec(
+                select(Lead)
+                .where(or_(*contacts), Lead.created_at >= now - self._window)
+                .order_by(Lead.created_at.desc())
+                .limit(1)
+            )
+        ).first()
+
+    async def remember(self, session: AsyncSession, key: str, lead_id: int) -> None:
+        """Добавляет ключ в транзакцию создания лида. Конфликт по ключу — гонка двух одинаковых запросов."""
+        # Просроченная запись с тем же ключом не должна мешать вставке.
+        await session.execute(
+            delete(IdempotencyKey).where(
+                IdempotencyKey.key == key,
+                IdempotencyKey.created_at < datetime.utcnow() - self._key_ttl,
+            )
+        )
+        session.add(IdempotencyKey(key=key, lead_id=lead_id))
+
+    async def after_insert(self) -> None:
+        self._inserts += 1
+        if self._inserts % PURGE_EVERY == 0:
+            await self.purge_expired()
+
+    async def purge_expired(self) -> int:
+        async with get_async_session() as session:
+            result = await session.execute(
+                delete(IdempotencyKey).where(IdempotencyKey.created_at < datetime.utcnow() - self._key_ttl)
+            )
+            await session.commit()
+        if result.rowcount:
+            logger.info("Purged %s expired idempotency keys", result.rowcount)
+        return result.rowcount
@@ -0,0 +1,164 @@
+"""
+Напоминания лидам, которые не ответили на приветствие.
+
+Расписание хранится в БД: у лида в awaiting_confirmation заполнен next_action_at,
+и частичный индекс по этой колонке служит очередью с приоритетом — ближайший срок
+читается одной записью индекса, просроченные лиды забираются одним range-запросом.
+Воркер держит один таймер до ближайшего срока, а не задачу на каждого лида, поэтому
+расписание переживает перезапуск и не зависит от числа открытых диалогов.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+
+from sqlalchemy import update
+from sqlmodel import select
+
+from ..config import get_settings
+from ..db import get_async_session
+from ..models import Lead
+
+logger = logging.getLogger(__name__)
+
+# Страховочный интервал: срок, назначенный другим воркером, заметим не позже чем через столько секунд.
+MAX_SLEEP_SECONDS = 300.0
+
+
+def reminder_count() -> int:
+    settings = get_settings()
+    return len(settings.follow_up_delays_hours) if settings.follow_up_templates else 0
+
+
+def reminder_text(step: int, name: str) -> str:
+    settings = get_settings()
+    templates = settings.follow_up_templates
+    template = templates[min(step, len(templates) - 1)]
+    return template.format(name=name, calendly_link=settings.calendly_link)
+
+
+def next_action_at(step: int, now: datetime | None = None) -> datetime | None:
+    """
+    Срок следующего действия, когда отправлено `step` напоминаний: очередное
+    напоминание, после последнего — закрытие лида. None — больше ничего не делаем.
+    """
+    settings = get_settings()
+    if not settings.follow_up_enabled:
+        return None
+    now = now or datetime.utcnow()
+    if step < reminder_count():
+        return now + timedelta(hours=settings.follow_up_delays_hours[step])
+    if step == reminder_count() and settings.follow_up_expire_hours:
+        return now + timedelta(hours=settings.follow_up_expire_hours)
+    return None
+
+
+class FollowUpScheduler:
+    """
+    Забирает лидов с наступившим next_action_at и передаёт их обработчику.
+
+    Забранному лиду срок сдвигается на `lease_seconds` вперёд: если обработчик
+    упал или воркер перезапустился, лид снова станет просроченным и его подберёт
+    любой воркер. Обработчик сам записывает следующий срок. `admit` урезает пачку
+    (или придерживает её), пока очередь напоминаний не разойдётся.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Lead], Awaitable[None]],
+        *,
+        admit: Callable[[int], Awaitable[int]] | None = None,
+        batch_size: int | None = None,
+        lease_seconds: int | None = None,
+    ) -> None:
+        settings = get_settings()
+        self._handler = handler
+        self._admit = admit
+        self._batch_size = batch_size or settings.follow_up_batch_size
+        self._lease = timedelta(seconds=lease_seconds or settings.lead_lease_seconds)
+        self._wakeup = asyncio.Event()
+        self._sleep_until: datetime | None = None
+        self._task: asyncio.Task[None] | None = None
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def notify(self, due_at: datetime) -> None:
+        """Новый срок раньше текущего таймера — будим цикл, чтобы он пересчитал ожидание."""
+        if self._sleep_until is None or due_at < self._sleep_until:
+            self._wakeup.set()
+
+    async def run_due(self) -> int:
+        limit = await self._admit(self._batch_size) if self._admit else self._batch_size
+        leads = await self._claim_due(limit)
+        results = await asyncio.gather(*(self._handler(lead) for lead in leads), return_exceptions=True)
+        for lead, result in zip(leads, results):
+            if isinstance(result, Exception):
+                # Срок уже сдвинут на время аренды — повторим позже.
+                logger.error("Follow-up for lead %s failed: %r", lead.id, result)
+        return len(leads)
+
+    async def _run(self) -> None:
+        while True:
+            self._sleep_until = None
+            self._wakeup.clear()
+            try:
+                if await self.run_due() >= self._batch_size:
+                    continue
+                due_at = await self._next_due_at()
+            except Exception:
+                logger.exception("Follow-up scheduler iteration failed")
+                due_at = None
+            now = datetime.utcnow()
+            delay = MAX_SLEEP_SECONDS
+            if due_at is not None:
+                delay = min(max((due_at - now).total_seconds(), 0.0), MAX_SLEEP_SECONDS)
+            self._sleep_until = now + timedelta(seconds=delay)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    @staticmethod
+    async def _next_due_at() -> datetime | None:
+        async with get_async_session() as session:
+            return (
+                await session.exec(
+                    select(Lead.next_action_at)
+                    .where(Lead.next_action_at.is_not(None))
+                    .order_by(Lead.next_action_at)
+                    .limit(1)
+                )
+            ).first()
+
+    async def _claim_due(self, limit: int) -> list[Lead]:
+        now = datetime.utcnow()
+        due = (
+            select(Lead.id)
+            .where(Lead.next_action_at <= now)
+            .order_by(Lead.next_action_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        statement = (
+            update(Lead)
+            .where(Lead.id.in_(due), Lead.next_action_at <= now)
+            .values(next_action_at=now + self._lease)
+            .returning(Lead)
+            .execution_options(synchronize_session=False)
+        )
+        async with get_async_session() as session:
+            leads = list((await session.execute(statement)).scalars().all())
+            await session.commit()
+        return leads
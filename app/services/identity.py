@@ -0,0 +1,108 @@
+import re
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Iterable, Mapping
+
+from sqlalchemy import ColumnElement
+from sqlmodel import select
+
+from ..config import get_settings
+from ..db import get_async_session, upsert
+from ..models import TelegramIdentity
+
+
+
+@dataclass(frozen=True)
+class ResolvedUser:
+    id: int
+    access_hash: int | None = None
+    username: str | None = None
+
+    @classmethod
+    def from_telegram(cls, user: Any) -> "ResolvedUser":
+        # Подходит и для raw.types.User (import_contacts), и для pyrogram.types.User (get_users).
+        return cls(
+            id=user.id,
+            access_hash=getattr(user, "access_hash", None),
+            username=getattr(user, "username", None),
+        )
+
+
+def phone_key(phone: str) -> str:
+    return "phone:" + re.sub(r"\D", "", phone)
+
+
+def username_key(username: str) -> str:
+    return "username:" + username.strip().lstrip("@").lower()
+
+
+class IdentityCache:
+    """Постоянный кэш резолва контактов, чтобы повторные лиды не вызывали import_contacts/get_users."""
+
+    def __init__(
+        self,
+        ttl: timedelta | None = None,
+        negative_ttl: timedelta | None = None,
+        *,
+        namespace: str | None = None,
+    ) -> None:
+        settings = get_settings()
+        self._ttl = ttl or timedelta(hours=settings.identity_cache_ttl_hours)
+        self._negative_ttl = negative_ttl or timedelta(hours=settings.identity_negative_ttl_hours)
+        # access_hash действителен только для аккаунта, который его получил: у каждого аккаунта
+        # пула свои ключи «аккаунт/ключ», основной аккаунт хранит ключи без префикса.
+        self._prefix = f"{namespace}/" if namespace else ""
+
+    def owns(self) -> ColumnElement[bool]:
+        """Условие на строки telegramidentity, принадлежащие этому кэшу."""
+        if self._prefix:
+            return TelegramIdentity.key.startswith(self._prefix)
+        return ~TelegramIdentity.key.contains("/")
+
+    async def get_many(self, keys: Iterable[str]) -> dict[str, ResolvedUser | None]:
+        """Возвращает свежие записи; значение None — контакт точно не найден в Telegram."""
+        stored_keys = {self._prefix + key: key for key in keys}
+        if not stored_keys:
+            return {}
+        now = datetime.utcnow()
+        async with get_async_session() as session:
+            rows = (
+                await session.exec(select(TelegramIdentity).where(TelegramIdentity.key.in_(list(stored_keys))))
+            ).all()
+        found: dict[str, ResolvedUser | None] = {}
+        for row in rows:
+            key = stored_keys[row.key]
+            if row.telegram_user_id is None:
+                if now - row.resolved_at <= self._negative_ttl:
+                    found[key] = None
+                continue
+            if now - row.resolved_at <= self._ttl:
+                found[key] = ResolvedUser(
+                    id=row.telegram_user_id,
+                    access_hash=row.telegram_access_hash,
+                    username=row.telegram_username,
+                )
+        return found
+
+    async def get(self, key: str) -> tuple[bool, ResolvedUser | None]:
+        found = await self.get_many([key])
+        return key in found, found.get(key)
+
+    async def put_many(self, entries: Mapping[str, ResolvedUser | None]) -> None:
+        if not entries:
+            return
+        now = datetime.utcnow()
+        rows = [
+            {
+                "key": self._prefix + key,
+                "telegram_user_id": user.id if user else None,
+                "telegram_access_hash": user.access_hash if user else None,
+                "telegram_username": user.username if user else None,
+                "resolved_at": now,
+            }
+            for key, user in entries.items()
+        ]
+        async with get_async_session() as session:
+            # Один upsert: воркер, резолвящий те же контакты параллельно, не уронит запись на ключе.
+            await session.execute(upsert(session, TelegramIdentity, rows, keys=["key"]))
+            await session.commit()
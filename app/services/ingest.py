@@ -0,0 +1,302 @@
+"""
+Отложенная запись лидов из вебхуков (write-behind).
+
+Вебхук проверяет заявку, кладёт её в ограниченную очередь и отвечает, как только
+заявка сохранена надёжно. Фоновая задача забирает заявки пачками (по размеру или
+по таймеру) и пишет каждую пачку одной транзакцией. Если задан спул, заявка
+сначала дописывается в файл процесса и синхронизируется на диск — после этого
+вебхук отвечает сразу, а пачка, которую не удалось записать, повторяется, пока
+БД не поднимется. Без спула вебхук ждёт коммита своей пачки. Спулы упавших
+процессов подхватываются при старте; дубли при этом отсекает LeadDeduplicator.
+"""
+import asyncio
+import fcntl
+import glob
+import json
+import logging
+import os
+import re
+import uuid
+from contextlib import suppress
+from dataclasses import asdict, dataclass
+from typing import IO
+
+from sqlalchemy.exc import IntegrityError
+
+from ..config import get_settings
+from ..db import get_async_session
+from ..models import Lead
+from .dedupe import LeadDeduplicator
+from .metrics import Gauge, Histogram
+from .notify import notify_pending_leads
+
+logger = logging.getLogger(__name__)
+
+# Попыток записи пачки, прежде чем вернуть заявки без спула на синхронный путь
+# (со спулом — прежде чем при остановке оставить их в файле до следующего старта).
+WRITE_ATTEMPTS = 3
+# Потолок паузы между повторами записи пачки, секунды.
+WRITE_RETRY_MAX_DELAY = 30.0
+
+QUEUE_DEPTH = Gauge("lead_ingest_queue_depth", "Webhook leads waiting in the write-behind queue.")
+FLUSH_SECONDS = Histogram("lead_ingest_flush_seconds", "Duration of one group commit of queued leads.")
+
+
+@dataclass
+class PendingLead:
+    name: str
+    phone: str | None
+    telegram_username: str | None
+    idempotency_key: str | None = None
+
+
+# Заявка и future вебхука, который ждёт коммита (без спула); None — ответ уже отдан.
+_Entry = tuple[PendingLead, asyncio.Future[bool] | None]
+
+
+class LeadIngestQueue:
+    def __init__(
+        self,
+        deduplicator: LeadDeduplicator,
+        *,
+        max_size: int | None = None,
+        batch_size: int | None = None,
+        flush_interval: float | None = None,
+        spool_path: str | None = None,
+    ) -> None:
+        settings = get_settings()
+        self._deduplicator = deduplicator
+        self._queue: asyncio.Queue[_Entry | None] = asyncio.Queue(max_size or settings.ingest_queue_size)
+        self._batch_size = batch_size or settings.ingest_batch_size
+        self._flush_interval = flush_interval if flush_interval is not None else settings.ingest_flush_interval
+        self._spool_base = spool_path if spool_path is not None else settings.ingest_spool_path
+        self._spool: IO[str] | None = None
+        # Спулы упавших процессов: держим под блокировкой, пока их заявки не записаны.
+        self._orphans: list[IO[str]] = []
+        # Пачку бросили при остановке — спул не очищаем, его подхватит следующий старт.
+        self._spool_dirty = False
+        self._stopping = False
+        self._task: asyncio.Task[None] | None = None
+        QUEUE_DEPTH.set_function(self._queue.qsize)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._spool_dirty = False
+        self._stopping = False
+        backlog: list[PendingLead] = []
+        if self._spool_base:
+            # Свой файл у каждого процесса: воркеры uvicorn не пишут в один спул.
+            path = f"{self._spool_base}.{os.getpid()}-{uuid.uuid4().hex[:8]}"
+            self._spool = open(path, "a", encoding="utf-8")
+            fcntl.flock(self._spool, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            backlog = self._adopt_orphans()
+        self._task = asyncio.create_task(self._run(backlog))
+
+    async def stop(self) -> None:
+        if not self.running:
+            return
+        assert self._task is not None
+        self._stopping = True
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        if self._spool:
+            path = self._spool.name
+            self._spool.close()
+            self._spool = None
+            if not self._spool_dirty:
+                os.unlink(path)
+        for orphan in self._orphans:
+            orphan.close()
+        self._orphans = []
+
+    async def submit(self, item: PendingLead) -> bool:
+        """
+        Ставит заявку в очередь и возвращает True, когда она сохранена надёжно: в спуле
+        на диске или (без спула) в БД. False — очередь заполнена, не запущена или пачку
+        записать не удалось: пишите синхронно.
+        """
+        if not self.running or self._queue.full():
+            return False
+        if self._spool:
+            self._spool.write(json.dumps(asdict(item), ensure_ascii=False) + "\n")
+            self._spool.flush()
+            self._queue.put_nowait((item, None))
+            await asyncio.to_thread(os.fsync, self._spool.fileno())
+            return True
+        future: asyncio.Future[bool] = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((item, future))
+        return await future
+
+    async def _run(self, backlog: list[PendingLead]) -> None:
+        if backlog:
+            logger.warning("Replaying %s leads from orphaned ingest spools", len(backlog))
+            replayed = True
+            for start in range(0, len(backlog), self._batch_size):
+                if not await self._flush([(item, None) for item in backlog[start:start + self._batch_size]]):
+                    replayed = False
+                    break
+            if replayed:
+                self._release_orphans()
+        loop = asyncio.get_running_loop()
+        while True:
+            entry = await self._queue.get()
+            if entry is None:
+                return
+            batch = [entry]
+            stopping = False
+            deadline = loop.time() + self._flush_interval
+            while len(batch) < self._batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    next_entry = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if next_entry is None:
+                    stopping = True
+                    break
+                batch.append(next_entry)
+            await self._flush(batch)
+            if stopping:
+                await self._drain()
+                return
+
+    async def _drain(self) -> None:
+        batch: list[_Entry] = []
+        while not self._queue.empty():
+            entry = self._queue.get_nowait()
+            if entry is not None:
+                batch.append(entry)
+        for start in range(0, len(batch), self._batch_size):
+            await self._flush(batch[start:start + self._batch_size])
+
+    async def _flush(self, batch: list[_Entry]) -> bool:
+        if self._stopping and self._spool_dirty:
+            # БД не ответила уже при остановке: остальное тоже оставляем в спуле.
+            return self._give_up(batch)
+        items = [item for item, _ in batch]
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                with FLUSH_SECONDS.time():
+                    created = await self._write(items)
+                break
+            except Exception:
+                logger.exception("Failed to write %s queued leads (attempt %s)", len(batch), attempt)
+            if attempt >= WRITE_ATTEMPTS and (self._spool is None or self._stopping):
+                return self._give_up(batch)
+            # Со спулом заявки уже подтверждены: повторяем, пока БД не поднимется.
+            await asyncio.sleep(min(WRITE_RETRY_MAX_DELAY, 2 ** (attempt - 1)))
+        logger.debug("Group commit: %s leads queued, %s created", len(batch), created)
+        for _, future in batch:
+            if future is not None and not future.done():
+                future.set_result(True)
+        if self._queue.empty():
+            self._truncate_spool()
+        return True
+
+    def _give_up(self, batch: list[_Entry]) -> bool:
+        if self._spool is None:
+            # Ответа вебхуку ещё не было: он запишет заявку синхронно или вернёт ошибку.
+            logger.error("Returning %s queued leads to the synchronous path", len(batch))
+            for _, future in batch:
+                if future is not None and not future.done():
+                    future.set_result(False)
+        else:
+            self._spool_dirty = True
+            logger.error("%s queued leads kept in the spool until the next start", len(batch))
+        return False
+
+    def _truncate_spool(self) -> None:
+        # Очередь пуста — всё, что было в спуле, уже в БД.
+        if self._spool and not self._spool_dirty:
+            self._spool.seek(0)
+            self._spool.truncate()
+
+    async def _write(self, batch: list[PendingLead]) -> int:
+        try:
+            return await self._insert(batch)
+        except IntegrityError:
+            if len(batch) == 1:
+                # Ключ только что занял такой же запрос, прошедший синхронным путём.
+                return 0
+            # Конфликт ключа с параллельным запросом: пишем по одной, дубли отсеются.
+            return sum([await self._write([item]) for item in batch])
+
+    async def _insert(self, batch: list[PendingLead]) -> int:
+        created: list[tuple[str, Lead]] = []
+        seen: set[str] = set()
+        async with get_async_session() as session:
+            for item in batch:
+                key = self._deduplicator.make_key(
+                    item.name,
+                    item.phone,
+                    item.telegram_username,
+                    client_key=item.idempotency_key,
+                )
+                if key in seen:
+                    continue
+                seen.add(key)
+                if await self._deduplicator.find(session, key, item.phone, item.telegram_username):
+                    continue
+                lead = Lead(name=item.name, phone=item.phone, telegram_username=item.telegram_username)
+                session.add(lead)
+                created.append((key, lead))
+            if not created:
+                return 0
+            await session.flush()
+            for key, lead in created:
+                await self._deduplicator.remember(session, key, lead.id)
+            await notify_pending_leads(session)
+            await session.commit()
+        for _ in created:
+            await self._deduplicator.after_insert()
+        return len(created)
+
+    def _adopt_orphans(self) -> list[PendingLead]:
+        """Заявки из спулов завершившихся процессов; живой процесс держит свой файл под блокировкой."""
+        assert self._spool_base and self._spool
+        prefix = self._spool_base + "."
+        paths = [
+            path
+            for path in glob.glob(glob.escape(prefix) + "*")
+            if re.fullmatch(r"\d+-[0-9a-f]{8}", path[len(prefix):]) and path != self._spool.name
+        ]
+        if os.path.exists(self._spool_base):
+            # Единый спул прежних версий.
+            paths.append(self._spool_base)
+        items: list[PendingLead] = []
+        for path in sorted(paths):
+            try:
+                spool = open(path, "r+", encoding="utf-8")
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(spool, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                spool.close()
+                continue
+            for line in spool:
+                try:
+                    items.append(PendingLead(**json.loads(line)))
+                except (ValueError, TypeError):
+                    logger.warning("Skipping malformed spool line: %r", line)
+            self._orphans.append(spool)
+        return items
+
+    def _release_orphans(self) -> None:
+        # Заявки записаны. Файл сначала опустошаем: процесс, открывший его до unlink, ничего не повторит.
+        for orphan in self._orphans:
+            orphan.truncate(0)
+            with suppress(FileNotFoundError):
+                os.unlink(orphan.name)
+            orphan.close()
+        self._orphans = []
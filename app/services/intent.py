@@ -0,0 +1,257 @@
+"""
+Локальный классификатор намерений лида.
+
+Шаблоны собраны в автоматы Ахо — Корасик, которые за один проход находят
+совпадения: целые слова — в застемленном тексте, префиксы — в исходных
+нормализованных словах, чтобы стеммер не отрезал часть префикса. Отрицание
+(«не интересно») переворачивает согласие в отказ. На выходе — ярлык
+и уверенность; при низкой уверенности вызывающий код идёт в LLM.
+"""
+import re
+from bisect import bisect_right
+from collections import deque
+from dataclasses import dataclass, field
+from enum import Enum
+
+
+class IntentLabel(str, Enum):
+    accept = "accept"
+    reject = "reject"
+    question = "question"
+    ambiguous = "ambiguous"
+
+
+@dataclass(frozen=True)
+class IntentResult:
+    label: IntentLabel
+    confidence: float
+    scores: dict[IntentLabel, float] = field(default_factory=dict)
+
+
+# Шаблон: слова через пробел; "*" в конце — совпадение по префиксу последнего слова.
+# Шаблоны с префиксом сравниваются с исходными словами сообщения, без стемминга.
+ACCEPT_PATTERNS: dict[str, float] = {
+    "да": 1.0,
+    "ага": 0.8,
+    "угу": 0.8,
+    "дава*": 1.0,
+    "конечно": 1.0,
+    "готов*": 1.0,
+    "соглас*": 1.0,
+    "ок": 0.8,
+    "окей": 0.8,
+    "хорошо": 0.6,
+    "поехали": 1.0,
+    "интерес*": 0.8,
+    "актуал*": 0.8,
+    "оставлял*": 0.6,
+    "удобно": 0.6,
+    "подходит": 0.8,
+    "записал*": 0.8,
+    "выбрал*": 0.6,
+    "не против": 1.2,
+}
+REJECT_PATTERNS: dict[str, float] = {
+    "нет": 1.0,
+    "неинтерес*": 1.2,
+    "не надо": 1.2,
+    "не нуж*": 1.2,
+    "ненуж*": 1.0,
+    "не пиш*": 1.5,
+    "не беспокой*": 1.5,
+    "ошибк*": 1.0,
+    "ошиб*": 0.8,
+    "не оставлял*": 1.5,
+    "спам*": 1.5,
+    "неактуал*": 1.2,
+    "отказ*": 1.0,
+    "отпис*": 1.2,
+    "отпиш*": 1.2,
+    "уже нашли": 1.2,
+    "передумал*": 1.2,
+}
+QUESTION_PATTERNS: dict[str, float] = {
+    "что": 0.6,
+    "как": 0.6,
+    "когда": 0.8,
+    "какие": 0.8,
+    "какая": 0.8,
+    "какой": 0.8,
+    "сколько": 1.0,
+    "стоимост*": 1.0,
+    "цен*": 0.8,
+    "можно": 0.6,
+    "могу": 0.6,
+    "чем": 0.6,
+    "где": 0.8,
+    "почему": 0.8,
+    "зачем": 0.8,
+    "календар*": 1.0,
+    "запис*": 0.6,
+    "не получа*": 1.2,
+    "не могу": 1.0,
+    "расскаж*": 0.8,
+    "подробн*": 0.6,
+}
+QUESTION_MARK_WEIGHT = 1.0
+NEGATIONS = frozenset({"не", "ни", "неа"})
+NEGATION_WINDOW = 2
+# Чем больше prior, тем больше весов нужно набрать для уверенного ответа.
+CONFIDENCE_PRIOR = 0.25
+
+_ENDINGS = tuple(
+    sorted(
+        {
+            "иями", "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими",
+            "ых", "их", "ую", "юю", "ая", "яя", "ое", "ее", "ые", "ие", "ой", "ей", "ий", "ый",
+            "ом", "ем", "ам", "ям", "ах", "ях", "ов", "ев",
+            "ешь", "ете", "ишь", "ите", "ает", "яет", "ают", "яют", "ует", "уют",
+            "ет", "ит", "ут", "ют", "ат", "ят",
+            "ться", "тся", "ть", "ся", "сь",
+            "ен", "на", "но", "ны",
+            "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+        },
+        key=len,
+        reverse=True,
+    )
+)
+_MIN_STEM = 3
+_TOKEN_RE = re.compile(r"[a-zа-я0-9]+")
+
+
+def stem(word: str) -> str:
+    """Лёгкий стеммер: отрезает одно самое длинное окончание, оставляя основу не короче 3 букв."""
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= _MIN_STEM:
+            return word[: -len(ending)]
+    return word
+
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN_RE.findall(text.lower().replace("ё", "е"))
+
+
+class _Automaton:
+    """Ахо — Корасик над символами; payload возвращается для каждого найденного шаблона."""
+
+    def __init__(self) -> None:
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[list[tuple[int, object]]] = [[]]
+
+    def add(self, pattern: str, payload: object) -> None:
+        node = 0
+        for char in pattern:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = next_node
+        self._out[node].append((len(pattern), payload))
+
+    def build(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0) if node else 0
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def find(self, text: str) -> list[tuple[int, int, object]]:
+        """Возвращает (start, end, payload) всех совпадений."""
+        matches: list[tuple[int, int, object]] = []
+        node = 0
+        for index, char in enumerate(text):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            for length, payload in self._out[node]:
+                matches.append((index + 1 - length, index + 1, payload))
+        return matches
+
+
+@dataclass(frozen=True)
+class _Pattern:
+    label: IntentLabel
+    weight: float
+    negated: bool
+    words: int
+
+
+class IntentClassifier:
+    def __init__(
+        self,
+        patterns: dict[IntentLabel, dict[str, float]] | None = None,
+        question_mark_weight: float = QUESTION_MARK_WEIGHT,
+    ) -> None:
+        patterns = patterns or {
+            IntentLabel.accept: ACCEPT_PATTERNS,
+            IntentLabel.reject: REJECT_PATTERNS,
+            IntentLabel.question: QUESTION_PATTERNS,
+        }
+        self._question_mark_weight = question_mark_weight
+        # Целые слова ищем среди основ, префиксы — в исходных словах.
+        self._words = _Automaton()
+        self._prefixes = _Automaton()
+        for label, entries in patterns.items():
+            for raw_pattern, weight in entries.items():
+                words = tokenize(raw_pattern.rstrip("*"))
+                pattern = _Pattern(label, weight, negated=words[0] in NEGATIONS, words=len(words))
+                if raw_pattern.endswith("*"):
+                    self._prefixes.add(self._compile_pattern(words, prefix=True), pattern)
+                else:
+                    self._words.add(self._compile_pattern([stem(word) for word in words]), pattern)
+        self._words.build()
+        self._prefixes.build()
+
+    @staticmethod
+    def _compile_pattern(words: list[str], *, prefix: bool = False) -> str:
+        # Пробелы кодируют границы слов: " да " — целое слово, " интерес" — префикс.
+        return " " + " ".join(words) + ("" if prefix else " ")
+
+    def classify(self, message: str) -> IntentResult:
+        tokens = tokenize(message or "")
+        scores = {label: 0.0 for label in IntentLabel if label != IntentLabel.ambiguous}
+        if "?" in (message or ""):
+            scores[IntentLabel.question] += self._question_mark_weight
+        if not tokens and not any(scores.values()):
+            return IntentResult(IntentLabel.ambiguous, 0.0, scores)
+
+        stems = [stem(token) for token in tokens]
+        # Совпадения обоих автоматов приводим к диапазонам слов: (первое слово, слов, символов, шаблон).
+        matches: list[tuple[int, int, int, _Pattern]] = []
+        for automaton, words in ((self._words, stems), (self._prefixes, tokens)):
+            text = " " + " ".join(words) + " "
+            word_starts = [index for index, char in enumerate(text) if char == " "]
+            for start, end, pattern in automaton.find(text):
+                assert isinstance(pattern, _Pattern)
+                matches.append((bisect_right(word_starts, start) - 1, pattern.words, end - start, pattern))
+
+        matches.sort(key=lambda match: (-match[1], -match[2]))
+        kept: list[tuple[int, int]] = []
+        for word_index, length, _, pattern in matches:
+            # Более длинный шаблон («не интересно») поглощает вложенный («интересно»).
+            last = word_index + length
+            if any(word_index >= kept_start and last <= kept_end for kept_start, kept_end in kept):
+                continue
+            kept.append((word_index, last))
+            label = pattern.label
+            if label == IntentLabel.accept and not pattern.negated:
+                window = stems[max(0, word_index - NEGATION_WINDOW):word_index]
+                if any(word in NEGATIONS for word in window):
+                    label = IntentLabel.reject
+            scores[label] += pattern.weight
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        (top_label, top_score), (_, second_score) = ranked[0], ranked[1]
+        if top_score <= 0:
+            return IntentResult(IntentLabel.ambiguous, 0.0, scores)
+        confidence = (top_score - second_score) / (top_score + CONFIDENCE_PRIOR)
+        return IntentResult(top_label, round(confidence, 4), scores)
@@ -0,0 +1,122 @@
+"""
+Пакетная классификация намерений через OpenAI.
+
+Сообщения, которые не распознал локальный классификатор, в час пик приходят
+десятками одновременно, и каждое платит полную цену запроса: инструкции,
+сетевой круг, место в лимите запросов в минуту. IntentBatcher копит их до
+INTENT_BATCH_WINDOW секунд или до INTENT_BATCH_SIZE штук и спрашивает модель
+один раз со structured output — ярлык для каждого id. Сообщения, ярлык которых
+не пришёл или не разобрался, классифицируются поодиночке.
+"""
+import asyncio
+import json
+import logging
+from typing import Awaitable, Callable
+
+from ..config import get_settings
+from .llm_gateway import LLMUnavailableError
+from .metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+INTENT_BATCH_SIZE = Histogram(
+    "intent_batch_size",
+    "Messages classified by one batched OpenAI request.",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+INTENT_BATCH_FALLBACKS = Counter(
+    "intent_batch_fallbacks_total",
+    "Messages of a batch classified one by one because the batched reply had no usable label.",
+    ("reason",),
+)
+
+
+def parse_labels(raw: str, size: int) -> dict[int, str]:
+    """Ярлыки из ответа {"labels": [{"id": 0, "label": "accept"}, ...]}; чужие id и мусор отбрасываем."""
+    labels: dict[int, str] = {}
+    for item in json.loads(raw)["labels"]:
+        index, label = item.get("id"), item.get("label")
+        if isinstance(index, int) and 0 <= index < size and isinstance(label, str):
+            labels[index] = label.strip().lower()
+    return labels
+
+
+class IntentBatcher:
+    def __init__(
+        self,
+        classify_batch: Callable[[list[str]], Awaitable[str]],
+        classify_one: Callable[[str], Awaitable[str]],
+        *,
+        max_size: int | None = None,
+        window: float | None = None,
+    ) -> None:
+        settings = get_settings()
+        self._classify_batch = classify_batch
+        self._classify_one = classify_one
+        self._max_size = max_size or settings.intent_batch_size
+        self._window = window if window is not None else settings.intent_batch_window
+        self._pending: list[tuple[str, asyncio.Future[str]]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task[None]] = set()
+
+    async def classify(self, message: str) -> str:
+        """Сырой ярлык модели для сообщения; LLMUnavailableError — как у одиночного запроса."""
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future[str] = loop.create_future()
+        self._pending.append((message, future))
+        if len(self._pending) >= self._max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self._window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # Отменённые ожидания (лид дописал сообщение) в запрос не берём.
+        batch = [(message, future) for message, future in self._pending if not future.done()]
+        self._pending = []
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list[tuple[str, asyncio.Future[str]]]) -> None:
+        INTENT_BATCH_SIZE.observe(len(batch))
+        if len(batch) == 1:
+            await self._resolve_one(*batch[0])
+            return
+        labels: dict[int, str] = {}
+        try:
+            labels = parse_labels(await self._classify_batch([message for message, _ in batch]), len(batch))
+        except LLMUnavailableError as exc:
+            # Поодиночке тоже не выйдет: вызывающие откатятся к локальному ярлыку.
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        except Exception as exc:
+            logger.warning("Batched intent classification of %s messages failed: %r", len(batch), exc)
+            INTENT_BATCH_FALLBACKS.labels(reason="error").inc(len(batch))
+        leftovers = []
+        for index, (message, future) in enumerate(batch):
+            if future.done():
+                continue
+            if index in labels:
+                future.set_result(labels[index])
+            else:
+                leftovers.append((message, future))
+        if labels and leftovers:
+            INTENT_BATCH_FALLBACKS.labels(reason="missing").inc(len(leftovers))
+        await asyncio.gather(*(self._resolve_one(message, future) for message, future in leftovers))
+
+    async def _resolve_one(self, message: str, future: asyncio.Future[str]) -> None:
+        try:
+            result = await self._classify_one(message)
+        except Exception as exc:
+            if not future.done():
+                future.set_exception(exc)
+            return
+        if not future.done():
+            future.set_result(result)
@@ -0,0 +1,178 @@
+"""
+Потоковый разбор тела массового импорта лидов: JSON-массив, NDJSON или CSV.
+
+Тело читается по чанкам, записи отдаются по одной — весь файл в памяти
+не держим. Ошибка в отдельной строке не прерывает разбор остальных.
+"""
+import codecs
+import csv
+import json
+from dataclasses import dataclass
+from typing import Any, AsyncIterator
+
+FORMAT_JSON = "json"
+FORMAT_NDJSON = "ndjson"
+FORMAT_CSV = "csv"
+
+CONTENT_TYPES = {
+    "application/json": FORMAT_JSON,
+    "application/x-ndjson": FORMAT_NDJSON,
+    "application/ndjson": FORMAT_NDJSON,
+    "application/jsonl": FORMAT_NDJSON,
+    "text/csv": FORMAT_CSV,
+}
+
+
+class ImportFormatError(ValueError):
+    """Тело целиком не разбирается в заявленном формате."""
+
+
+@dataclass
+class ImportRow:
+    # Номер записи с единицы (для CSV — без строки заголовка).
+    number: int
+    fields: dict[str, Any] | None
+    error: str | None = None
+
+
+def detect_format(content_type: str | None, head: str) -> str:
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type in CONTENT_TYPES:
+        return CONTENT_TYPES[media_type]
+    first = head.lstrip()[:1]
+    if first == "[":
+        return FORMAT_JSON
+    if first == "{":
+        return FORMAT_NDJSON
+    return FORMAT_CSV
+
+
+async def iter_rows(chunks: AsyncIterator[bytes], content_type: str | None) -> AsyncIterator[ImportRow]:
+    texts = _decode(chunks)
+    head = ""
+    async for text in texts:
+        head += text
+        if head.strip():
+            break
+    import_format = detect_format(content_type, head)
+    parser = {FORMAT_JSON: _iter_json_array, FORMAT_NDJSON: _iter_ndjson, FORMAT_CSV: _iter_csv}[import_format]
+    async for row in parser(_prepend(head, texts)):
+        yield row
+
+
+async def _decode(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    # utf-8-sig: выгрузки из Excel начинаются с BOM.
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    async for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+async def _prepend(head: str, texts: AsyncIterator[str]) -> AsyncIterator[str]:
+    if head:
+        yield head
+    async for text in texts:
+        yield text
+
+
+def _as_fields(value: Any, number: int) -> ImportRow:
+    if not isinstance(value, dict):
+        return ImportRow(number, None, "Запись должна быть JSON-объектом.")
+    return ImportRow(number, value)
+
+
+async def _iter_json_array(texts: AsyncIterator[str]) -> AsyncIterator[ImportRow]:
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    started = finished = False
+    number = 0
+    async for text in texts:
+        buffer = buffer[pos:] + text
+        pos = 0
+        while not finished:
+            while pos < len(buffer) and (buffer[pos].isspace() or (started and buffer[pos] == ",")):
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if not started:
+                if buffer[pos] != "[":
+                    raise ImportFormatError("Ожидался JSON-массив записей.")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                finished = True
+                break
+            try:
+                value, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # Запись ещё не дочитана — ждём следующий чанк.
+                break
+            number += 1
+            yield _as_fields(value, number)
+    if not finished:
+        if not started:
+            raise ImportFormatError("Ожидался JSON-массив записей.")
+        number += 1
+        yield ImportRow(number, None, "Некорректный JSON или массив не закрыт.")
+
+
+async def _iter_lines(texts: AsyncIterator[str]) -> AsyncIterator[str]:
+    buffer = ""
+    async for text in texts:
+        buffer += text
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+
+async def _iter_ndjson(texts: AsyncIterator[str]) -> AsyncIterator[ImportRow]:
+    number = 0
+    async for line in _iter_lines(texts):
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            value = json.loads(line)
+        except json.JSONDecodeError as exc:
+            yield ImportRow(number, None, f"Некорректный JSON: {exc.msg}.")
+            continue
+        yield _as_fields(value, number)
+
+
+async def _iter_csv(texts: AsyncIterator[str]) -> AsyncIterator[ImportRow]:
+    header: list[str] | None = None
+    delimiter = ","
+    record = ""
+    number = 0
+    async for line in _iter_lines(texts):
+        record = f"{record}\n{line}" if record else line
+        # Перевод строки внутри кавычек — продолжение той же записи.
+        if record.count('"') % 2:
+            continue
+        current, record = record.rstrip("\r"), ""
+        if not current.strip():
+            continue
+        if header is None:
+            # Выгрузки из русской локали Excel разделены точкой с запятой.
+            delimiter = ";" if current.count(";") > current.count(",") else ","
+            header = [name.strip().lower() for name in next(csv.reader([current], delimiter=delimiter))]
+            continue
+        number += 1
+        values = next(csv.reader([current], delimiter=delimiter))
+        if len(values) > len(header):
+            yield ImportRow(number, None, "В строке больше значений, чем колонок в заголовке.")
+            continue
+        yield ImportRow(number, {name: value for name, value in zip(header, values) if value.strip()})
+    if record:
+        number += 1
+        yield ImportRow(number, None, "Незакрытая кавычка в CSV.")
+    if header is None:
+        raise ImportFormatError("В CSV нет строки заголовка.")
@@ -0,0 +1,159 @@
+import hashlib
+import logging
+import random
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+
+from sqlalchemy import delete, func
+from sqlmodel import select
+
+from ..config import get_settings
+from ..db import get_async_session, upsert
+from ..models import LLMCacheEntry
+from .cache import LRUCache
+from .intent import tokenize
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Чистку БД-уровня запускаем не на каждую запись, а раз в столько вставок.
+EVICTION_EVERY = 100
+
+CACHE_LOOKUPS = metrics.Counter("llm_cache_lookups_total", "LLM response cache lookups.", ("kind", "result"))
+
+
+def normalize_message(text: str) -> str:
+    normalized = " ".join(tokenize(text))
+    return normalized + " ?" if "?" in text else normalized
+
+
+class LLMResponseCache:
+    """
+    Двухуровневый кэш ответов LLM: LRU в памяти и таблица llmcacheentry в БД.
+
+    На каждый ключ копится до `variants` разных ответов: пока пул не заполнен,
+    запрос уходит в модель и ответ занимает свободный слот, дальше отдаётся случайный
+    вариант из пула. Так ответы с temperature=0.8 не становятся одинаковыми.
+    """
+
+    def __init__(
+        self,
+        *,
+        ttl: timedelta | None = None,
+        max_entries: int | None = None,
+        memory_size: int | None = None,
+    ) -> None:
+        settings = get_settings()
+        self._ttl = ttl or timedelta(hours=settings.llm_cache_ttl_hours)
+        self._max_entries = max_entries or settings.llm_cache_max_entries
+        self._memory: LRUCache[str, list[str]] = LRUCache(
+            memory_size or settings.llm_cache_memory_size,
+            ttl=self._ttl.total_seconds(),
+        )
+        self._inserts = 0
+        self.hits: Counter[str] = Counter()
+        self.misses: Counter[str] = Counter()
+
+    @staticmethod
+    def make_key(kind: str, prompt_version: str, message: str) -> str:
+        raw = f"{kind}\x00{prompt_version}\x00{normalize_message(message)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def get_or_create(
+        self,
+        kind: str,
+        prompt_version: str,
+        message: str,
+        factory: Callable[[], Awaitable[str]],
+        *,
+        variants: int = 1,
+    ) -> str:
+        cached = await self.peek(kind, prompt_version, message, variants=variants)
+        if cached is not None:
+            return cached
+        response = await factory()
+        await self.add(kind, prompt_version, message, response, variants=variants)
+        return response
+
+    async def peek(self, kind: str, prompt_version: str, message: str, *, variants: int = 1) -> str | None:
+        """Возвращает вариант из пула, если он уже заполнен; иначе None (промах)."""
+        pool = await self._pool(self.make_key(kind, prompt_version, message))
+        if len(pool) >= variants:
+            self.hits[kind] += 1
+            CACHE_LOOKUPS.labels(kind=kind, result="hit").inc()
+            logger.debug("LLM cache hit for %s (hits=%s, misses=%s)", kind, self.hits[kind], self.misses[kind])
+            return random.choice(pool)
+        self.misses[kind] += 1
+        CACHE_LOOKUPS.labels(kind=kind, result="miss").inc()
+        logger.debug("LLM cache miss for %s (hits=%s, misses=%s)", kind, self.hits[kind], self.misses[kind])
+        return None
+
+    async def add(self, kind: str, prompt_version: str, message: str, response: str, *, variants: int = 1) -> None:
+        if not response:
+            return
+        key = self.make_key(kind, prompt_version, message)
+        self._memory.set(key, await self._store(key, response, variants))
+
+    async def _pool(self, key: str) -> list[str]:
+        pool = self._memory.get(key)
+        if pool is None:
+            pool = await self._load(key)
+            self._memory.set(key, pool)
+        return pool
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        kinds = set(self.hits) | set(self.misses)
+        return {kind: {"hits": self.hits[kind], "misses": self.misses[kind]} for kind in sorted(kinds)}
+
+    async def _load(self, key: str) -> list[str]:
+        cutoff = datetime.utcnow() - self._ttl
+        async with get_async_session() as session:
+            rows = await session.exec(
+                select(LLMCacheEntry.response)
+                .where(LLMCacheEntry.key == key, LLMCacheEntry.created_at >= cutoff)
+                .order_by(LLMCacheEntry.variant)
+            )
+            return list(rows.all())
+
+    async def _store(self, key: str, response: str, variants: int) -> list[str]:
+        """Пишет ответ в свободный слот пула (или в случайный, если пул полон) и возвращает пул."""
+        cutoff = datetime.utcnow() - self._ttl
+        async with get_async_session() as session:
+            # Слоты берём из БД, а не из памяти: пул могли пополнить другие процессы.
+            # Просроченные строки считаем свободными — upsert их перезапишет.
+            rows = await session.exec(
+                select(LLMCacheEntry.variant, LLMCacheEntry.response).where(
+                    LLMCacheEntry.key == key,
+                    LLMCacheEntry.created_at >= cutoff,
+                    LLMCacheEntry.variant < variants,
+                )
+            )
+            pool = dict(rows.all())
+            free = [variant for variant in range(variants) if variant not in pool]
+            variant = free[0] if free else random.randrange(variants)
+            row = {"key": key, "variant": variant, "response": response, "created_at": datetime.utcnow()}
+            # Тот же слот мог занять параллельный запрос: перезаписываем, а не падаем на уникальном ключе.
+            await session.execute(upsert(session, LLMCacheEntry, [row], keys=["key", "variant"]))
+            await session.commit()
+        pool[variant] = response
+        self._inserts += 1
+        if self._inserts % EVICTION_EVERY == 0:
+            await self._evict()
+        return [pool[variant] for variant in sorted(pool)]
+
+    async def _evict(self) -> None:
+        cutoff = datetime.utcnow() - self._ttl
+        async with get_async_session() as session:
+            await session.execute(delete(LLMCacheEntry).where(LLMCacheEntry.created_at < cutoff))
+            total = (await session.exec(select(func.count()).select_from(LLMCacheEntry))).one()
+            overflow = total - self._max_entries
+            if overflow > 0:
+                oldest = (
+                    select(LLMCacheEntry.id)
+                    .order_by(LLMCacheEntry.created_at)
+                    .limit(overflow)
+                )
+                await session.execute(delete(LLMCacheEntry).where(LLMCacheEntry.id.in_(oldest)))
+            await session.commit()
+        logger.info("LLM cache eviction done, %s entries before trim", total)
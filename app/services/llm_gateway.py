@@ -0,0 +1,271 @@
+import asyncio
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    AsyncOpenAI,
+    DefaultAsyncHttpxClient,
+)
+
+from ..config import get_settings
+from .metrics import Counter, Histogram
+from .ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+LLM_REQUESTS = Counter(
+    "llm_requests_total",
+    "OpenAI calls by mode (create/stream) and outcome (ok, error, unavailable, breaker_open).",
+    ("mode", "outcome"),
+)
+LLM_RETRIES = Counter("llm_retries_total", "Retried OpenAI attempts after 429/5xx/timeouts.")
+LLM_TOKENS = Counter(
+    "llm_tokens_total",
+    "OpenAI tokens by kind: input, cached (input served from the provider prompt cache) and output.",
+    ("kind",),
+)
+LLM_LATENCY = Histogram("llm_request_seconds", "OpenAI call duration including retries.", ("mode",))
+
+
+class LLMUnavailableError(RuntimeError):
+    """OpenAI недоступен (открыт breaker или исчерпаны повторы) — вызывающий код берёт шаблонный ответ."""
+
+
+class CircuitBreaker:
+    """
+    closed → open после `failure_threshold` неудач подряд; через `reset_timeout`
+    пропускает один пробный запрос (half-open) и по его итогу закрывается или снова открывается.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float) -> None:
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self._reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+
+    def release_probe(self) -> None:
+        # Пробный запрос прервали без результата — следующий вызов сможет попробовать снова.
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._probe_in_flight = False
+        if self._opened_at is not None or self._failures >= self._failure_threshold:
+            if self._opened_at is None:
+                logger.warning("OpenAI circuit breaker opened after %s failures", self._failures)
+            self._opened_at = time.monotonic()
+
+
+def _outcome(exc: BaseException) -> str:
+    return "unavailable" if isinstance(exc, LLMUnavailableError) else "error"
+
+
+def _record_usage(usage: Any) -> None:
+    if usage is None:
+        return
+    LLM_TOKENS.labels(kind="input").inc(usage.input_tokens or 0)
+    LLM_TOKENS.labels(kind="output").inc(usage.output_tokens or 0)
+    details = getattr(usage, "input_tokens_details", None)
+    LLM_TOKENS.labels(kind="cached").inc(getattr(details, "cached_tokens", 0) or 0)
+
+
+def build_openai_client() -> AsyncOpenAI:
+    settings = get_settings()
+    # Прокси задаётся явно (OPENAI_PROXY), а не через переменные окружения процесса.
+    http_client = DefaultAsyncHttpxClient(proxy=settings.openai_proxy) if settings.openai_proxy else None
+    return AsyncOpenAI(
+        api_key=settings.openai_api_key,
+        base_url=settings.openai_base_url,
+        timeout=settings.openai_timeout_seconds,
+        max_retries=0,
+        http_client=http_client,
+    )
+
+
+class LLMGateway:
+    """
+    Единая точка вызова OpenAI Responses API: дедлайн на вызов, общий семафор,
+    лимит запросов в минуту, повторы с джиттером на 429/5xx и circuit breaker.
+    """
+
+    def __init__(self, client: AsyncOpenAI | None = None) -> None:
+        settings = get_settings()
+        # Клиент SDK (httpx, SSL-контекст) создаётся к первому запросу, а не при старте воркера.
+        self._client = client
+        self._timeout = settings.openai_timeout_seconds
+        self._max_retries = settings.openai_max_retries
+        self._slots = asyncio.Semaphore(settings.openai_max_concurrency)
+        rate = settings.openai_requests_per_minute / 60
+        self._rate_limiter = TokenBucket(rate, max(1.0, rate))
+        self._breaker = CircuitBreaker(
+            settings.openai_breaker_failures,
+            settings.openai_breaker_reset_seconds,
+        )
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        if self._client is None:
+            self._client = build_openai_client()
+        return self._client
+
+    @property
+    def breaker(self) -> CircuitBreaker:
+        return self._breaker
+
+    async def create_response(self, **kwargs: Any) -> Any:
+        if not self._breaker.allow():
+            LLM_REQUESTS.labels(mode="create", outcome="breaker_open").inc()
+            raise LLMUnavailableError("OpenAI circuit breaker is open")
+        started = time.perf_counter()
+        deadline = self._deadline()
+        try:
+            async with self._slot(deadline):
+                response = await self._with_retries(lambda: self.client.responses.create(**kwargs), deadline)
+        except Exception as exc:
+            LLM_REQUESTS.labels(mode="create", outcome=_outcome(exc)).inc()
+            raise
+        finally:
+            self._breaker.release_probe()
+        LLM_LATENCY.labels(mode="create").observe(time.perf_counter() - started)
+        _record_usage(getattr(response, "usage", None))
+        LLM_REQUESTS.labels(mode="create", outcome="ok").inc()
+        self._breaker.record_success()
+        return response
+
+    async def stream_response(self, **kwargs: Any) -> AsyncIterator[str]:
+        """
+        Потоковый вызов: отдаёт текстовые дельты по мере генерации.
+        Повторяется только открытие потока — начатый ответ не перезапрашиваем.
+        Общий дедлайн ограничивает открытие потока, дальше таймаут действует
+        на ожидание каждого следующего события.
+        """
+        if not self._breaker.allow():
+            LLM_REQUESTS.labels(mode="stream", outcome="breaker_open").inc()
+            raise LLMUnavailableError("OpenAI circuit breaker is open")
+        started = time.perf_counter()
+        deadline = self._deadline()
+        try:
+            async with self._slot(deadline):
+                stream = await self._with_retries(
+                    lambda: self.client.responses.create(stream=True, **kwargs), deadline
+                )
+                events = stream.__aiter__()
+                while True:
+                    try:
+                        event = await asyncio.wait_for(events.__anext__(), self._timeout)
+                    except StopAsyncIteration:
+                        break
+                    except Exception as exc:
+                        if not self._is_retryable(exc):
+                            raise
+                        self._breaker.record_failure()
+                        raise LLMUnavailableError(f"OpenAI stream failed: {exc!r}") from exc
+                    if event.type == "response.output_text.delta":
+                        yield event.delta
+                    elif event.type == "response.completed":
+                        _record_usage(event.response.usage)
+        except Exception as exc:
+            LLM_REQUESTS.labels(mode="stream", outcome=_outcome(exc)).inc()
+            raise
+        finally:
+            self._breaker.release_probe()
+        LLM_LATENCY.labels(mode="stream").observe(time.perf_counter() - started)
+        LLM_REQUESTS.labels(mode="stream", outcome="ok").inc()
+        self._breaker.record_success()
+
+    def _deadline(self) -> float:
+        # Общий бюджет вызова: очередь за слотом и лимитом, все попытки и паузы между ними.
+        return asyncio.get_running_loop().time() + self._timeout * (self._max_retries + 1)
+
+    @asynccontextmanager
+    async def _slot(self, deadline: float) -> AsyncIterator[None]:
+        try:
+            async with asyncio.timeout_at(deadline):
+                await self._slots.acquire()
+        except TimeoutError as exc:
+            raise LLMUnavailableError("No free OpenAI slot before the deadline") from exc
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    async def _with_retries(self, call: Callable[[], Awaitable[Any]], deadline: float) -> Any:
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            try:
+                async with asyncio.timeout_at(deadline):
+                    await self._rate_limiter.acquire()
+            except TimeoutError as exc:
+                # Перегружены мы сами, а не OpenAI: breaker не трогаем.
+                raise LLMUnavailableError("OpenAI rate limit wait exceeded the deadline") from exc
+            budget = deadline - loop.time()
+            try:
+                return await asyncio.wait_for(call(), min(self._timeout, budget))
+            except Exception as exc:
+                if not self._is_retryable(exc):
+                    # Ошибка запроса (400, 401…), а не здоровья OpenAI: breaker не трогаем.
+                    self._breaker.record_success()
+                    raise
+                if isinstance(exc, asyncio.TimeoutError) and budget < self._timeout:
+                    # Попытке досталось меньше обычного таймаута — бюджет съела очередь, не OpenAI.
+                    raise LLMUnavailableError("OpenAI call exceeded the deadline") from exc
+                delay = self._backoff(attempt, exc)
+                if attempt >= self._max_retries or loop.time() + delay >= deadline:
+                    self._breaker.record_failure()
+                    raise LLMUnavailableError(f"OpenAI request failed: {exc!r}") from exc
+                attempt += 1
+                LLM_RETRIES.inc()
+                logger.warning("OpenAI call failed (%r), retry %s in %.2fs", exc, attempt, delay)
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    def _is_retryable(exc: Exception) -> bool:
+        if isinstance(exc, (asyncio.TimeoutError, APITimeoutError, APIConnectionError)):
+            return True
+        if isinstance(exc, APIStatusError):
+            return exc.status_code == 429 or exc.status_code >= 500
+        return False
+
+    @staticmethod
+    def _backoff(attempt: int, exc: Exception) -> float:
+        retry_after = None
+        if isinstance(exc, APIStatusError):
+            header = exc.response.headers.get("retry-after")
+            if header:
+                try:
+                    retry_after = float(header)
+                except ValueError:
+                    retry_after = None
+        # Full jitter: случайная задержка до экспоненциальной границы.
+        delay = random.uniform(0, min(8.0, 0.5 * 2**attempt))
+        return max(delay, retry_after or 0.0)
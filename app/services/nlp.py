@@ -1,104 +1,88 @@
-import re
-from enum import Enum
-import os
-from openai import AsyncOpenAI
+import hashlib
+import logging
+import time
+from contextlib import aclosing
+from typing import AsyncGenerator, Awaitable, Callable
 
 from ..config import get_settings
+from .conversation import History, Turn
+from .intent import IntentClassifier, IntentLabel
+from .intent_batch import IntentBatcher
+from .llm_cache import LLMResponseCache
+from .llm_gateway import LLMGateway, LLMUnavailableError
+from .metrics import Counter, Histogram
+from .prompts import CLASSIFY_BATCH_FORMAT, PromptBuilder
 
-settings = get_settings()
+logger = logging.getLogger(__name__)
 
-# Прокси для контейнеров (отдельный xray-инстанс, напр. на 1082)
-os.environ["http_proxy"] = "socks5h://host.docker.internal:1082"
-os.environ["https_proxy"] = "socks5h://host.docker.internal:1082"
+# Меняйте версию при правке текста промпта — старые ответы в кэше перестанут использоваться.
+PROMPT_VERSIONS = {
+    "classify": "2",
+    "answer": "2",
+    "rejection": "1",
+}
 
-class IntentLabel(str, Enum):
-    accept = "accept"
-    reject = "reject"
-    question = "question"
-    ambiguous = "ambiguous"
+# Запасное краткое содержание, когда OpenAI недоступен: столько последних символов переписки.
+SUMMARY_FALLBACK_CHARS = 1000
+
+INTENT_CLASSIFICATIONS = Counter(
+    "intent_classifications_total",
+    "Intent labels by source: local classifier, LLM, or local fallback when OpenAI is unavailable.",
+    ("source", "label"),
+)
+TIME_TO_FIRST_TOKEN = Histogram(
+    "llm_time_to_first_token_seconds",
+    "Time from sending a streaming OpenAI request to its first text delta.",
+)
 
 
 class LeadConversationAI:
-    def __init__(self) -> None:
-        self._client = AsyncOpenAI(api_key=settings.openai_api_key)
+    def __init__(self, gateway: LLMGateway | None = None) -> None:
+        settings = get_settings()
+        self._gateway = gateway or LLMGateway()
         self._model = settings.openai_model
-        self._accept_patterns = [
-            r"\bда\b",
-            r"\bдавай(те)?\b",
-            r"\bконечно\b",
-            r"\bготов\b",
-            r"\bсоглас(ен|на)\b",
-            r"\bок\b",
-            r"\bокей\b",
-            r"\bпоехали\b",
-            r"\bинтересно\b",
-        ]
-        self._reject_patterns = [
-            r"\bнет\b",
-            r"\bне интересно\b",
-            r"\bнеинтересно\b",
-            r"\bне надо\b",
-            r"\bне нужен\b",
-            r"\bне пишите\b",
-            r"\bне беспокойте\b",
-            r"\bошибка\b",
-            r"\bне оставлял[аи]?\b",
-            r"\bспам\b",
-            r"\bне актуально\b",
-        ]
-        self._question_patterns = [
-            r"\bчто\b",
-            r"\bкак\b",
-            r"\bкогда\b",
-            r"\bкакие\b",
-            r"\bкакая\b",
-            r"\bсколько\b",
-            r"\bможно\b",
-            r"\bмогу\b",
-            r"\bчем\b",
-            r"\bгде\b",
-            r"календар",
-            r"записать",
-            r"записаться",
-            r"не получается",
-        ]
+        self._classifier = IntentClassifier()
+        self._cache = LLMResponseCache() if settings.llm_cache_enabled else None
+        self._prompts = PromptBuilder()
+        self._batcher = (
+            IntentBatcher(self._request_labels, self._request_label) if settings.intent_batch_enabled else None
+        )
+        # В промпты подставляются ссылка и профиль компании: их смена тоже сбрасывает кэш.
+        self._settings_fingerprint = hashlib.sha256(
+            f"{self._model}|{settings.calendly_link}|{settings.company_profile}".encode("utf-8")
+        ).hexdigest()[:12]
+
+    @property
+    def cache(self) -> LLMResponseCache | None:
+        return self._cache
 
     async def classify(self, message: str) -> IntentLabel:
         text = (message or "").strip()
         if not text:
             return IntentLabel.ambiguous
-        normalized = text.lower()
 
-        if self._match(normalized, self._accept_patterns):
-            return IntentLabel.accept
-        if self._match(normalized, self._reject_patterns):
-            return IntentLabel.reject
-        if "?" in text or self._match(normalized, self._question_patterns):
-            return IntentLabel.question
+        local = self._classifier.classify(text)
+        if local.label != IntentLabel.ambiguous and local.confidence >= get_settings().intent_confidence_threshold:
+            INTENT_CLASSIFICATIONS.labels(source="local", label=local.label.value).inc()
+            return local.label
 
-        prompt = (
-            "Ты работаешь в отделе продаж GordovCode. "
-            "Оцени сообщение лида и верни один ярлык из списка:\n"
-            "- accept: пользователь подтверждает, что оставлял заявку и готов обсудить созвон.\n"
-            "- reject: пользователь отказывается, говорит что это ошибка или просит не писать.\n"
-            "- question: пользователь задаёт вопрос, и нужно ответить по нашему описанию.\n"
-            "- ambiguous: всё остальное.\n"
-            "Ответь только одним словом (accept/reject/question/ambiguous).\n"
-            f"Сообщение лида: ```{message}```"
-        )
+        async def request_label() -> str:
+            if self._batcher is not None:
+                return await self._batcher.classify(message)
+            return await self._request_label(message)
 
-        completion = await self._client.responses.create(
-            model=self._model,
-            input=prompt,
-            temperature=0.0,
-        )
-        raw = (completion.output_text or "").strip().lower()
-        for label in IntentLabel:
-            if label.value in raw:
-                return label
-        return IntentLabel.ambiguous
+        try:
+            raw = await self._cached("classify", text, request_label, variants=1)
+        except LLMUnavailableError:
+            # OpenAI недоступен — лучше неуверенный локальный ярлык, чем никакого.
+            INTENT_CLASSIFICATIONS.labels(source="fallback", label=local.label.value).inc()
+            return local.label
+        result = next((label for label in IntentLabel if label.value in raw), IntentLabel.ambiguous)
+        INTENT_CLASSIFICATIONS.labels(source="llm", label=result.value).inc()
+        return result
 
     async def generate_greeting(self, name: str) -> str:
+        settings = get_settings()
         return settings.greeting_template.format(name=name, calendly_link=settings.calendly_link)
 
     async def generate_rejection_reply(self, name: str | None = None) -> str:
@@ -107,37 +91,143 @@ class LeadConversationAI:
             "Нужно коротко извиниться за беспокойство, поблагодарить за ответ и сказать, что будем на связи, если ситуация изменится. "
             "Стиль дружелюбный, 1-2 предложения."
         )
-        return await self._single_text_response(prompt)
+        # Промпт не зависит от сообщения, поэтому все отказы делят один пул вариантов.
+        return await self._cached(
+            "rejection",
+            "",
+            lambda: self._single_text_response(prompt),
+            variants=get_settings().llm_cache_variants,
+        )
 
-    async def answer_question(self, message: str, intent_hint: IntentLabel | None = None) -> str:
+    async def answer_question(
+        self,
+        message: str,
+        intent_hint: IntentLabel | None = None,
+        history: History | None = None,
+    ) -> str:
         intent_context = intent_hint.value if intent_hint else "unspecified"
-        prompt = (
-            "Ты — ИИ-менеджер GordovCode и ведёшь переписку с лидом после отправки приглашения в календарь.\n"
-            "Следуй сценарию:\n"
-            "1) Если пользователь говорит, что не получается записаться в календаре или возникают сложности с выбором времени, "
-            "ответь в стиле: \"Хорошо. Ничего страшного. В какой день и время Вам удобнее будет пообщаться в zoom?\" "
-            "Сохрани дружелюбный тон и не добавляй ссылку.\n"
-            "2) Если пользователь просит помочь без звонка или задаёт любой другой уточняющий вопрос, скажи, что можем обсудить и в переписке, "
-            "но созвон помогает быстрее разобраться, поэтому предложи выбрать время в календаре. "
-            f"Добавь строку с ссылкой 👉 {settings.calendly_link} и закончи фразой "
-            "\"Там же будет ссылка на Zoom. Ждем вас на встрече!\" без дополнительных подробностей.\n"
-            "3) Если пользователь просто подтверждает, что оставлял заявку и готов созвониться, поблагодари и скажи, что ждёте его на встрече. "
-            "Не присылай ссылку повторно.\n"
-            "Используй информацию о GordovCode только если это помогает ответить на их вопрос:\n"
-            f"{settings.company_profile}\n"
-            f"Классификация исходного сообщения: {intent_context}.\n"
-            "Сообщение лида: " + message
+        input_items = self._prompts.answer_input(message, intent_context, history)
+
+        async def request_answer() -> str:
+            completion = await self._gateway.create_response(
+                model=self._model,
+                instructions=self._prompts.answer_instructions,
+                input=input_items,
+                temperature=0.8,
+            )
+            return (completion.output_text or "").strip()
+
+        if history and not history.empty:
+            # Ответ с учётом переписки принадлежит одному лиду — в общий кэш его не кладём.
+            return await request_answer()
+        return await self._cached(
+            f"answer:{intent_context}",
+            message,
+            request_answer,
+            variants=get_settings().llm_cache_variants,
         )
-        return await self._single_text_response(prompt)
+
+    async def stream_answer(
+        self,
+        message: str,
+        intent_hint: IntentLabel | None = None,
+        history: History | None = None,
+    ) -> AsyncGenerator[str, None]:
+        """
+        То же, что answer_question, но отдаёт текст частями по мере генерации.
+        Ответ из заполненного пула кэша приходит одним куском.
+        """
+        intent_context = intent_hint.value if intent_hint else "unspecified"
+        kind = f"answer:{intent_context}"
+        cache = self._cache if not history or history.empty else None
+        if cache is not None:
+            cached = await cache.peek(
+                kind,
+                self._prompt_version(kind),
+                message,
+                variants=get_settings().llm_cache_variants,
+            )
+            if cached is not None:
+                yield cached
+                return
+
+        started = time.monotonic()
+        chunks: list[str] = []
+        # Если потребитель бросит поток, aclosing сразу закроет и запрос к OpenAI, освободив слот шлюза.
+        stream = self._gateway.stream_response(
+            model=self._model,
+            instructions=self._prompts.answer_instructions,
+            input=self._prompts.answer_input(message, intent_context, history),
+            temperature=0.8,
+        )
+        async with aclosing(stream):
+            async for delta in stream:
+                if not chunks:
+                    TIME_TO_FIRST_TOKEN.observe(time.monotonic() - started)
+                chunks.append(delta)
+                yield delta
+
+        full_text = "".join(chunks).strip()
+        if cache is not None and full_text:
+            await cache.add(
+                kind, self._prompt_version(kind), message, full_text, variants=get_settings().llm_cache_variants
+            )
+
+    async def summarize_history(self, summary: str | None, turns: list[Turn]) -> str:
+        """Краткое содержание ранней переписки; без OpenAI — хвост переписки как есть."""
+        try:
+            completion = await self._gateway.create_response(
+                model=self._model,
+                instructions=self._prompts.summary_instructions,
+                input=self._prompts.summary_input(summary, turns),
+                temperature=0.0,
+            )
+            text = (completion.output_text or "").strip()
+        except LLMUnavailableError:
+            text = ""
+        if not text:
+            # Обрезаем с начала: последние реплики важнее для следующего ответа.
+            text = self._prompts.summary_input(summary, turns)[-SUMMARY_FALLBACK_CHARS:]
+        return text
+
+    async def _cached(
+        self,
+        kind: str,
+        message: str,
+        factory: Callable[[], Awaitable[str]],
+        *,
+        variants: int,
+    ) -> str:
+        if self._cache is None:
+            return await factory()
+        return await self._cache.get_or_create(kind, self._prompt_version(kind), message, factory, variants=variants)
+
+    def _prompt_version(self, kind: str) -> str:
+        return f"{PROMPT_VERSIONS[kind.split(':')[0]]}:{self._settings_fingerprint}"
+
+    async def _request_label(self, message: str) -> str:
+        completion = await self._gateway.create_response(
+            model=self._model,
+            instructions=self._prompts.classify_instructions,
+            input=self._prompts.classify_input(message),
+            temperature=0.0,
+        )
+        return (completion.output_text or "").strip().lower()
+
+    async def _request_labels(self, messages: list[str]) -> str:
+        completion = await self._gateway.create_response(
+            model=self._model,
+            instructions=self._prompts.classify_batch_instructions,
+            input=self._prompts.classify_batch_input(messages),
+            text=CLASSIFY_BATCH_FORMAT,
+            temperature=0.0,
+        )
+        return completion.output_text or ""
 
     async def _single_text_response(self, prompt: str) -> str:
-        completion = await self._client.responses.create(
+        completion = await self._gateway.create_response(
             model=self._model,
             input=prompt,
             temperature=0.8,
         )
         return (completion.output_text or "").strip()
-
-    @staticmethod
-    def _match(text: str, patterns: list[str]) -> bool:
-        return any(re.search(pattern, text) for pattern in patterns)
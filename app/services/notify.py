@@ -0,0 +1,141 @@
+"""
+Мгновенное пробуждение воркера при появлении новых лидов.
+
+API вызывает `notify_pending_leads` в транзакции, создающей лида. На Postgres
+это `pg_notify`, который доставляется слушателю после коммита. На SQLite
+после коммита отправляется датаграмма в unix-сокет воркера. Воркер ждёт
+сигнала через `LeadWakeup.wait`, а обычный опрос остаётся страховкой.
+"""
+import asyncio
+import logging
+import os
+import socket
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from ..config import get_settings
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "leads_pending"
+
+
+def _is_postgres(database_url: str) -> bool:
+    return make_url(database_url).get_backend_name() == "postgresql"
+
+
+async def notify_pending_leads(session: AsyncSession) -> None:
+    if session.sync_session.get_bind().dialect.name == "postgresql":
+        # NOTIFY транзакционный: слушатель получит его только после коммита.
+        await session.execute(text("SELECT pg_notify(:channel, '')"), {"channel": CHANNEL})
+    else:
+        event.listen(session.sync_session, "after_commit", _send_local_signal, once=True)
+
+
+def _send_local_signal(_session: Session) -> None:
+    path = get_settings().worker_signal_path
+    if not path or not hasattr(socket, "AF_UNIX"):
+        return
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.setblocking(False)
+            sock.sendto(b"1", path)
+    except OSError:
+        # Воркер не запущен или очередь сокета переполнена — сработает опрос.
+        pass
+
+
+class LeadWakeup:
+    def __init__(self, database_url: str | None = None) -> None:
+        self._database_url = database_url or get_settings().database_url
+        self._event = asyncio.Event()
+        self._listener: asyncio.Task[None] | None = None
+        self._socket: socket.socket | None = None
+
+    async def start(self) -> None:
+        if _is_postgres(self._database_url):
+            self._listener = asyncio.create_task(self._listen_postgres())
+        else:
+            self._bind_local_socket()
+
+    async def stop(self) -> None:
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._socket:
+            asyncio.get_running_loop().remove_reader(self._socket.fileno())
+            self._socket.close()
+            self._socket = None
+            try:
+                os.unlink(get_settings().worker_signal_path)
+            except OSError:
+                pass
+
+    def set(self) -> None:
+        self._event.set()
+
+    async def wait(self, timeout: float) -> bool:
+        """Ждёт сигнала не дольше `timeout` секунд. Возвращает True, если он пришёл."""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._event.clear()
+
+    async def _listen_postgres(self) -> None:
+        import psycopg
+
+        conninfo = make_url(self._database_url).set(drivername="postgresql").render_as_string(hide_password=False)
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(conninfo, autocommit=True) as conn:
+                    await conn.execute(f"LISTEN {CHANNEL}")
+                    logger.info("Listening for new leads on channel %s", CHANNEL)
+                    # После переподключения могли пропустить уведомления.
+                    self._event.set()
+                    async for _ in conn.notifies():
+                        self._event.set()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("LISTEN connection lost, retrying in 5 seconds")
+                await asyncio.sleep(5)
+
+    def _bind_local_socket(self) -> None:
+        path = get_settings().worker_signal_path
+        if not path or not hasattr(socket, "AF_UNIX"):
+            return
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        try:
+            sock.bind(path)
+        except OSError:
+            logger.warning("Cannot bind worker signal socket %s, falling back to polling", path)
+            sock.close()
+            return
+        self._socket = sock
+        asyncio.get_running_loop().add_reader(sock.fileno(), self._drain_local_socket)
+
+    def _drain_local_socket(self) -> None:
+        assert self._socket is not None
+        while True:
+            try:
+                self._socket.recv(64)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                break
+        self._event.set()
@@ -0,0 +1,371 @@
+"""
+Транзакционный outbox исходящих сообщений.
+
+Обработчик лида не ходит в Telegram: он добавляет сообщение в outbox в той же
+транзакции, что и смену статуса, и возвращается сразу после коммита. Падение
+между отправкой и записью статуса больше не теряет и не дублирует сообщения.
+OutboxSender забирает созревшие сообщения пачками (как FollowUpScheduler — с арендой
+через сдвиг срока), отправляет, повторяет с backoff и пишет итог пачки одной
+транзакцией. Воркер держит по отправителю на вид сообщений, чтобы пачка
+приветствий не задерживала ответы. Доставка «хотя бы один раз»: повтор после падения уходит с тем же
+random_id, и Telegram отвечает RANDOM_ID_DUPLICATE вместо второго сообщения.
+"""
+import asyncio
+import hashlib
+import logging
+import random
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable
+
+from pyrogram.errors import FloodWait
+from sqlalchemy import delete, func, update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from ..config import get_settings
+from ..db import get_async_session
+from ..models import Lead, OutboxMessage, OutboxStatus
+from .metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+KIND_GREETING = "greeting"
+KIND_REPLY = "reply"
+KIND_REMINDER = "reminder"
+# Страховочный интервал опроса: сообщения, поставленные другим процессом, заметим не позже.
+MAX_SLEEP_SECONDS = 60.0
+# Раз в столько пачек удаляем отправленные и неудавшиеся сообщения старше OUTBOX_RETENTION_HOURS.
+PURGE_EVERY = 100
+
+OUTBOX_MESSAGES = Counter(
+    "outbox_messages_total",
+    "Outgoing messages by kind and outcome: sent, retried or failed.",
+    ("kind", "outcome"),
+)
+OUTBOX_DELAY = Histogram(
+    "outbox_delay_seconds",
+    "Time from enqueueing an outgoing message to its delivery to Telegram.",
+    ("kind",),
+)
+
+
+class DeliveryFailed(RuntimeError):
+    """Сообщение доставить нельзя (лид заблокировал аккаунт, аккаунт отключён…) — не повторять."""
+
+
+class RetryLater(RuntimeError):
+    """Отправить пока нельзя (аккаунт временно ограничен) — отложить, не расходуя попытку."""
+
+    def __init__(self, seconds: float, reason: str = "") -> None:
+        super().__init__(reason or f"retry in {seconds:.0f}s")
+        self.seconds = seconds
+
+
+def random_id(dedupe_key: str) -> int:
+    """random_id для messages.sendMessage: одинаковый у всех попыток одного сообщения."""
+    return int.from_bytes(hashlib.blake2b(dedupe_key.encode("utf-8"), digest_size=8).digest(), "big") >> 1
+
+
+def enqueue(
+    session: AsyncSession,
+    *,
+    dedupe_key: str,
+    lead_id: int,
+    kind: str,
+    account: str | None,
+    telegram_user_id: int,
+    text: str,
+) -> None:
+    """Добавляет сообщение в транзакцию вызывающего кода; после коммита вызовите OutboxSender.notify()."""
+    session.add(
+        OutboxMessage(
+            dedupe_key=dedupe_key,
+            lead_id=lead_id,
+            kind=kind,
+            telegram_account=account,
+            telegram_user_id=telegram_user_id,
+            text=text,
+        )
+    )
+
+
+def record_sent(
+    session: AsyncSession,
+    *,
+    dedupe_key: str,
+    lead_id: int,
+    kind: str,
+    account: str | None,
+    telegram_user_id: int,
+    text: str,
+    telegram_message_id: int | None,
+) -> None:
+    """
+    Записывает сообщение, уже доставленное в обход отправителя (потоковый ответ), в той же
+    транзакции, что и статус лида: повтор с тем же ключом упрётся в уникальный dedupe_key.
+    """
+    now = datetime.utcnow()
+    session.add(
+        OutboxMessage(
+            dedupe_key=dedupe_key,
+            lead_id=lead_id,
+            kind=kind,
+            telegram_account=account,
+            telegram_user_id=telegram_user_id,
+            text=text,
+            status=OutboxStatus.sent,
+            attempts=1,
+            telegram_message_id=telegram_message_id,
+            sent_at=now,
+        )
+    )
+
+
+@dataclass
+class _Outcome:
+    message: OutboxMessage
+    telegram_message_id: int | None = None
+    error: Exception | None = None
+    retry_at: datetime | None = None
+
+
+class OutboxSender:
+    def __init__(
+        self,
+        send: Callable[[OutboxMessage], Awaitable[int | None]],
+        on_failed: Callable[[OutboxMessage, str], Awaitable[None]],
+        *,
+        kinds: tuple[str, ...] | None = None,
+        batch_size: int | None = None,
+        lease_seconds: int | None = None,
+    ) -> None:
+        settings = get_settings()
+        self._send = send
+        self._on_failed = on_failed
+        self._kinds = kinds
+        self._batch_size = batch_size or settings.outbox_batch_size
+        self._lease = timedelta(seconds=lease_seconds or settings.lead_lease_seconds)
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task[None] | None = None
+        self._batches = 0
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def notify(self) -> None:
+        self._wakeup.set()
+
+    async def backlog(self) -> int:
+        """Сколько сообщений своих видов ещё ждут отправки."""
+        async with get_async_session() as session:
+            statement = select(func.count()).select_from(OutboxMessage).where(*self._pending())
+            return (await session.exec(statement)).one()
+
+    def _pending(self) -> list[Any]:
+        conditions = [OutboxMessage.status == OutboxStatus.pending]
+        if self._kinds is not None:
+            conditions.append(OutboxMessage.kind.in_(self._kinds))
+        return conditions
+
+    async def run_due(self) -> int:
+        messages = await self._claim_due(self._batch_size)
+        if not messages:
+            return 0
+        # Сообщения одного лида уходят по порядку, разные лиды — параллельно.
+        by_lead: dict[int, list[OutboxMessage]] = defaultdict(list)
+        for message in messages:
+            by_lead[message.lead_id].append(message)
+        chains = await asyncio.gather(*(self._deliver_chain(chain) for chain in by_lead.values()))
+        outcomes = [outcome for chain in chains for outcome in chain]
+        await self._save_outcomes(outcomes)
+        for outcome in outcomes:
+            if outcome.error is not None and outcome.retry_at is None:
+                try:
+                    await self._on_failed(outcome.message, repr(outcome.error))
+                except Exception:
+                    logger.exception("Failure handler for outbox message %s failed", outcome.message.id)
+        self._batches += 1
+        if self._batches % PURGE_EVERY == 0:
+            await self.purge()
+        return len(messages)
+
+    async def purge(self) -> int:
+        cutoff = datetime.utcnow() - timedelta(hours=get_settings().outbox_retention_hours)
+        async with get_async_session() as session:
+            result = await session.execute(
+                delete(OutboxMessage).where(
+                    OutboxMessage.status != OutboxStatus.pending,
+                    OutboxMessage.created_at < cutoff,
+                )
+            )
+            await session.commit()
+        if result.rowcount:
+            logger.info("Purged %s delivered outbox messages", result.rowcount)
+        return result.rowcount
+
+    async def _deliver_chain(self, chain: list[OutboxMessage]) -> list[_Outcome]:
+        outcomes = []
+        for number, message in enumerate(chain):
+            outcome = await self._deliver(message)
+            outcomes.append(outcome)
+            if outcome.retry_at is not None:
+                # Следующие сообщения лида не обгоняют отложенное: повторим их вместе с ним.
+                outcomes += [_Outcome(later, retry_at=outcome.retry_at) for later in chain[number + 1:]]
+                break
+        return outcomes
+
+    async def _deliver(self, message: OutboxMessage) -> _Outcome:
+        try:
+            return _Outcome(message, telegram_message_id=await self._send(message))
+        except asyncio.CancelledError:
+            raise
+        except DeliveryFailed as exc:
+            return _Outcome(message, error=exc)
+        except RetryLater as exc:
+            return _Outcome(message, retry_at=datetime.utcnow() + timedelta(seconds=exc.seconds))
+        except Exception as exc:
+            if message.attempts + 1 >= get_settings().outbox_max_attempts:
+                return _Outcome(message, error=exc)
+            return _Outcome(message, error=exc, retry_at=datetime.utcnow() + self._backoff(message.attempts, exc))
+
+    @staticmethod
+    def _backoff(attempts: int, exc: Exception) -> timedelta:
+        settings = get_settings()
+        delay = min(settings.outbox_retry_max_seconds, settings.outbox_retry_base_seconds * 2**attempts)
+        delay = random.uniform(delay / 2, delay)
+        if isinstance(exc, FloodWait):
+            delay = max(delay, float(exc.value or 0))
+        return timedelta(seconds=delay)
+
+    @staticmethod
+    async def _save_outcomes(outcomes: list[_Outcome]) -> None:
+        """Итог пачки — одна транзакция: executemany по первичному ключу для сообщений и лидов."""
+        now = datetime.utcnow()
+        sent: list[dict[str, Any]] = []
+        contacted: list[dict[str, Any]] = []
+        retried: list[dict[str, Any]] = []
+        postponed: list[dict[str, Any]] = []
+        failed: list[dict[str, Any]] = []
+        for outcome in outcomes:
+            message = outcome.message
+            if outcome.error is None and outcome.retry_at is None:
+                sent.append(
+                    {
+                        "id": message.id,
+                        "status": OutboxStatus.sent,
+                        "sent_at": now,
+                        "telegram_message_id": outcome.telegram_message_id,
+                    }
+                )
+                # RANDOM_ID_DUPLICATE не возвращает id: last_message_id тогда не трогаем.
+                if outcome.telegram_message_id is not None:
+                    contacted.append(
+                        {
+                            "id": message.lead_id,
+                            "last_message_id": outcome.telegram_message_id,
+                            "last_contacted_at": now,
+                        }
+                    )
+                OUTBOX_MESSAGES.labels(kind=message.kind, outcome="sent").inc()
+                OUTBOX_DELAY.labels(kind=message.kind).observe((now - message.created_at).total_seconds())
+            elif outcome.retry_at is not None and outcome.error is None:
+                postponed.append({"id": message.id, "next_attempt_at": outcome.retry_at})
+            elif outcome.retry_at is not None:
+                retried.append(
+                    {
+                        "id": message.id,
+                        "next_attempt_at": outcome.retry_at,
+                        "attempts": message.attempts + 1,
+                        "last_error": repr(outcome.error),
+                    }
+                )
+                OUTBOX_MESSAGES.labels(kind=message.kind, outcome="retried").inc()
+                logger.warning(
+                    "Outbox message %s to lead %s failed (%r), retry at %s",
+                    message.id,
+                    message.lead_id,
+                    outcome.error,
+                    outcome.retry_at,
+                )
+            else:
+                failed.append(
+                    {
+                        "id": message.id,
+                        "status": OutboxStatus.failed,
+                        "attempts": message.attempts + 1,
+                        "last_error": repr(outcome.error),
+                    }
+                )
+                OUTBOX_MESSAGES.labels(kind=message.kind, outcome="failed").inc()
+                logger.error("Outbox message %s to lead %s failed: %r", message.id, message.lead_id, outcome.error)
+        async with get_async_session() as session:
+            for rows in (sent, retried, postponed, failed):
+                if rows:
+                    await session.execute(update(OutboxMessage), rows)
+            if contacted:
+                await session.execute(update(Lead), contacted)
+            await session.commit()
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            try:
+                if await self.run_due() >= self._batch_size:
+                    continue
+                due_at = await self._next_due_at()
+            except Exception:
+                logger.exception("Outbox sender iteration failed")
+                due_at = None
+            delay = MAX_SLEEP_SECONDS
+            if due_at is not None:
+                delay = min(max((due_at - datetime.utcnow()).total_seconds(), 0.0), MAX_SLEEP_SECONDS)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _next_due_at(self) -> datetime | None:
+        async with get_async_session() as session:
+            return (
+                await session.exec(
+                    select(OutboxMessage.next_attempt_at)
+                    .where(*self._pending())
+                    .order_by(OutboxMessage.next_attempt_at)
+                    .limit(1)
+                )
+            ).first()
+
+    async def _claim_due(self, limit: int) -> list[OutboxMessage]:
+        now = datetime.utcnow()
+        due = (
+            select(OutboxMessage.id)
+            .where(*self._pending(), OutboxMessage.next_attempt_at <= now)
+            .order_by(OutboxMessage.next_attempt_at, OutboxMessage.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        statement = (
+            update(OutboxMessage)
+            .where(OutboxMessage.id.in_(due), OutboxMessage.next_attempt_at <= now)
+            .values(next_attempt_at=now + self._lease)
+            .returning(OutboxMessage)
+            .execution_options(synchronize_session=False)
+        )
+        async with get_async_session() as session:
+            messages = list((await session.execute(statement)).scalars().all())
+            await session.commit()
+        messages.sort(key=lambda message: message.id or 0)
+        return messages
@@ -0,0 +1,108 @@
+from pyrogram import raw
+from sqlalchemy import or_
+from sqlmodel import select
+
+from ..config import get_settings
+from ..db import get_async_session
+from ..models import Lead, TelegramIdentity
+from .cache import LRUCache
+from .identity import IdentityCache, ResolvedUser, username_key
+
+
+
+class PeerCache:
+    """
+    Кэш Telegram-пиров: user_id → access_hash и username → пользователь.
+
+    Первый уровень — LRU в памяти, второй — БД (лиды и telegramidentity).
+    По найденной паре id/access_hash `InputPeerUser` строится сразу,
+    без get_users/ResolveUsername и без обращения к сессии Pyrogram.
+    """
+
+    def __init__(
+        self,
+        identity_cache: IdentityCache,
+        capacity: int | None = None,
+        *,
+        account: str | None = None,
+    ) -> None:
+        capacity = capacity or get_settings().peer_cache_size
+        self._identity_cache = identity_cache
+        # Лиды, чей access_hash получен этим аккаунтом (без владельца — основным).
+        self._account = account
+        self._by_id: LRUCache[int, ResolvedUser] = LRUCache(capacity)
+        self._by_username: LRUCache[str, ResolvedUser] = LRUCache(capacity)
+
+    def remember(self, user: ResolvedUser) -> None:
+        if user.access_hash is None:
+            # Без access_hash пир всё равно придётся резолвить, держим только известные.
+            known = self._by_id.get(user.id)
+            if known is None:
+                return
+            user = ResolvedUser(id=user.id, access_hash=known.access_hash, username=user.username or known.username)
+        self._by_id.set(user.id, user)
+        if user.username:
+            self._by_username.set(user.username.lower(), user)
+
+    async def get(self, user_id: int) -> ResolvedUser | None:
+        user = self._by_id.get(user_id)
+        if user is not None:
+            return user
+        user = await self._load_by_id(user_id)
+        if user is not None:
+            self.remember(user)
+        return user
+
+    async def get_by_username(self, username: str) -> ResolvedUser | None:
+        normalized = username.strip().lstrip("@").lower()
+        user = self._by_username.get(normalized)
+        if user is not None:
+            return user
+        _, user = await self._identity_cache.get(username_key(normalized))
+        if user is not None and user.access_hash is not None:
+            self.remember(user)
+            return user
+        return None
+
+    async def input_peer(self, user_id: int) -> raw.types.InputPeerUser | None:
+        user = await self.get(user_id)
+        if user is None or user.access_hash is None:
+            return None
+        return raw.types.InputPeerUser(user_id=user.id, access_hash=user.access_hash)
+
+    async def _load_by_id(self, user_id: int) -> ResolvedUser | None:
+        owner = Lead.telegram_account == self._account
+        if self._account is None or self._account == get_settings().telegram_session_name:
+            owner = or_(owner, Lead.telegram_account.is_(None))
+        async with get_async_session() as session:
+            lead = (
+                await session.exec(
+                    select(Lead)
+                    .where(Lead.telegram_user_id == user_id, Lead.telegram_access_hash.is_not(None), owner)
+                    .limit(1)
+                )
+            ).first()
+            if lead:
+                return ResolvedUser(
+                    id=user_id,
+                    access_hash=lead.telegram_access_hash,
+                    username=lead.telegram_username,
+                )
+            identity = (
+                await session.exec(
+                    select(TelegramIdentity)
+                    .where(
+                        TelegramIdentity.telegram_user_id == user_id,
+                        TelegramIdentity.telegram_access_hash.is_not(None),
+                        self._identity_cache.owns(),
+                    )
+                    .limit(1)
+                )
+            ).first()
+            if identity:
+                return ResolvedUser(
+                    id=user_id,
+                    access_hash=identity.telegram_access_hash,
+                    username=identity.telegram_username,
+                )
+        return None
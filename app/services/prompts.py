@@ -0,0 +1,126 @@
+"""
+Промпты LLM, разложенные под кэширование префикса у провайдера.
+
+Всё неизменное — сценарий, ссылка, профиль компании — уходит в `instructions`
+и одинаково для всех лидов. Дальше в `input` идут краткое содержание ранней
+переписки и последние реплики (префикс, стабильный для одного лида между
+ответами), и только в самом конце — текущее сообщение с ярлыком намерения.
+"""
+import json
+from functools import cached_property
+from typing import Any
+
+from ..config import get_settings
+from .conversation import ROLE_LEAD, History, Turn
+from .intent import IntentLabel
+
+
+INTENT_LABELS = (
+    "- accept: пользователь подтверждает, что оставлял заявку и готов обсудить созвон.\n"
+    "- reject: пользователь отказывается, говорит что это ошибка или просит не писать.\n"
+    "- question: пользователь задаёт вопрос, и нужно ответить по нашему описанию.\n"
+    "- ambiguous: всё остальное.\n"
+)
+# Structured output пакетной классификации: ярлык для каждого id из входного списка.
+CLASSIFY_BATCH_FORMAT = {
+    "format": {
+        "type": "json_schema",
+        "name": "intent_labels",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "labels": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "id": {"type": "integer"},
+                            "label": {"type": "string", "enum": [label.value for label in IntentLabel]},
+                        },
+                        "required": ["id", "label"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["labels"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+class PromptBuilder:
+    @cached_property
+    def classify_instructions(self) -> str:
+        return (
+            "Ты работаешь в отделе продаж GordovCode. "
+            "Оцени сообщение лида и верни один ярлык из списка:\n"
+            f"{INTENT_LABELS}"
+            "Ответь только одним словом (accept/reject/question/ambiguous)."
+        )
+
+    @cached_property
+    def classify_batch_instructions(self) -> str:
+        return (
+            "Ты работаешь в отделе продаж GordovCode. "
+            "Тебе пришлют JSON-список сообщений разных лидов с их id. "
+            "Оцени каждое сообщение отдельно от остальных и верни для него один ярлык из списка:\n"
+            f"{INTENT_LABELS}"
+            "Верни ярлык для каждого id из входного списка."
+        )
+
+    @cached_property
+    def answer_instructions(self) -> str:
+        settings = get_settings()
+        return (
+            "Ты — ИИ-менеджер GordovCode и ведёшь переписку с лидом после отправки приглашения в календарь. "
+            "Лид уже получил приветствие со ссылкой на календарь и, возможно, напоминания.\n"
+            "Следуй сценарию:\n"
+            "1) Если пользователь говорит, что не получается записаться в календаре или возникают сложности с выбором времени, "
+            "ответь в стиле: \"Хорошо. Ничего страшного. В какой день и время Вам удобнее будет пообщаться в zoom?\" "
+            "Сохрани дружелюбный тон и не добавляй ссылку.\n"
+            "2) Если пользователь просит помочь без звонка или задаёт любой другой уточняющий вопрос, скажи, что можем обсудить и в переписке, "
+            "но созвон помогает быстрее разобраться, поэтому предложи выбрать время в календаре. "
+            f"Добавь строку с ссылкой 👉 {settings.calendly_link} и закончи фразой "
+            "\"Там же будет ссылка на Zoom. Ждем вас на встрече!\" без дополнительных подробностей.\n"
+            "3) Если пользователь просто подтверждает, что оставлял заявку и готов созвониться, поблагодари и скажи, что ждёте его на встрече. "
+            "Не присылай ссылку повторно.\n"
+            "Учитывай предыдущую переписку и не повторяй уже сказанное. "
+            "Отвечай на последнее сообщение лида; перед ним указана его классификация.\n"
+            "Используй информацию о GordovCode только если это помогает ответить на их вопрос:\n"
+            f"{settings.company_profile}"
+        )
+
+    @cached_property
+    def summary_instructions(self) -> str:
+        return (
+            "Сожми переписку менеджера GordovCode с лидом в 2-3 предложения: что лид хотел и спрашивал, "
+            "что ему ответили, о чём договорились и что осталось открытым. "
+            "Если есть прежнее краткое содержание, дополни его. Без вступлений, только суть."
+        )
+
+    @staticmethod
+    def classify_input(message: str) -> str:
+        return f"Сообщение лида: ```{message}```"
+
+    @staticmethod
+    def classify_batch_input(messages: list[str]) -> str:
+        items = [{"id": index, "message": message} for index, message in enumerate(messages)]
+        return json.dumps(items, ensure_ascii=False)
+
+    @staticmethod
+    def answer_input(message: str, intent_context: str, history: History | None = None) -> list[dict[str, Any]]:
+        items: list[dict[str, Any]] = []
+        if history and history.summary:
+            items.append({"role": "developer", "content": f"Краткое содержание ранней переписки: {history.summary}"})
+        for turn in history.turns if history else []:
+            items.append({"role": "user" if turn.role == ROLE_LEAD else "assistant", "content": turn.text})
+        items.append({"role": "user", "content": f"[классификация: {intent_context}]\n{message}"})
+        return items
+
+    @staticmethod
+    def summary_input(summary: str | None, turns: list[Turn]) -> str:
+        lines = [f"Прежнее краткое содержание: {summary}"] if summary else []
+        lines += [f"{'Лид' if turn.role == ROLE_LEAD else 'Менеджер'}: {turn.text}" for turn in turns]
+        return "\n".join(lines)
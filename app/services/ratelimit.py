@@ -0,0 +1,131 @@
+import asyncio
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Hashable, Mapping
+
+
+class WeightedGate:
+    """
+    Очередь к ресурсу, который обслуживает ожидающих по одному.
+
+    Ожидающие делятся на классы; когда ждут несколько классов, следующий
+    выбирается smooth weighted round robin. При постоянной конкуренции класс
+    получает долю, пропорциональную весу, а в одиночку — весь ресурс, и никто
+    не голодает. Класс без веса в `weights` весит 1.
+    """
+
+    def __init__(self, weights: Mapping[Hashable, int] | None = None) -> None:
+        self._weights = dict(weights or {})
+        self._waiters: dict[Hashable, deque[asyncio.Future[None]]] = defaultdict(deque)
+        self._credit: dict[Hashable, int] = defaultdict(int)
+        self._busy = False
+
+    @asynccontextmanager
+    async def turn(self, key: Hashable = None) -> AsyncIterator[None]:
+        if self._busy:
+            future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+            self._waiters[key].append(future)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Очередь уже дошла до нас — передаём её следующему.
+                    self._release()
+                else:
+                    self._waiters[key].remove(future)
+                raise
+        else:
+            self._busy = True
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self) -> None:
+        candidates = [key for key, waiters in self._waiters.items() if waiters]
+        if not candidates:
+            self._busy = False
+            return
+        total = 0
+        for key in candidates:
+            weight = self._weights.get(key, 1)
+            self._credit[key] += weight
+            total += weight
+        chosen = max(candidates, key=lambda key: self._credit[key])
+        self._credit[chosen] -= total
+        waiters = self._waiters[chosen]
+        waiters.popleft().set_result(None)
+        if not waiters:
+            # Класс, переставший ждать, не копит кредит на будущее.
+            self._credit[chosen] = 0
+
+
+class TokenBucket:
+    """
+    Адаптивный token bucket для одного Telegram-аккаунта.
+
+    Скорость растёт аддитивно после каждой успешной отправки (до `max_rate`)
+    и уменьшается вдвое на FloodWait, а сам bucket «замораживается» на время,
+    которое попросил Telegram. Так пропускная способность подстраивается под
+    реальный лимит аккаунта, а FloodWait служит сигналом обратного давления.
+    Токены раздаются классам ожидающих по весам `weights` (см. WeightedGate).
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: float,
+        *,
+        max_rate: float | None = None,
+        min_rate: float = 0.05,
+        increase_step: float = 0.01,
+        weights: Mapping[Hashable, int] | None = None,
+    ) -> None:
+        self._rate = rate
+        self._capacity = max(capacity, 1.0)
+        self._max_rate = max_rate if max_rate is not None else rate
+        self._min_rate = min_rate
+        self._increase_step = increase_step
+        self._tokens = self._capacity
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._gate = WeightedGate(weights)
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    @property
+    def blocked_for(self) -> float:
+        return max(0.0, self._blocked_until - time.monotonic())
+
+    async def acquire(self, key: Hashable = None) -> None:
+        async with self._gate.turn(key):
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                await asyncio.sleep((1.0 - self._tokens) / self._rate)
+
+    def on_success(self) -> None:
+        self._rate = min(self._max_rate, self._rate + self._increase_step)
+
+    def on_flood_wait(self, seconds: float) -> None:
+        now = time.monotonic()
+        self._refill(now)
+        self._rate = max(self._min_rate, self._rate / 2)
+        self._tokens = 0.0
+        self._blocked_until = max(self._blocked_until, now + seconds)
+
+    def _refill(self, now: float) -> None:
+        # Пока действует FloodWait, токены не копятся.
+        elapsed = now - max(self._updated_at, self._blocked_until)
+        self._updated_at = now
+        if elapsed > 0:
+            self._tokens = min(self._capacity, self._tokens + elapsed * self._rate)
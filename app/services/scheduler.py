@@ -0,0 +1,113 @@
+"""
+Приоритеты работы воркера.
+
+Вся работа воркера относится к одному из классов: ответы лидам, напоминания,
+новая рассылка. Класс текущей задачи хранится в contextvar и наследуется
+порождёнными задачами. По нему rate limiter аккаунта делит токены по весам
+SCHEDULER_WEIGHTS: в разгар рассылки ответ «да» получает токен раньше очередного
+приветствия, но и рассылка не останавливается. Предел очереди класса
+(SCHEDULER_QUEUE_LIMITS) — обратное давление: напоминания и рассылка не забирают
+новых лидов, пока их уже поставленная в очередь работа не разойдётся.
+"""
+import asyncio
+import contextvars
+import logging
+from collections import defaultdict
+from contextlib import contextmanager
+from enum import Enum
+from typing import Awaitable, Callable, Iterator
+
+from ..config import get_settings
+from .metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+# Пока очередь класса полна, её длина перепроверяется не реже этого интервала.
+BACKPRESSURE_POLL_SECONDS = 1.0
+
+SCHEDULER_ACTIVE = Gauge("scheduler_active_tasks", "Work items in progress by priority class.", ("work_class",))
+SCHEDULER_BACKPRESSURE = Counter(
+    "scheduler_backpressure_waits_total",
+    "Times a producer waited because the queue of its priority class was full.",
+    ("work_class",),
+)
+
+
+class WorkClass(str, Enum):
+    # В порядке приоритета.
+    reply = "reply"
+    follow_up = "follow_up"
+    outreach = "outreach"
+
+
+_current: contextvars.ContextVar[WorkClass | None] = contextvars.ContextVar("work_class", default=None)
+
+
+def current() -> WorkClass | None:
+    return _current.get()
+
+
+@contextmanager
+def work_class(value: WorkClass) -> Iterator[None]:
+    token = _current.set(value)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def rate_weights() -> dict[WorkClass | None, int]:
+    """Веса классов для rate limiter; работа вне классов (старт, служебные вызовы) весит 1."""
+    return {WorkClass(name): weight for name, weight in get_settings().scheduler_weights.items()}
+
+
+class WorkScheduler:
+    def __init__(self, limits: dict[str, int] | None = None) -> None:
+        limits = get_settings().scheduler_queue_limits if limits is None else limits
+        self._limits = {WorkClass(name): limit for name, limit in limits.items()}
+        self._active: dict[WorkClass, int] = defaultdict(int)
+        self._progress = {value: asyncio.Event() for value in WorkClass}
+
+    def active(self, value: WorkClass) -> int:
+        return self._active[value]
+
+    @contextmanager
+    def track(self, value: WorkClass) -> Iterator[None]:
+        """Единица работы класса в процессе; задаёт класс для всех вызовов внутри."""
+        self._active[value] += 1
+        SCHEDULER_ACTIVE.labels(work_class=value.value).set(self._active[value])
+        try:
+            with work_class(value):
+                yield
+        finally:
+            self._active[value] -= 1
+            SCHEDULER_ACTIVE.labels(work_class=value.value).set(self._active[value])
+            self.progress(value)
+
+    def progress(self, value: WorkClass) -> None:
+        """Очередь класса продвинулась — ожидающий reserve() перепроверит место."""
+        self._progress[value].set()
+
+    async def reserve(self, value: WorkClass, wanted: int, backlog: Callable[[], Awaitable[int]]) -> int:
+        """
+        Сколько новых единиц работы класса можно взять (не больше `wanted`). Очередь класса —
+        работа в процессе плюс `backlog()`; пока в ней нет места на целую пачку, ждём: неполная
+        пачка значила бы для воркера, что лиды кончились.
+        """
+        limit = self._limits.get(value)
+        if not limit:
+            return wanted
+        waited = False
+        while True:
+            self._progress[value].clear()
+            room = limit - self._active[value] - await backlog()
+            if room >= min(wanted, limit):
+                return min(wanted, room)
+            if not waited:
+                SCHEDULER_BACKPRESSURE.labels(work_class=value.value).inc()
+                logger.info("%s queue is full (limit %s), waiting before taking more work", value.value, limit)
+                waited = True
+            try:
+                await asyncio.wait_for(self._progress[value].wait(), BACKPRESSURE_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import re
+import time
+from contextlib import aclosing
+from typing import AsyncGenerator, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+# Предложение закончено, если после знака препинания идёт пробел или перевод строки.
+_SENTENCE_END = re.compile(r"[.!?…](\s|$)|\n")
+# Telegram держит статус «печатает» около 5 секунд.
+TYPING_REFRESH_SECONDS = 4.0
+
+
+class ProgressiveReply:
+    """
+    Доставляет потоковый ответ в чат: «печатает…» пока идёт генерация,
+    первое сообщение — как только готово первое предложение, дальше правки
+    не чаще `edit_interval` секунд и финальная правка с полным текстом.
+    Если id первого сообщения неизвестен, остаток уходит вторым сообщением.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str], Awaitable[int | None]],
+        edit: Callable[[int, str], Awaitable[None]],
+        typing: Callable[[], Awaitable[None]],
+        *,
+        edit_interval: float,
+        before_first_send: Callable[[], None] | None = None,
+    ) -> None:
+        self._send = send
+        self._edit = edit
+        self._typing = typing
+        self._edit_interval = edit_interval
+        self._before_first_send = before_first_send
+        self.time_to_first_message: float | None = None
+        # Итоговый текст, который увидел лид, и id его сообщения.
+        self.text = ""
+        self.message_id: int | None = None
+
+    async def deliver(self, chunks: AsyncGenerator[str, None]) -> bool:
+        """
+        Возвращает True, если лид получил сообщение. Ошибка до первой отправки
+        пробрасывается — вызывающий код может ответить без стриминга. Поток
+        закрывается в любом случае, чтобы не держать слот шлюза OpenAI.
+        """
+        started = time.monotonic()
+        typing_task = asyncio.create_task(self._keep_typing())
+        buffer = ""
+        shown = ""
+        first_sent = False
+        message_id: int | None = None
+        last_edit = 0.0
+        try:
+            async with aclosing(chunks):
+                async for chunk in chunks:
+                    buffer += chunk
+                    if not first_sent:
+                        if not _SENTENCE_END.search(buffer):
+                            continue
+                        message_id = self.message_id = await self._send_first(buffer.strip())
+                        first_sent = True
+                        shown = buffer
+                        self.time_to_first_message = time.monotonic() - started
+                        last_edit = time.monotonic()
+                    elif (
+                        message_id is not None
+                        and time.monotonic() - last_edit >= self._edit_interval
+                        and buffer.strip() != shown.strip()
+                    ):
+                        await self._edit(message_id, buffer.strip())
+                        shown = buffer
+                        last_edit = time.monotonic()
+        except Exception:
+            if not first_sent:
+                raise
+            logger.exception("Reply stream broke after the first message, finishing with partial text")
+        finally:
+            typing_task.cancel()
+
+        final_text = buffer.strip()
+        self.text = final_text
+        if not first_sent:
+            if not final_text:
+                return False
+            self.message_id = await self._send_first(final_text)
+            self.time_to_first_message = time.monotonic() - started
+            return True
+        if message_id is None:
+            # Первое сообщение не поправить — остаток ответа отправляем отдельным.
+            rest = buffer[len(shown):].strip()
+            if rest:
+                try:
+                    await self._send(rest)
+                except Exception:
+                    # Первое предложение лид уже видел: полный ответ заново не шлём.
+                    logger.exception("Failed to send the rest of a streamed reply")
+                    self.text = shown.strip()
+            return True
+        if final_text and final_text != shown.strip():
+            await self._edit(message_id, final_text)
+        return True
+
+    async def _send_first(self, text: str) -> int | None:
+        if self._before_first_send:
+            self._before_first_send()
+        return await self._send(text)
+
+    async def _keep_typing(self) -> None:
+        while True:
+            try:
+                await self._typing()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.debug("Failed to send typing action", exc_info=True)
+            await asyncio.sleep(TYPING_REFRESH_SECONDS)
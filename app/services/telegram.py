@@ -1,206 +1,1059 @@
 import asyncio
 import logging
-from typing import Iterable
+import os
+import socket
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Any, Awaitable, Callable, TypeVar
 
-from pyrogram import Client, filters
-from pyrogram.errors import RPCError
+from pyrogram import Client, enums, filters, raw, utils
+from pyrogram.errors import (
+    AuthKeyDuplicated,
+    FloodWait,
+    InternalServerError,
+    PeerFlood,
+    RandomIdDuplicate,
+    RPCError,
+    Unauthorized,
+    UsernameInvalid,
+    UsernameNotOccupied,
+)
 from pyrogram.handlers import MessageHandler
 from pyrogram.raw.types import InputPhoneContact
-from pyrogram.types import Message, User
+from pyrogram.types import Message
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import select
 
 from ..config import get_settings
-from ..db import get_session
-from ..models import Lead, LeadStatus
+from ..db import get_async_session
+from ..models import Lead, LeadStatus, OutboxMessage, OutboxStatus
+from . import follow_up, outbox, scheduler
+from .accounts import AccountPool, AccountUnavailable, TelegramAccount
+from .cache import LRUCache
+from .coalesce import MessageCoalescer
+from .conversation import ROLE_ASSISTANT, ROLE_LEAD, ConversationLog, History
+from .identity import ResolvedUser, phone_key, username_key
+from .metrics import Counter, Histogram, Timer
 from .nlp import IntentLabel, LeadConversationAI
+from .scheduler import WorkClass, WorkScheduler
+from .streaming import ProgressiveReply
 
 logger = logging.getLogger(__name__)
-settings = get_settings()
+
+T = TypeVar("T")
+
+# Сколько контактов отправляем в одном вызове import_contacts.
+IMPORT_CHUNK_SIZE = 100
+# PEER_FLOOD — аккаунт ограничен за спам; снова пробуем писать с него не раньше чем через столько секунд.
+PEER_FLOOD_COOLDOWN_SECONDS = 6 * 3600
+# Отправители, не найденные среди лидов: столько помним, чтобы не ходить в БД на каждое их сообщение.
+# Короткий TTL — лида могли только что поприветствовать с другого воркера.
+UNKNOWN_SENDERS_CAPACITY = 10_000
+UNKNOWN_SENDER_TTL_SECONDS = 60.0
+# Ответы, которые генерирует модель и которые можно отдавать потоком, и статус лида после них.
+STREAMED_STATUSES = {
+    IntentLabel.accept: LeadStatus.scheduled,
+    IntentLabel.question: LeadStatus.awaiting_confirmation,
+}
+# Класс приоритета, с которым уходит сообщение outbox каждого вида.
+OUTBOX_CLASSES = {
+    outbox.KIND_REPLY: WorkClass.reply,
+    outbox.KIND_REMINDER: WorkClass.follow_up,
+    outbox.KIND_GREETING: WorkClass.outreach,
+}
+
+PIPELINE_STAGE_SECONDS = Histogram(
+    "pipeline_stage_seconds",
+    "Duration of each stage of the outreach and reply pipelines.",
+    ("pipeline", "stage"),
+)
+REPLY_FIRST_MESSAGE_SECONDS = Histogram(
+    "reply_first_message_seconds",
+    "Time from starting a streamed reply to delivering its first chunk to Telegram.",
+)
+TELEGRAM_REQUESTS = Counter("telegram_requests_total", "Telegram API calls made by the worker.", ("account", "method"))
+FLOOD_WAITS = Counter("telegram_flood_waits_total", "FloodWait errors returned by Telegram.", ("account", "method"))
+REPLIES = Counter("lead_replies_total", "Handled bursts of lead messages by intent and delivery.", ("intent", "delivery"))
+REPLY_FALLBACKS = Counter("reply_fallbacks_total", "Replies sent from a template because the LLM failed.", ("intent",))
+FOLLOW_UPS = Counter("lead_follow_ups_total", "Follow-up actions: reminder sent, lead expired or skipped.", ("action",))
+
+
+def _stage(pipeline: str, stage: str) -> Timer:
+    return PIPELINE_STAGE_SECONDS.labels(pipeline=pipeline, stage=stage).time()
 
 
 class TelegramLeadService:
-    def __init__(self) -> None:
-        self._client = Client(
-            settings.telegram_session_name,
-            api_id=settings.telegram_api_id,
-            api_hash=settings.telegram_api_hash,
-            bot_token=settings.telegram_bot_token,
-            workdir=settings.telegram_session_dir,
-        )
+    def __init__(self, client: Client | None = None, *, accounts: AccountPool | None = None) -> None:
+        settings = get_settings()
+        self._accounts = accounts or AccountPool.from_settings(client)
         self._conversation_ai = LeadConversationAI()
-        self._lock = asyncio.Lock()
+        self._conversation_log = ConversationLog()
+        self._worker_id = settings.worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self._last_reap_at = 0.0
+        # (аккаунт, telegram_user_id) → id последнего лида: сообщения не от лидов отсекаем без запроса в БД.
+        self._lead_ids: dict[tuple[str, int], int] = {}
+        self._unknown_senders: LRUCache[tuple[str, int], bool] = LRUCache(
+            UNKNOWN_SENDERS_CAPACITY, ttl=UNKNOWN_SENDER_TTL_SECONDS
+        )
+        self._conversations: MessageCoalescer[int, Message] = MessageCoalescer(
+            settings.reply_debounce_seconds,
+            self._reply_to_burst,
+        )
+        self._scheduler = WorkScheduler()
+        # Отдельный отправитель на каждый вид сообщений: пачка приветствий не держит ответы.
+        self._outbox = {
+            kind: outbox.OutboxSender(self._send_outbox_message, self._outbox_failed, kinds=(kind,))
+            for kind in OUTBOX_CLASSES
+        }
+        self._follow_ups = follow_up.FollowUpScheduler(
+            self._follow_up,
+            admit=partial(
+                self._scheduler.reserve, WorkClass.follow_up, backlog=self._outbox[outbox.KIND_REMINDER].backlog
+            ),
+        )
+        self._outreach_slots = asyncio.Semaphore(settings.outreach_concurrency)
         self._started = False
 
     async def start(self) -> None:
         if self._started:
             return
-        await self._client.start()
-        self._client.add_handler(MessageHandler(self._handle_incoming_message, filters.private))
+        await self._accounts.start()
+        self._lead_ids = await self._load_lead_index()
+        logger.info("Lead index warmed with %s Telegram users", len(self._lead_ids))
+        for account in self._accounts:
+            # Ответ лида приходит тому аккаунту, который ему писал.
+            account.client.add_handler(
+                MessageHandler(partial(self._handle_incoming_message, account), filters.private)
+            )
+        for sender in self._outbox.values():
+            await sender.start()
+        if get_settings().follow_up_enabled:
+            await self._follow_ups.start()
         self._started = True
-        logger.info("Telegram client started")
+        logger.info("Telegram clients started: %s", ", ".join(account.name for account in self._accounts))
 
     async def stop(self) -> None:
         if not self._started:
             return
-        await self._client.stop()
+        await self._follow_ups.close()
+        await self._conversations.close()
+        for sender in self._outbox.values():
+            await sender.close()
+        await self._accounts.stop()
         self._started = False
 
-    async def process_pending(self, limit: int = 10) -> None:
-        async with self._lock:
-            leads = self._fetch_leads_by_status([LeadStatus.pending], limit)
-            for lead in leads:
-                await self._touch_lead(lead)
+    async def process_pending(self, limit: int | None = None) -> int:
+        """
+        Обрабатывает пачку pending-лидов и возвращает их количество. Пока очередь рассылки
+        (SCHEDULER_QUEUE_LIMITS) полна неотправленными приветствиями, новых лидов не берёт.
+        """
+        with scheduler.work_class(WorkClass.outreach):
+            return await self._process_pending(limit or get_settings().outreach_batch_size)
+
+    async def _process_pending(self, limit: int) -> int:
+        if time.monotonic() - self._last_reap_at >= get_settings().lease_reaper_interval:
+            self._last_reap_at = time.monotonic()
+            await self.reclaim_expired_leases()
+        accounts = self._accounts.available()
+        if not accounts:
+            logger.warning("All Telegram accounts are limited or disabled, outreach paused")
+            return 0
+        with _stage("outreach", "backpressure"):
+            limit = await self._scheduler.reserve(WorkClass.outreach, limit, self._outbox[outbox.KIND_GREETING].backlog)
+        with _stage("outreach", "claim"):
+            leads = await self._claim_pending_leads(limit)
+        if not leads:
+            return 0
+        batches: dict[str, list[Lead]] = defaultdict(list)
+        for lead in leads:
+            batches[self._accounts.pick(lead.id or 0, accounts).name].append(lead)
+        await asyncio.gather(
+            *(self._process_account_batch(self._accounts.get(name), batch) for name, batch in batches.items())
+        )
+        return len(leads)
 
-    async def _touch_lead(self, lead: Lead) -> None:
+    async def _process_account_batch(self, account: TelegramAccount, leads: list[Lead]) -> None:
         try:
-            greeting = await self._conversation_ai.generate_greeting(lead.name)
-        except Exception:
-            logger.exception("Failed to generate greeting via GPT for lead %s, using fallback", lead.id)
-            greeting = settings.greeting_template.format(name=lead.name, calendly_link=settings.calendly_link)
+            with _stage("outreach", "import_contacts"):
+                phone_users = await self._resolve_phones(account, leads)
+        except (FloodWait, AccountUnavailable) as exc:
+            logger.warning("Contact import via %s postponed (%r), releasing %s leads", account.name, exc, len(leads))
+            for lead in leads:
+                await self._release_lead(lead.id)
+            return
+        await asyncio.gather(
+            *(self._touch_lead_bounded(account, lead, phone_users.get(lead.id)) for lead in leads)
+        )
+
+    async def _touch_lead_bounded(self, account: TelegramAccount, lead: Lead, phone_user: ResolvedUser | None) -> None:
+        async with self._outreach_slots:
+            with self._scheduler.track(WorkClass.outreach):
+                try:
+                    await self._touch_lead(account, lead, phone_user)
+                except (FloodWait, AccountUnavailable) as exc:
+                    # Возвращаем лида в очередь; если аккаунт выбыл из пула, лид достанется другому.
+                    logger.warning("Lead %s postponed: %r", lead.id, exc)
+                    await self._release_lead(lead.id)
+                except Exception:
+                    # Лид останется за этим воркером до истечения аренды, потом его подберёт reaper.
+                    logger.exception("Failed to process lead %s", lead.id)
+
+    async def _call_telegram(
+        self,
+        account: TelegramAccount,
+        method: Callable[..., Awaitable[T]],
+        *args: Any,
+        **kwargs: Any,
+    ) -> T:
+        """
+        Вызывает RPC через rate limiter аккаунта, повторяя запрос после FloodWait.
+        Долгий FloodWait, PEER_FLOOD или потеря авторизации выводят аккаунт из пула (AccountUnavailable).
+        """
+        settings = get_settings()
+        attempts = 0
+        method_name = getattr(method, "__name__", "call")
+        if method_name == "invoke" and args:
+            method_name = type(args[0]).__name__
+        while True:
+            if not account.available:
+                raise AccountUnavailable(account.name)
+            # Токен аккаунта делится между ответами, напоминаниями и рассылкой по весам.
+            await account.rate_limiter.acquire(scheduler.current())
+            TELEGRAM_REQUESTS.labels(account=account.name, method=method_name).inc()
+            try:
+                result = await method(*args, **kwargs)
+            except FloodWait as exc:
+                attempts += 1
+                FLOOD_WAITS.labels(account=account.name, method=method_name).inc()
+                wait_seconds = float(exc.value or 1)
+                if wait_seconds > settings.telegram_account_flood_limit_seconds:
+                    account.limit(wait_seconds, f"FloodWait on {method_name}")
+                    raise AccountUnavailable(account.name) from exc
+                account.rate_limiter.on_flood_wait(wait_seconds)
+                logger.warning(
+                    "FloodWait %ss on %s via %s, send rate lowered to %.2f/s",
+                    wait_seconds,
+                    method_name,
+                    account.name,
+                    account.rate_limiter.rate,
+                )
+                if attempts > settings.telegram_flood_retries:
+                    raise
+                continue
+            except PeerFlood as exc:
+                account.limit(PEER_FLOOD_COOLDOWN_SECONDS, "PEER_FLOOD")
+                raise AccountUnavailable(account.name) from exc
+            except (Unauthorized, AuthKeyDuplicated) as exc:
+                account.disable(repr(exc))
+                raise AccountUnavailable(account.name) from exc
+            account.rate_limiter.on_success()
+            return result
+
+    async def _touch_lead(self, account: TelegramAccount, lead: Lead, phone_user: ResolvedUser | None = None) -> None:
+        with _stage("outreach", "total"):
+            await self._touch_lead_stages(account, lead, phone_user)
+
+    async def _touch_lead_stages(self, account: TelegramAccount, lead: Lead, phone_user: ResolvedUser | None) -> None:
+        settings = get_settings()
+        with _stage("outreach", "greeting"):
+            try:
+                greeting = await self._conversation_ai.generate_greeting(lead.name)
+            except Exception:
+                logger.exception("Failed to generate greeting via GPT for lead %s, using fallback", lead.id)
+                greeting = settings.greeting_template.format(name=lead.name, calendly_link=settings.calendly_link)
 
-        user, used_phone = await self._resolve_user_for_lead(lead)
+        with _stage("outreach", "resolve_user"):
+            user, _ = await self._resolve_user_for_lead(account, lead, phone_user)
         if not user:
             logger.warning("Telegram user not found for lead %s", lead.id)
-            self._update_lead_status(lead.id, LeadStatus.rejected, note="User not found in Telegram")
+            await self._update_lead_status(lead.id, LeadStatus.rejected, note="User not found in Telegram")
             return
 
-        delivered_user = await self._deliver_greeting(lead, user, greeting, used_phone)
-        if not delivered_user:
-            return
+        # Приветствие уходит через outbox: лид освобождается сразу после коммита.
+        with _stage("outreach", "enqueue_greeting"):
+            await self._enqueue_greeting(account, lead, user, greeting)
+
+    async def _enqueue_greeting(self, account: TelegramAccount, lead: Lead, user: ResolvedUser, greeting: str) -> None:
+        """
+        Назначает лиду пользователя и аккаунт и ставит приветствие в outbox одной транзакцией.
+        Если лида успели изменить (аренду забрал другой воркер, лид ответил), ничего не делаем.
+        """
+        lead_id = lead.id
+        dedupe_key = f"greeting:{lead_id}:{account.name}:{user.id}"
+        now = datetime.utcnow()
+        due_at = follow_up.next_action_at(0)
+        assign = (
+            update(Lead)
+            .where(Lead.id == lead_id, Lead.updated_at == lead.updated_at)
+            .values(
+                telegram_user_id=user.id,
+                telegram_access_hash=user.access_hash,
+                telegram_account=account.name,
+                status=LeadStatus.awaiting_confirmation,
+                follow_up_step=0,
+                next_action_at=due_at,
+                claimed_by=None,
+                lease_expires_at=None,
+                updated_at=now,
+            )
+        )
+        async with get_async_session() as session:
+            result = await session.execute(assign)
+            if not result.rowcount:
+                logger.warning("Lead %s changed while its greeting was prepared, greeting dropped", lead_id)
+                return
+            outbox.enqueue(
+                session,
+                dedupe_key=dedupe_key,
+                lead_id=lead_id,
+                kind=outbox.KIND_GREETING,
+                account=account.name,
+                telegram_user_id=user.id,
+                text=greeting,
+            )
+            try:
+                await session.commit()
+            except IntegrityError:
+                # Лид вернулся в очередь и снова попал на тот же аккаунт: неотправленное приветствие
+                # ставим в очередь заново, уже отправленное или ожидающее не дублируем. Лид в любом
+                # случае освобождаем и переводим в ожидание ответа.
+                await session.rollback()
+                result = await session.execute(assign)
+                if not result.rowcount:
+                    logger.warning("Lead %s changed while its greeting was prepared, greeting dropped", lead_id)
+                    return
+                rearmed = await session.execute(
+                    update(OutboxMessage)
+                    .where(OutboxMessage.dedupe_key == dedupe_key, OutboxMessage.status == OutboxStatus.failed)
+                    .values(
+                        status=OutboxStatus.pending,
+                        text=greeting,
+                        attempts=0,
+                        next_attempt_at=now,
+                        last_error=None,
+                    )
+                )
+                await session.commit()
+                if not rearmed.rowcount:
+                    logger.warning("Greeting for lead %s to user %s is already queued", lead_id, user.id)
+        self._lead_ids[(account.name, user.id)] = lead_id
+        self._unknown_senders.pop((account.name, user.id))
+        self._outbox[outbox.KIND_GREETING].notify()
+        if due_at:
+            self._follow_ups.notify(due_at)
 
-        with get_session() as session:
-            db_lead = session.get(Lead, lead.id)
-            if not db_lead:
+    async def _send_outbox_message(self, message: OutboxMessage) -> int | None:
+        account = self._accounts.get(message.telegram_account)
+        if account is None or account.disabled_reason:
+            raise outbox.DeliveryFailed(f"Telegram account {message.telegram_account} is not in the pool")
+        if not account.available:
+            self._defer_outbox_message(account, message)
+        try:
+            with _stage("outbox", "send"), scheduler.work_class(OUTBOX_CLASSES[message.kind]):
+                return await self._send_text(
+                    account,
+                    message.telegram_user_id,
+                    message.text,
+                    random_id=outbox.random_id(message.dedupe_key),
+                )
+        except RandomIdDuplicate:
+            # Прошлая попытка дошла до Telegram, но не успела записать результат.
+            return None
+        except AccountUnavailable as exc:
+            self._defer_outbox_message(account, message, exc)
+        except (FloodWait, InternalServerError):
+            raise
+        except RPCError as exc:
+            raise outbox.DeliveryFailed(repr(exc)) from exc
+
+    @staticmethod
+    def _defer_outbox_message(
+        account: TelegramAccount,
+        message: OutboxMessage,
+        cause: Exception | None = None,
+    ) -> None:
+        """
+        Аккаунт ограничен или отключён. Приветствие отдаём другому аккаунту (лид вернётся
+        в очередь), а ответ и напоминание ждут: переписку с лидом ведёт только этот аккаунт.
+        """
+        reason = account.disabled_reason or f"account {account.name} is limited"
+        if account.disabled_reason or message.kind == outbox.KIND_GREETING:
+            raise outbox.DeliveryFailed(reason) from cause
+        raise outbox.RetryLater(account.limited_until - time.monotonic(), reason) from cause
+
+    async def _outbox_failed(self, message: OutboxMessage, error: str) -> None:
+        """Приветствие не доставлено: пробуем пользователя по username, иначе закрываем или отдаём лида другому аккаунту."""
+        if message.kind != outbox.KIND_GREETING:
+            return
+        lead = await self._get_lead(message.lead_id)
+        if (
+            lead is None
+            or lead.status != LeadStatus.awaiting_confirmation
+            or lead.telegram_user_id != message.telegram_user_id
+        ):
+            return
+        account = self._accounts.get(message.telegram_account)
+        if account is None or not account.available:
+            await self._requeue_lead(lead)
+            return
+        # Если писали найденному по телефону, запасной вариант — пользователь по username.
+        if lead.telegram_username:
+            try:
+                fallback_user = await self._get_user_by_username(account, lead.telegram_username)
+            except (FloodWait, AccountUnavailable):
+                await self._requeue_lead(lead)
+                return
+            if fallback_user and fallback_user.id != message.telegram_user_id:
+                await self._enqueue_greeting(account, lead, fallback_user, message.text)
                 return
-            db_lead.telegram_user_id = delivered_user.id
-            db_lead.telegram_access_hash = getattr(delivered_user, "access_hash", None)
-            db_lead.status = LeadStatus.awaiting_confirmation
-            db_lead.mark_updated()
-            session.add(db_lead)
-            session.commit()
-
-    def _fetch_leads_by_status(self, statuses: Iterable[LeadStatus], limit: int) -> list[Lead]:
-        with get_session() as session:
-            statement = (
-                select(Lead)
-                .where(Lead.status.in_(tuple(statuses)))
-                .order_by(Lead.created_at)
-                .limit(limit)
+        await self._update_lead_status(lead.id, LeadStatus.rejected, note=error)
+
+    async def _requeue_lead(self, lead: Lead) -> None:
+        """Возвращает лида в очередь рассылки: его заново найдёт и поприветствует доступный аккаунт."""
+        async with get_async_session() as session:
+            await session.execute(
+                update(Lead)
+                .where(Lead.id == lead.id, Lead.updated_at == lead.updated_at)
+                .values(
+                    status=LeadStatus.pending,
+                    telegram_account=None,
+                    next_action_at=None,
+                    follow_up_step=0,
+                    updated_at=datetime.utcnow(),
+                )
             )
-            return list(session.exec(statement).all())
+            await session.commit()
+        self._lead_ids = {key: value for key, value in self._lead_ids.items() if value != lead.id}
+        logger.warning("Lead %s returned to the outreach queue", lead.id)
+
+    @staticmethod
+    async def _find_lead_id(account_name: str, telegram_user_id: int) -> int | None:
+        """Последний лид пользователя, которому писал этот аккаунт."""
+        owner = Lead.telegram_account == account_name
+        if account_name == get_settings().telegram_session_name:
+            owner = or_(owner, Lead.telegram_account.is_(None))
+        async with get_async_session() as session:
+            return (
+                await session.exec(
+                    select(Lead.id)
+                    .where(Lead.telegram_user_id == telegram_user_id, owner)
+                    .order_by(Lead.id.desc())
+                    .limit(1)
+                )
+            ).first()
 
-    def _update_lead_status(self, lead_id: int | None, status: LeadStatus, note: str | None = None) -> None:
+    @staticmethod
+    async def _load_lead_index() -> dict[tuple[str, int], int]:
+        async with get_async_session() as session:
+            rows = (
+                await session.exec(
+                    select(Lead.telegram_account, Lead.telegram_user_id, Lead.id)
+                    .where(Lead.telegram_user_id.is_not(None))
+                    .order_by(Lead.id)
+                )
+            ).all()
+        # При нескольких лидах на одного пользователя побеждает самый свежий.
+        return {
+            (account or get_settings().telegram_session_name, telegram_user_id): lead_id
+            for account, telegram_user_id, lead_id in rows
+        }
+
+    async def _claim_pending_leads(self, limit: int) -> list[Lead]:
+        """
+        Атомарно переводит до `limit` pending-лидов в contact_in_progress за этим воркером.
+
+        На Postgres подзапрос берёт строки через FOR UPDATE SKIP LOCKED, поэтому
+        параллельные воркеры получают непересекающиеся пачки. SQLite сериализует
+        пишущие транзакции, и тот же UPDATE … WHERE id IN (SELECT …) там тоже атомарен.
+        """
+        now = datetime.utcnow()
+        candidates = (
+            select(Lead.id)
+            .where(Lead.status == LeadStatus.pending)
+            .order_by(Lead.created_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        statement = (
+            update(Lead)
+            .where(Lead.id.in_(candidates), Lead.status == LeadStatus.pending)
+            .values(
+                status=LeadStatus.contact_in_progress,
+                claimed_by=self._worker_id,
+                lease_expires_at=now + timedelta(seconds=get_settings().lead_lease_seconds),
+                updated_at=now,
+            )
+            .returning(Lead)
+            .execution_options(synchronize_session=False)
+        )
+        async with get_async_session() as session:
+            leads = list((await session.execute(statement)).scalars().all())
+            await session.commit()
+        leads.sort(key=lambda lead: lead.created_at)
+        return leads
+
+    async def _release_lead(self, lead_id: int | None) -> None:
+        if not lead_id:
+            return
+        async with get_async_session() as session:
+            await session.execute(
+                update(Lead)
+                .where(
+                    Lead.id == lead_id,
+                    Lead.status == LeadStatus.contact_in_progress,
+                    Lead.claimed_by == self._worker_id,
+                )
+                .values(
+                    status=LeadStatus.pending,
+                    claimed_by=None,
+                    lease_expires_at=None,
+                    updated_at=datetime.utcnow(),
+                )
+            )
+            await session.commit()
+
+    async def reclaim_expired_leases(self) -> int:
+        """Возвращает в pending лидов, чья аренда истекла (воркер упал или завис)."""
+        now = datetime.utcnow()
+        async with get_async_session() as session:
+            result = await session.execute(
+                update(Lead)
+                .where(
+                    Lead.status == LeadStatus.contact_in_progress,
+                    Lead.lease_expires_at < now,
+                )
+                .values(
+                    status=LeadStatus.pending,
+                    claimed_by=None,
+                    lease_expires_at=None,
+                    updated_at=now,
+                )
+            )
+            await session.commit()
+        if result.rowcount:
+            logger.warning("Reclaimed %s leads with expired leases", result.rowcount)
+        return result.rowcount
+
+    async def _update_lead_status(self, lead_id: int | None, status: LeadStatus, note: str | None = None) -> None:
         if not lead_id:
             return
-        with get_session() as session:
-            lead = session.get(Lead, lead_id)
+        async with get_async_session() as session:
+            lead = await session.get(Lead, lead_id)
             if not lead:
                 return
             lead.status = status
             lead.notes = note
+            lead.release_claim()
             lead.mark_updated()
             session.add(lead)
-            session.commit()
+            await session.commit()
 
-    async def _get_user_by_username(self, username: str) -> User | None:
+    async def _get_user_by_username(self, account: TelegramAccount, username: str) -> ResolvedUser | None:
         normalized = username.strip().lstrip("@")
         if not normalized:
             return None
+        user = await account.peers.get_by_username(normalized)
+        if user:
+            return user
+        key = username_key(normalized)
+        cached, user = await account.identity_cache.get(key)
+        if cached:
+            return user
         try:
-            return await self._client.get_users(normalized)
+            # ResolveUsername напрямую, чтобы получить access_hash (в types.User его нет).
+            resolved = await self._call_telegram(
+                account,
+                account.client.invoke,
+                raw.functions.contacts.ResolveUsername(username=normalized),
+            )
+        except FloodWait:
+            raise
         except RPCError as exc:
             logger.warning("Failed to resolve username %s: %s", username, exc)
+            if isinstance(exc, (UsernameInvalid, UsernameNotOccupied)):
+                await account.identity_cache.put_many({key: None})
             return None
+        user_id = getattr(resolved.peer, "user_id", None)
+        found = next((item for item in resolved.users if item.id == user_id), None)
+        user = ResolvedUser.from_telegram(found) if found else None
+        await account.identity_cache.put_many({key: user})
+        if user:
+            account.peers.remember(user)
+        return user
 
-    async def _import_user_by_phone(self, lead: Lead) -> User | None:
-        if not lead.phone:
-            return None
+    async def _resolve_phones(self, account: TelegramAccount, leads: list[Lead]) -> dict[int, ResolvedUser]:
+        """
+        Резолвит телефоны всей пачки: сначала из кэша, остальные — одним import_contacts
+        на каждые IMPORT_CHUNK_SIZE номеров. Возвращает пользователей по id лида.
+        """
+        keys_by_lead = {lead.id: phone_key(lead.phone) for lead in leads if lead.id and lead.phone}
+        if not keys_by_lead:
+            return {}
+        resolved = await account.identity_cache.get_many(keys_by_lead.values())
+        for user in resolved.values():
+            if user:
+                account.peers.remember(user)
+
+        # Дубликаты номера в пачке импортируем один раз.
+        to_import: dict[str, Lead] = {}
+        for lead in leads:
+            key = keys_by_lead.get(lead.id)
+            if key and key not in resolved and key not in to_import:
+                to_import[key] = lead
+
+        pending = list(to_import.items())
+        for start in range(0, len(pending), IMPORT_CHUNK_SIZE):
+            chunk = dict(pending[start:start + IMPORT_CHUNK_SIZE])
+            imported = await self._import_contacts(account, list(chunk.values()))
+            if imported is None:
+                continue
+            entries: dict[str, ResolvedUser | None] = {}
+            for key, lead in chunk.items():
+                if lead.id in imported:
+                    user = imported[lead.id]
+                    entries[key] = user
+                    if user and user.username:
+                        entries[username_key(user.username)] = user
+            await account.identity_cache.put_many(entries)
+            resolved.update({key: entries[key] for key in chunk if key in entries})
+
+        return {
+            lead_id: user
+            for lead_id, key in keys_by_lead.items()
+            if (user := resolved.get(key)) is not None
+        }
+
+    async def _import_contacts(
+        self,
+        account: TelegramAccount,
+        leads: list[Lead],
+    ) -> dict[int, ResolvedUser | None] | None:
+        """
+        Импортирует контакты пачкой и сопоставляет результат с лидами по client_id.
+        Лиды, которые Telegram попросил повторить позже, в результат не попадают.
+        """
         try:
-            result = await self._client.import_contacts(
-                [InputPhoneContact(client_id=lead.id or 0, phone=lead.phone, first_name=lead.name, last_name="")]
+            result = await self._call_telegram(
+                account,
+                account.client.import_contacts,
+                [
+                    InputPhoneContact(client_id=lead.id or 0, phone=lead.phone, first_name=lead.name, last_name="")
+                    for lead in leads
+                ],
             )
-            return result.users[0] if result.users else None
+        except FloodWait:
+            raise
         except RPCError as exc:
-            logger.warning("Failed to import contact for lead %s: %s", lead.id, exc)
+            logger.warning("Failed to import %s contacts: %s", len(leads), exc)
             return None
+        users = {user.id: ResolvedUser.from_telegram(user) for user in result.users}
+        for user in users.values():
+            account.peers.remember(user)
+        user_by_client = {item.client_id: users.get(item.user_id) for item in result.imported}
+        retry = set(result.retry_contacts or [])
+        return {
+            lead.id: user_by_client.get(lead.id)
+            for lead in leads
+            if lead.id is not None and lead.id not in retry
+        }
 
-    async def _resolve_user_for_lead(self, lead: Lead) -> tuple[User | None, bool]:
-        # Сначала пробуем найти по телефону (импорт контакта),
+    async def _resolve_user_for_lead(
+        self,
+        account: TelegramAccount,
+        lead: Lead,
+        phone_user: ResolvedUser | None = None,
+    ) -> tuple[ResolvedUser | None, bool]:
+        # Сначала используем найденного по телефону (импорт контакта),
         # если не удалось — пробуем по username.
-        if lead.phone:
-            user = await self._import_user_by_phone(lead)
-            if user:
-                return user, True  # True = использовали телефон
+        if phone_user:
+            return phone_user, True  # True = использовали телефон
         if lead.telegram_username:
-            user = await self._get_user_by_username(lead.telegram_username)
+            user = await self._get_user_by_username(account, lead.telegram_username)
             if user:
                 return user, False
         return None, False
 
-    async def _deliver_greeting(
+    async def _send_text(
+        self,
+        account: TelegramAccount,
+        user_id: int,
+        text: str,
+        *,
+        random_id: int | None = None,
+    ) -> int | None:
+        """
+        Отправляет сообщение и возвращает его id. При известном access_hash пир собирается
+        из кэша без resolve-запросов, иначе его резолвит сессия Pyrogram. Постоянный
+        `random_id` делает повтор отправки безопасным: Telegram его отклонит.
+        """
+        peer = await account.peers.input_peer(user_id)
+        if peer is None:
+            peer = await self._call_telegram(account, account.client.resolve_peer, user_id)
+            if isinstance(peer, raw.types.InputPeerUser):
+                account.peers.remember(ResolvedUser(id=peer.user_id, access_hash=peer.access_hash, username=None))
+        parsed = await utils.parse_text_entities(account.client, text, None, None)
+        updates = await self._call_telegram(
+            account,
+            account.client.invoke,
+            raw.functions.messages.SendMessage(peer=peer, random_id=random_id or account.client.rnd_id(), **parsed),
+        )
+        return _sent_message_id(updates)
+
+    async def _edit_text(self, account: TelegramAccount, user_id: int, message_id: int, text: str) -> None:
+        peer = await account.peers.input_peer(user_id)
+        if peer is None:
+            await self._call_telegram(account, account.client.edit_message_text, user_id, message_id, text)
+            return
+        parsed = await utils.parse_text_entities(account.client, text, None, None)
+        await self._call_telegram(
+            account,
+            account.client.invoke,
+            raw.functions.messages.EditMessage(peer=peer, id=message_id, **parsed),
+        )
+
+    async def _send_typing(self, account: TelegramAccount, user_id: int) -> None:
+        # Статус «печатает» не расходует лимит сообщений: идёт мимо rate limiter.
+        peer = await account.peers.input_peer(user_id)
+        if peer is None:
+            await account.client.send_chat_action(user_id, enums.ChatAction.TYPING)
+            return
+        await account.client.invoke(
+            raw.functions.messages.SetTyping(peer=peer, action=raw.types.SendMessageTypingAction())
+        )
+
+    async def _stream_reply(
         self,
+        account: TelegramAccount,
+        user_id: int,
         lead: Lead,
-        user: User,
-        greeting: str,
-        used_phone: bool,
-    ) -> User | None:
+        label: IntentLabel,
+        incoming_text: str,
+        history: History,
+        reply_key: str,
+        begin_commit: Callable[[], None],
+    ) -> ProgressiveReply | None:
+        """
+        Отправляет ответ по мере генерации — мимо отправителя outbox, потому что первое
+        сообщение потом правится. Первое сообщение уходит с random_id от ключа ответа:
+        повтор той же серии после падения Telegram отклонит, и ответ пойдёт через outbox,
+        где дубль отсечёт тот же ключ. None — ответ нужно собрать обычным путём.
+        """
+        # Постоянный random_id только у первого сообщения; остаток (если id неизвестен) — обычный.
+        random_ids = iter([outbox.random_id(reply_key)])
+        delivery = ProgressiveReply(
+            send=lambda text: self._send_text(account, user_id, text, random_id=next(random_ids, None)),
+            edit=lambda message_id, text: self._edit_text(account, user_id, message_id, text),
+            typing=lambda: self._send_typing(account, user_id),
+            edit_interval=get_settings().stream_edit_interval,
+            before_first_send=begin_commit,
+        )
         try:
-            await self._client.send_message(user.id, greeting)
-            return user
-        except RPCError as exc:
-            logger.warning("Failed to send greeting to lead %s: %s", lead.id, exc)
-            # Если изначально писали по телефону, пробуем запасным вариантом username.
-            if used_phone and lead.telegram_username:
-                fallback_user = await self._get_user_by_username(lead.telegram_username)
-                if fallback_user:
-                    try:
-                        await self._client.send_message(fallback_user.id, greeting)
-                        return fallback_user
-                    except RPCError as fallback_exc:
-                        logger.exception("Fallback send to lead %s via username failed: %s", lead.id, fallback_exc)
-            self._update_lead_status(lead.id, LeadStatus.rejected, note=str(exc))
+            delivered = await delivery.deliver(
+                self._conversation_ai.stream_answer(incoming_text, intent_hint=label, history=history)
+            )
+        except asyncio.CancelledError:
+            raise
+        except RandomIdDuplicate:
+            # Этот ответ уже ушёл до падения процесса: статус допишет путь через outbox.
+            logger.warning("Streamed reply for lead %s was already delivered, recording it via the outbox", lead.id)
+            return None
+        except Exception:
+            logger.exception("Streaming reply failed for lead %s, falling back to a full reply", lead.id)
             return None
+        if delivered and delivery.time_to_first_message is not None:
+            REPLY_FIRST_MESSAGE_SECONDS.observe(delivery.time_to_first_message)
+        return delivery if delivered else None
 
-    async def _handle_incoming_message(self, client: Client, message: Message) -> None:
+    async def _handle_incoming_message(self, account: TelegramAccount, client: Client, message: Message) -> None:
         if not message.from_user:
             return
-        user_id = message.from_user.id
-        with get_session() as session:
-            lead = session.exec(select(Lead).where(Lead.telegram_user_id == user_id)).first()
-            if not lead:
+        key = (account.name, message.from_user.id)
+        lead_id = self._lead_ids.get(key)
+        if lead_id is None:
+            # Лида мог поприветствовать другой воркер или процесс после прогрева индекса.
+            if key in self._unknown_senders:
                 return
-            incoming_text = message.text or ""
+            lead_id = await self._find_lead_id(*key)
+            if lead_id is None:
+                self._unknown_senders.set(key, True)
+                return
+            self._lead_ids[key] = lead_id
+        # Серию сообщений («да», «а сколько стоит?», «и когда?») обработаем одним ответом.
+        self._conversations.submit(lead_id, message)
+
+    async def _reply_to_burst(
+        self,
+        lead_id: int,
+        messages: list[Message],
+        begin_commit: Callable[[], None],
+    ) -> None:
+        # Потоковый ответ идёт в Telegram прямо отсюда — с приоритетом ответов.
+        with self._scheduler.track(WorkClass.reply):
+            await self._answer_burst(lead_id, messages, begin_commit)
+
+    async def _answer_burst(
+        self,
+        lead_id: int,
+        messages: list[Message],
+        begin_commit: Callable[[], None],
+    ) -> None:
+        user_id = messages[-1].from_user.id
+        with _stage("reply", "load_lead"):
+            lead = await self._get_lead(lead_id)
+        account = self._accounts.get(lead.telegram_account) if lead else None
+        if not lead or not account:
+            self._lead_ids = {key: value for key, value in self._lead_ids.items() if value != lead_id}
+            return
+        with _stage("reply", "load_history"):
+            history = await self._conversation_log.load(lead)
+        if lead.telegram_access_hash is not None:
+            account.peers.remember(
+                ResolvedUser(id=user_id, access_hash=lead.telegram_access_hash, username=lead.telegram_username)
+            )
+
+        # Классификация и генерация ответа идут вне транзакции — сессия БД здесь не открыта.
+        # Если за это время придёт новое сообщение, задача будет отменена до отправки.
+        incoming_text = "\n".join(message.text for message in messages if message.text)
+        with _stage("reply", "classify"):
             label = await self._conversation_ai.classify(incoming_text)
-            if label == IntentLabel.accept:
-                try:
-                    answer = await self._conversation_ai.answer_question(incoming_text, intent_hint=IntentLabel.accept)
-                except Exception:
-                    logger.exception("Failed to craft confirmation reply for lead %s", lead.id)
-                    answer = "Отлично! Тогда увидимся на созвоне. Если что, мы рядом и на связи."
-                await client.send_message(user_id, answer)
-                lead.status = LeadStatus.scheduled
-            elif label == IntentLabel.reject:
-                try:
-                    reply = await self._conversation_ai.generate_rejection_reply(lead.name)
-                except Exception:
-                    logger.exception("Failed to craft rejection reply for lead %s", lead.id)
-                    reply = "Понял, спасибо за ответ! Если ситуация изменится, мы всегда на связи."
-                await client.send_message(user_id, reply)
-                lead.status = LeadStatus.rejected
-            elif label == IntentLabel.question:
-                try:
-                    answer = await self._conversation_ai.answer_question(incoming_text, intent_hint=IntentLabel.question)
-                except Exception:
-                    logger.exception("Failed to answer question for lead %s", lead.id)
-                    answer = (
-                        f"{settings.company_profile} Готовы обсудить подробнее на коротком созвоне "
-                        "и показать, как можем помочь в вашей задаче."
+        if get_settings().openai_streaming and label in STREAMED_STATUSES:
+            reply_key = _reply_key(account, messages[-1])
+            with _stage("reply", "stream_reply"):
+                streamed = await self._stream_reply(
+                    account, user_id, lead, label, incoming_text, history, reply_key, begin_commit
+                )
+            if streamed is not None:
+                with _stage("reply", "save_status"):
+                    await self._save_reply_status(
+                        account,
+                        lead.id,
+                        STREAMED_STATUSES[label],
+                        messages[-1],
+                        incoming_text,
+                        streamed.text,
+                        sent_message_id=streamed.message_id,
                     )
-                await client.send_message(user_id, answer)
-                lead.status = LeadStatus.awaiting_confirmation
-            else:
-                lead.status = LeadStatus.awaiting_confirmation
-            lead.last_message_id = message.id
-            lead.mark_updated()
-            session.add(lead)
-            session.commit()
+                REPLIES.labels(intent=label.value, delivery="stream").inc()
+                await self._compact_history(lead.id, history, incoming_text, streamed.text)
+                return
+        with _stage("reply", "compose_reply"):
+            reply, status = await self._compose_reply(lead, label, incoming_text, history)
+
+        begin_commit()
+        # Ответ ставится в outbox в одной транзакции со статусом и уходит отдельной задачей.
+        with _stage("reply", "save_status"):
+            await self._save_reply_status(account, lead.id, status, messages[-1], incoming_text, reply, queue=True)
+        REPLIES.labels(intent=label.value, delivery="message" if reply else "none").inc()
+        await self._compact_history(lead.id, history, incoming_text, reply)
+
+    async def _compact_history(self, lead_id: int, history: History, *texts: str | None) -> None:
+        # Задача уже коммитит: следующая серия сообщений лида подождёт и прочитает свёрнутую историю.
+        if not self._conversation_log.needs_compaction(history, *texts):
+            return
+        try:
+            with _stage("reply", "compact_history"):
+                await self._conversation_log.compact(lead_id, self._conversation_ai.summarize_history)
+        except Exception:
+            logger.exception("Failed to compact conversation history of lead %s", lead_id)
+
+    async def _compose_reply(
+        self,
+        lead: Lead,
+        label: IntentLabel,
+        incoming_text: str,
+        history: History,
+    ) -> tuple[str | None, LeadStatus]:
+        if label == IntentLabel.accept:
+            try:
+                answer = await self._conversation_ai.answer_question(
+                    incoming_text, intent_hint=IntentLabel.accept, history=history
+                )
+            except Exception:
+                logger.exception("Failed to craft confirmation reply for lead %s", lead.id)
+                REPLY_FALLBACKS.labels(intent=label.value).inc()
+                answer = "Отлично! Тогда увидимся на созвоне. Если что, мы рядом и на связи."
+            return answer, LeadStatus.scheduled
+        if label == IntentLabel.reject:
+            try:
+                reply = await self._conversation_ai.generate_rejection_reply(lead.name)
+            except Exception:
+                logger.exception("Failed to craft rejection reply for lead %s", lead.id)
+                REPLY_FALLBACKS.labels(intent=label.value).inc()
+                reply = "Понял, спасибо за ответ! Если ситуация изменится, мы всегда на связи."
+            return reply, LeadStatus.rejected
+        if label == IntentLabel.question:
+            try:
+                answer = await self._conversation_ai.answer_question(
+                    incoming_text, intent_hint=IntentLabel.question, history=history
+                )
+            except Exception:
+                logger.exception("Failed to answer question for lead %s", lead.id)
+                REPLY_FALLBACKS.labels(intent=label.value).inc()
+                answer = (
+                    f"{get_settings().company_profile} "
+                    "Готовы обсудить подробнее на коротком созвоне и показать, как можем помочь в вашей задаче."
+                )
+            return answer, LeadStatus.awaiting_confirmation
+        return None, LeadStatus.awaiting_confirmation
+
+    @staticmethod
+    async def _get_lead(lead_id: int) -> Lead | None:
+        async with get_async_session() as session:
+            return await session.get(Lead, lead_id)
+
+    async def _save_reply_status(
+        self,
+        account: TelegramAccount,
+        lead_id: int,
+        status: LeadStatus,
+        incoming: Message,
+        incoming_text: str,
+        reply: str | None,
+        *,
+        queue: bool = False,
+        sent_message_id: int | None = None,
+    ) -> None:
+        """
+        Записывает статус и реплики; с `queue` ставит ответ в outbox, иначе ответ
+        уже доставлен потоком и `sent_message_id` — его id: тогда в outbox пишется
+        отправленная строка с тем же ключом, чтобы повтор серии не ответил второй раз.
+        """
+        # Лид ответил: последовательность напоминаний начинается заново, если он всё ещё думает.
+        due_at = follow_up.next_action_at(0) if status == LeadStatus.awaiting_confirmation else None
+        now = datetime.utcnow()
+        values: dict[str, Any] = {"status": status, "follow_up_step": 0, "next_action_at": due_at, "updated_at": now}
+        if not queue and reply:
+            values.update(last_message_id=sent_message_id, last_contacted_at=now)
+        async with get_async_session() as session:
+            await session.execute(update(Lead).where(Lead.id == lead_id).values(**values))
+            self._conversation_log.add(session, lead_id, ROLE_LEAD, incoming_text)
+            self._conversation_log.add(session, lead_id, ROLE_ASSISTANT, reply)
+            if queue and reply:
+                outbox.enqueue(
+                    session,
+                    dedupe_key=_reply_key(account, incoming),
+                    lead_id=lead_id,
+                    kind=outbox.KIND_REPLY,
+                    account=account.name,
+                    telegram_user_id=incoming.from_user.id,
+                    text=reply,
+                )
+            elif reply:
+                outbox.record_sent(
+                    session,
+                    dedupe_key=_reply_key(account, incoming),
+                    lead_id=lead_id,
+                    kind=outbox.KIND_REPLY,
+                    account=account.name,
+                    telegram_user_id=incoming.from_user.id,
+                    text=reply,
+                    telegram_message_id=sent_message_id,
+                )
+            try:
+                await session.commit()
+            except IntegrityError:
+                logger.warning("Reply to message %s of lead %s is already recorded", incoming.id, lead_id)
+                return
+        if queue and reply:
+            self._outbox[outbox.KIND_REPLY].notify()
+        if due_at:
+            self._follow_ups.notify(due_at)
+
+    async def _follow_up(self, lead: Lead) -> None:
+        """Очередной шаг для лида, не ответившего на приветствие: напоминание или закрытие."""
+        step = lead.follow_up_step or 0
+        account = self._accounts.get(lead.telegram_account)
+        if (
+            lead.status != LeadStatus.awaiting_confirmation
+            or lead.telegram_user_id is None
+            or account is None
+            or account.disabled_reason
+        ):
+            # Писать некому или не с чего: переписку с лидом знает только его аккаунт.
+            await self._save_follow_up(lead, step, None)
+            FOLLOW_UPS.labels(action="skipped").inc()
+            return
+        if step >= follow_up.reminder_count():
+            await self._save_follow_up(lead, step, None, status=LeadStatus.expired)
+            FOLLOW_UPS.labels(action="expired").inc()
+            return
+        if lead.telegram_access_hash is not None:
+            account.peers.remember(
+                ResolvedUser(
+                    id=lead.telegram_user_id,
+                    access_hash=lead.telegram_access_hash,
+                    username=lead.telegram_username,
+                )
+            )
+        if await self._save_follow_up(
+            lead,
+            step + 1,
+            follow_up.next_action_at(step + 1),
+            reminder=(account, follow_up.reminder_text(step, lead.name)),
+        ):
+            FOLLOW_UPS.labels(action="reminder").inc()
+
+    async def _save_follow_up(
+        self,
+        lead: Lead,
+        step: int,
+        due_at: datetime | None,
+        *,
+        status: LeadStatus | None = None,
+        reminder: tuple[TelegramAccount, str] | None = None,
+    ) -> bool:
+        """Сдвигает расписание и ставит напоминание в outbox. False — лид успел ответить, ничего не меняем."""
+        values: dict[str, Any] = {"follow_up_step": step, "next_action_at": due_at, "updated_at": datetime.utcnow()}
+        if status:
+            values["status"] = status
+        # updated_at не совпадёт, если лид успел ответить: тогда расписание уже пересчитано.
+        guarded = update(Lead).where(Lead.id == lead.id, Lead.updated_at == lead.updated_at).values(**values)
+        async with get_async_session() as session:
+            result = await session.execute(guarded)
+            if not result.rowcount:
+                return False
+            if reminder:
+                account, text = reminder
+                # Ответ лида сбрасывает follow_up_step и меняет updated_at: метка отличает новую серию
+                # напоминаний от старой, а повторный захват того же шага даёт тот же ключ.
+                outbox.enqueue(
+                    session,
+                    dedupe_key=f"reminder:{lead.id}:{step}:{lead.updated_at:%Y%m%d%H%M%S%f}",
+                    lead_id=lead.id,
+                    kind=outbox.KIND_REMINDER,
+                    account=account.name,
+                    telegram_user_id=lead.telegram_user_id,
+                    text=text,
+                )
+            try:
+                await session.commit()
+            except IntegrityError:
+                # Напоминание уже в outbox (шаг обработан повторно): расписание всё равно сдвигаем,
+                # иначе лид останется с арендой и будет захватываться снова.
+                await session.rollback()
+                logger.warning("Reminder %s for lead %s is already queued", step, lead.id)
+                result = await session.execute(guarded)
+                await session.commit()
+                return bool(result.rowcount)
+        if reminder:
+            self._outbox[outbox.KIND_REMINDER].notify()
+        return True
+
+
+def _reply_key(account: TelegramAccount, incoming: Message) -> str:
+    # id входящего сообщения уникален в чате аккаунта с лидом: повтор той же серии не ответит дважды.
+    return f"reply:{account.name}:{incoming.chat.id}:{incoming.id}"
+
+
+def _sent_message_id(updates: Any) -> int | None:
+    if isinstance(updates, raw.types.UpdateShortSentMessage):
+        return updates.id
+    for item in getattr(updates, "updates", []):
+        if isinstance(item, raw.types.UpdateMessageID):
+            return item.id
+        if isinstance(item, raw.types.UpdateNewMessage):
+            return item.message.id
+    return None
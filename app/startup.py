@@ -0,0 +1,46 @@
+"""
+Стоимость старта по компонентам.
+
+StartupReport копит время импорта и инициализации; API и воркер пишут его в лог
+при старте, а `python -m app.manage startup-report` измеряет всё с нуля в
+отдельном процессе. Импорт считается приростом: модули, которые уже подтянул
+предыдущий компонент, повторно не оплачиваются.
+"""
+import importlib
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+# Компоненты в порядке, в котором их импортирует процесс.
+COMPONENTS = (
+    ("settings", "app.config"),
+    ("db", "app.db"),
+    ("models", "app.models"),
+    ("api", "main"),
+    ("worker", "app.services.telegram"),
+)
+
+
+class StartupReport:
+    """Время по компонентам, в порядке измерения."""
+
+    def __init__(self) -> None:
+        self.timings: dict[str, float] = {}
+
+    @contextmanager
+    def measure(self, component: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[component] = self.timings.get(component, 0.0) + time.perf_counter() - started
+
+    def render(self) -> str:
+        parts = [f"{component} {seconds * 1000:.1f} ms" for component, seconds in self.timings.items()]
+        return f"{', '.join(parts)}; total {sum(self.timings.values()) * 1000:.1f} ms"
+
+
+def measure_imports(report: StartupReport) -> None:
+    for component, module in COMPONENTS:
+        with report.measure(f"import:{component}"):
+            importlib.import_module(module)
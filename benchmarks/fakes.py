@@ -0,0 +1,329 @@
+"""
+Локальные заменители Telegram и OpenAI для бенчмарков.
+
+FakeTelegramClient повторяет ту часть API Pyrogram, которой пользуется
+TelegramLeadService, и умеет добавлять задержку, FloodWait и ошибки.
+FakeOpenAI — HTTP-сервер с эндпоинтом Responses API (обычные и потоковые
+ответы); адрес подставляется в OPENAI_BASE_URL. Он считает токены и, как
+провайдер, кэширует префикс промпта: повторённое начало запроса не тратит
+время на prefill и возвращается в usage как cached_tokens.
+"""
+import asyncio
+import json
+import random
+import re
+import time
+import zlib
+from collections import Counter
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Callable
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pyrogram import raw
+from pyrogram.errors import FloodWait, InternalServerError, RandomIdDuplicate, UsernameNotOccupied
+
+# Пользователи фейкового Telegram: id выводятся из телефона или username, чтобы бенчмарк знал их заранее.
+PHONE_USER_BASE = 10**10
+USERNAME_USER_BASE = 2 * 10**10
+
+DEFAULT_ANSWER = (
+    "Конечно, можем обсудить это и в переписке. "
+    "Но на коротком созвоне технический специалист быстрее разберётся в задаче и подскажет сроки. "
+    "Выберите удобное время в календаре, там же будет ссылка на Zoom. "
+    "Ждем вас на встрече!"
+)
+CLASSIFY_MARKER = "Ответь только одним словом"
+# Оценка токенов и гранулярность кэша префикса — как у провайдера: блоки по 128 токенов.
+CHARS_PER_TOKEN = 4
+PREFIX_BLOCK_TOKENS = 128
+
+
+@dataclass
+class FaultProfile:
+    # Задержка каждого вызова в секундах и доля вызовов с FloodWait / внутренней ошибкой Telegram.
+    latency: float = 0.0
+    flood_wait_rate: float = 0.0
+    flood_wait_seconds: int = 1
+    failure_rate: float = 0.0
+    # Доля телефонов, не зарегистрированных в Telegram (определяется по хэшу номера).
+    unknown_phone_rate: float = 0.0
+
+
+@dataclass
+class SentMessage:
+    user_id: int
+    text: str
+    at: float
+
+
+def phone_user_id(phone: str) -> int:
+    return PHONE_USER_BASE + int(re.sub(r"\D", "", phone)[-9:] or 0)
+
+
+def username_user_id(username: str) -> int:
+    return USERNAME_USER_BASE + zlib.crc32(username.lower().encode("utf-8"))
+
+
+class _Parser:
+    async def parse(self, text: str, mode: Any = None) -> dict[str, Any]:
+        return {"message": text, "entities": None}
+
+
+class FakeTelegramClient:
+    """Минимальный Pyrogram-совместимый клиент: вызовы считаются, исходящие сообщения записываются."""
+
+    def __init__(self, faults: FaultProfile | None = None, *, seed: int | None = None) -> None:
+        self.faults = faults or FaultProfile()
+        self.parser = _Parser()
+        self.calls: Counter[str] = Counter()
+        self.injected: Counter[str] = Counter()
+        self.sent: list[SentMessage] = []
+        self.listeners: list[Callable[[SentMessage], None]] = []
+        self._handlers: list[Any] = []
+        self._random = random.Random(seed)
+        self._message_ids = 0
+        self._random_ids: set[int] = set()
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    def add_handler(self, handler: Any, group: int = 0) -> None:
+        self._handlers.append(handler)
+
+    def rnd_id(self) -> int:
+        return self._random.getrandbits(63)
+
+    def is_registered(self, phone: str) -> bool:
+        digits = re.sub(r"\D", "", phone).encode("ascii")
+        return zlib.crc32(digits) % 10000 >= self.faults.unknown_phone_rate * 10000
+
+    async def receive(self, user_id: int, text: str) -> None:
+        """Входящее сообщение от пользователя: передаётся зарегистрированным обработчикам."""
+        self._message_ids += 1
+        message = SimpleNamespace(
+            id=self._message_ids,
+            text=text,
+            from_user=SimpleNamespace(id=user_id),
+            chat=SimpleNamespace(id=user_id),
+        )
+        for handler in self._handlers:
+            await handler.callback(self, message)
+
+    async def import_contacts(self, contacts: list[raw.types.InputPhoneContact]) -> Any:
+        await self._call("import_contacts")
+        users, imported = [], []
+        for contact in contacts:
+            if not self.is_registered(contact.phone):
+                continue
+            user_id = phone_user_id(contact.phone)
+            users.append(SimpleNamespace(id=user_id, access_hash=user_id * 7, username=None))
+            imported.append(SimpleNamespace(user_id=user_id, client_id=contact.client_id))
+        return SimpleNamespace(users=users, imported=imported, retry_contacts=[])
+
+    async def invoke(self, query: Any) -> Any:
+        await self._call(type(query).__name__)
+        if isinstance(query, raw.functions.contacts.ResolveUsername):
+            if query.username.startswith("unknown"):
+                raise UsernameNotOccupied()
+            user_id = username_user_id(query.username)
+            return SimpleNamespace(
+                peer=raw.types.PeerUser(user_id=user_id),
+                users=[SimpleNamespace(id=user_id, access_hash=user_id * 7, username=query.username)],
+            )
+        if isinstance(query, raw.functions.messages.SendMessage):
+            # Как Telegram: повтор с тем же random_id не создаёт второе сообщение.
+            if query.random_id in self._random_ids:
+                raise RandomIdDuplicate()
+            self._random_ids.add(query.random_id)
+            message_id = self._record(query.peer.user_id, query.message)
+            return raw.types.UpdateShortSentMessage(id=message_id, pts=0, pts_count=0, date=0)
+        if isinstance(query, raw.functions.messages.EditMessage):
+            return raw.types.Updates(updates=[], users=[], chats=[], date=0, seq=0)
+        return True
+
+    async def resolve_peer(self, peer_id: int) -> raw.types.InputPeerUser:
+        await self._call("resolve_peer")
+        return raw.types.InputPeerUser(user_id=peer_id, access_hash=peer_id * 7)
+
+    async def send_message(self, chat_id: int, text: str, **kwargs: Any) -> Any:
+        await self._call("send_message")
+        return SimpleNamespace(id=self._record(chat_id, text))
+
+    async def edit_message_text(self, chat_id: int, message_id: int, text: str, **kwargs: Any) -> Any:
+        await self._call("edit_message_text")
+        return SimpleNamespace(id=message_id)
+
+    async def send_chat_action(self, chat_id: int, action: Any) -> bool:
+        await self._call("send_chat_action")
+        return True
+
+    async def _call(self, method: str) -> None:
+        self.calls[method] += 1
+        if self.faults.latency:
+            await asyncio.sleep(self.faults.latency)
+        roll = self._random.random()
+        if roll < self.faults.flood_wait_rate:
+            self.injected["flood_wait"] += 1
+            raise FloodWait(value=self.faults.flood_wait_seconds)
+        if roll < self.faults.flood_wait_rate + self.faults.failure_rate:
+            self.injected["failure"] += 1
+            raise InternalServerError()
+
+    def _record(self, user_id: int, text: str) -> int:
+        self._message_ids += 1
+        message = SentMessage(user_id=user_id, text=text, at=time.monotonic())
+        self.sent.append(message)
+        for listener in self.listeners:
+            listener(message)
+        return self._message_ids
+
+
+@dataclass
+class FakeOpenAI:
+    """
+    Эндпоинт POST /v1/responses. Запрос классификации получает `classify_label`
+    (пакетный — JSON с этим ярлыком для каждого id), остальные — `answer`; потоковый ответ режется на слова с паузой `token_delay`.
+    """
+
+    latency: float = 0.0
+    token_delay: float = 0.0
+    failure_rate: float = 0.0
+    classify_label: str = "question"
+    answer: str = DEFAULT_ANSWER
+    seed: int | None = None
+    # Промпт короче этого не кэшируется; prefill_per_1k — задержка на каждую 1000 некэшированных токенов.
+    cache_min_tokens: int = 1024
+    prefill_per_1k: float = 0.0
+    requests: Counter[str] = field(default_factory=Counter)
+    tokens: Counter[str] = field(default_factory=Counter)
+
+    def __post_init__(self) -> None:
+        self._random = random.Random(self.seed)
+        self._prefixes: set[int] = set()
+        self._server: uvicorn.Server | None = None
+        self._task: asyncio.Task[None] | None = None
+        self.base_url = ""
+
+    def build_app(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.post("/v1/responses")
+        async def responses(request: Request) -> Any:
+            body = await request.json()
+            stream = bool(body.get("stream"))
+            self.requests["stream" if stream else "create"] += 1
+            prompt = str(body.get("instructions") or "") + json.dumps(body.get("input"), ensure_ascii=False)
+            input_tokens, cached_tokens = self._prefill(prompt)
+            await asyncio.sleep(self.latency + self.prefill_per_1k * (input_tokens - cached_tokens) / 1000)
+            if self._random.random() < self.failure_rate:
+                self.requests["failed"] += 1
+                return JSONResponse({"error": {"message": "overloaded", "type": "server_error"}}, status_code=503)
+            if ((body.get("text") or {}).get("format") or {}).get("type") == "json_schema":
+                items = json.loads(body["input"])
+                self.requests["batched_messages"] += len(items)
+                text = json.dumps({"labels": [{"id": item["id"], "label": self.classify_label} for item in items]})
+            else:
+                text = self.classify_label if CLASSIFY_MARKER in prompt else self.answer
+            usage = {
+                "input_tokens": input_tokens,
+                "input_tokens_details": {"cached_tokens": cached_tokens},
+                "output_tokens": len(text) // CHARS_PER_TOKEN + 1,
+                "output_tokens_details": {"reasoning_tokens": 0},
+                "total_tokens": input_tokens + len(text) // CHARS_PER_TOKEN + 1,
+            }
+            self.tokens["input"] += input_tokens
+            self.tokens["cached"] += cached_tokens
+            self.tokens["output"] += usage["output_tokens"]
+            if stream:
+                return StreamingResponse(self._events(body, text, usage), media_type="text/event-stream")
+            return _response(body, text, usage)
+
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        config = uvicorn.Config(self.build_app(), host=host, port=port, log_level="warning", lifespan="off")
+        self._server = uvicorn.Server(config)
+        self._task = asyncio.create_task(self._server.serve())
+        while not self._server.started:
+            if self._task.done():
+                await self._task
+            await asyncio.sleep(0.01)
+        bound_port = self._server.servers[0].sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{bound_port}/v1"
+        return self.base_url
+
+    async def stop(self) -> None:
+        if self._server and self._task:
+            self._server.should_exit = True
+            await self._task
+            self._server = self._task = None
+
+    def _prefill(self, prompt: str) -> tuple[int, int]:
+        """Токены запроса и сколько из них взято из кэша: самый длинный ранее виденный префикс из целых блоков."""
+        tokens = len(prompt) // CHARS_PER_TOKEN + 1
+        if tokens < self.cache_min_tokens:
+            return tokens, 0
+        block = PREFIX_BLOCK_TOKENS * CHARS_PER_TOKEN
+        cached = 0
+        for end in range(block, len(prompt) + 1, block):
+            key = hash(prompt[:end])
+            if key in self._prefixes:
+                cached = end // CHARS_PER_TOKEN
+            else:
+                self._prefixes.add(key)
+        return tokens, cached
+
+    async def _events(self, body: dict[str, Any], text: str, usage: dict[str, Any]) -> AsyncIterator[str]:
+        response = _response(body, text, usage)
+        yield _sse(
+            {"type": "response.created", "sequence_number": 0, "response": {**response, "output": [], "usage": None}}
+        )
+        words = re.findall(r"\S+\s*", text)
+        for number, word in enumerate(words, start=1):
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            yield _sse(
+                {
+                    "type": "response.output_text.delta",
+                    "sequence_number": number,
+                    "item_id": "msg_bench",
+                    "output_index": 0,
+                    "content_index": 0,
+                    "delta": word,
+                    "logprobs": [],
+                }
+            )
+        yield _sse({"type": "response.completed", "sequence_number": len(words) + 1, "response": response})
+
+
+def _response(body: dict[str, Any], text: str, usage: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "id": "resp_bench",
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": body.get("model", "bench"),
+        "status": "completed",
+        "parallel_tool_calls": False,
+        "tool_choice": "auto",
+        "tools": [],
+        "output": [
+            {
+                "type": "message",
+                "id": "msg_bench",
+                "role": "assistant",
+                "status": "completed",
+                "content": [{"type": "output_text", "text": text, "annotations": []}],
+            }
+        ],
+        "usage": usage,
+    }
+
+
+def _sse(event: dict[str, Any]) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
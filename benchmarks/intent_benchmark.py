@@ -0,0 +1,101 @@
+"""
+Бенчмарк локального классификатора намерений на размеченном корпусе.
+
+    python -m benchmarks.intent_benchmark [--threshold 0.6] [--json]
+
+Сообщения с меткой ambiguous считаются корректно обработанными, если ушли в LLM.
+Остальные размеченные фразы должны решаться локально (кроме помеченных
+"local": false — в них смешаны сигналы, и их разбирает модель): если такая фраза
+ушла в LLM или получила чужой ярлык, бенчмарк завершается с кодом 1.
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from app.services.intent import IntentClassifier, IntentLabel
+
+DEFAULT_CORPUS = Path(__file__).with_name("intent_corpus.jsonl")
+
+
+def load_corpus(path: Path) -> list[tuple[str, IntentLabel, bool]]:
+    """(текст, ярлык, должна ли фраза решаться без LLM)."""
+    rows = []
+    with path.open(encoding="utf-8") as corpus:
+        for line in corpus:
+            if line.strip():
+                item = json.loads(line)
+                label = IntentLabel(item["label"])
+                rows.append((item["text"], label, item.get("local", label != IntentLabel.ambiguous)))
+    return rows
+
+
+def run(corpus: list[tuple[str, IntentLabel, bool]], threshold: float, repeat: int) -> dict[str, object]:
+    classifier = IntentClassifier()
+    latencies: list[float] = []
+    local = correct_local = fallback = correct = 0
+    mistakes: list[dict[str, str]] = []
+    unexpected_fallbacks: list[str] = []
+
+    for text, expected, must_be_local in corpus:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = classifier.classify(text)
+            latencies.append(time.perf_counter() - started)
+        if result.label != IntentLabel.ambiguous and result.confidence >= threshold:
+            local += 1
+            if result.label == expected:
+                correct_local += 1
+                correct += 1
+            else:
+                mistakes.append({"text": text, "expected": expected.value, "got": result.label.value})
+        else:
+            fallback += 1
+            if expected == IntentLabel.ambiguous:
+                correct += 1
+            if must_be_local:
+                unexpected_fallbacks.append(text)
+
+    latencies.sort()
+    total = len(corpus)
+    return {
+        "messages": total,
+        "threshold": threshold,
+        "accuracy": round(correct / total, 4) if total else 0.0,
+        "local_accuracy": round(correct_local / local, 4) if local else 0.0,
+        "llm_fallback_rate": round(fallback / total, 4) if total else 0.0,
+        "latency_us_p50": round(statistics.median(latencies) * 1e6, 2),
+        "latency_us_p95": round(latencies[int(len(latencies) * 0.95) - 1] * 1e6, 2),
+        "latency_us_max": round(latencies[-1] * 1e6, 2),
+        "mistakes": mistakes,
+        "unexpected_fallbacks": unexpected_fallbacks,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--corpus", type=Path, default=DEFAULT_CORPUS)
+    parser.add_argument("--threshold", type=float, default=0.6)
+    parser.add_argument("--repeat", type=int, default=200, help="прогонов на сообщение для замера задержки")
+    parser.add_argument("--json", action="store_true", help="вывести результат одной JSON-строкой")
+    args = parser.parse_args()
+
+    report = run(load_corpus(args.corpus), args.threshold, args.repeat)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False))
+    else:
+        for key, value in report.items():
+            if key not in ("mistakes", "unexpected_fallbacks"):
+                print(f"{key:>20}: {value}")
+        for mistake in report["mistakes"]:
+            print(f"  ✗ {mistake['text']!r}: expected {mistake['expected']}, got {mistake['got']}")
+        for text in report["unexpected_fallbacks"]:
+            print(f"  ✗ {text!r}: should be classified locally, went to the LLM")
+    if report["mistakes"] or report["unexpected_fallbacks"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
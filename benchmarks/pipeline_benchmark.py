@@ -0,0 +1,456 @@
+"""
+Сквозной бенчмарк: вебхуки → очередь записи → рассылка приветствий → ответы лидам.
+
+    python -m benchmarks.pipeline_benchmark [--leads 500] [--save baseline.json] [--compare baseline.json]
+
+API и воркер работают в одном процессе на временной SQLite (или на --database-url);
+Telegram заменён FakeTelegramClient, OpenAI — локальным FakeOpenAI. Нагрузку дают
+записанные вебхуки из --payloads: каждый повтор получает свой телефон, username и tranid.
+Результат можно сохранить как baseline и сравнить с ним прогон на другом коммите.
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+from urllib.parse import parse_qsl, urlencode
+
+from .fakes import FakeOpenAI, FakeTelegramClient, FaultProfile, SentMessage, phone_user_id, username_user_id
+
+DEFAULT_PAYLOADS = Path(__file__).with_name("tilda_payloads.jsonl")
+REPLY_TEXTS = (
+    "Да, оставлял заявку, давайте созвонимся",
+    "Нет, спасибо, уже не актуально",
+    "А сколько стоит разработка мобильного приложения?",
+    "Хм, даже не знаю",
+)
+# Следующие раунды: уточняющие вопросы, на которые модель отвечает с учётом истории переписки.
+FOLLOW_UP_TEXTS = (
+    "А какие примерно сроки у такого проекта?",
+    "Можно сначала обсудить в переписке, без созвона?",
+    "А вы делали что-то похожее для других клиентов?",
+)
+PHONE_KEYS = {"phone"}
+USERNAME_KEYS = {"tg-nickname", "telegram_username", "telegram"}
+# Метрики, которые при сравнении с baseline должны расти; остальные — уменьшаться.
+HIGHER_IS_BETTER = {"ingest_rps", "greeted", "replies", "openai_cached_input_share"}
+
+_phase: contextvars.ContextVar[str] = contextvars.ContextVar("benchmark_phase", default="other")
+
+
+@dataclass
+class Payload:
+    path: str
+    content_type: str
+    body: Any
+
+
+@dataclass
+class Submission:
+    started_at: float
+    user_ids: tuple[int, ...]
+
+
+def load_payloads(path: Path) -> list[Payload]:
+    payloads = []
+    with path.open(encoding="utf-8") as source:
+        for line in source:
+            if line.strip():
+                payloads.append(Payload(**json.loads(line)))
+    if not payloads:
+        raise SystemExit(f"No payloads in {path}")
+    return payloads
+
+
+def personalize(payload: Payload, number: int, run_id: str) -> tuple[str, dict[str, str], list[str], list[str]]:
+    """Подставляет в записанную заявку уникальные контакты. Возвращает тело, заголовки, телефоны и username."""
+    if isinstance(payload.body, dict):
+        items = list(payload.body.items())
+    else:
+        items = parse_qsl(payload.body, keep_blank_values=True)
+    phones, usernames, fields = [], [], []
+    for key, value in items:
+        lowered = key.lower()
+        if lowered in PHONE_KEYS and value:
+            value = f"+7999{number:07d}"
+            phones.append(value)
+        elif lowered in USERNAME_KEYS and value:
+            value = f"bench_{run_id}_{number}"
+            usernames.append(value)
+        elif lowered == "tranid":
+            value = f"{run_id}:{number}"
+        fields.append((key, value))
+    if isinstance(payload.body, dict):
+        body = json.dumps(dict(fields), ensure_ascii=False)
+    else:
+        body = urlencode(fields)
+    return body, {"content-type": payload.content_type}, phones, usernames
+
+
+def percentiles(values: list[float], prefix: str) -> dict[str, float | None]:
+    if not values:
+        return {f"{prefix}_p50_ms": None, f"{prefix}_p95_ms": None, f"{prefix}_p99_ms": None}
+    ordered = sorted(values)
+
+    def pick(share: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * share))] * 1000, 2)
+
+    return {
+        f"{prefix}_p50_ms": round(statistics.median(ordered) * 1000, 2),
+        f"{prefix}_p95_ms": pick(0.95),
+        f"{prefix}_p99_ms": pick(0.99),
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip() or None
+
+
+def configure_environment(args: argparse.Namespace, workdir: str, openai_url: str) -> None:
+    # Settings читаются при импорте модулей приложения, поэтому окружение готовим до него.
+    os.environ.update(
+        {
+            "DATABASE_URL": args.database_url or f"sqlite:///{workdir}/bench.db",
+            "WORKER_SIGNAL_PATH": f"{workdir}/worker.sock",
+            "OPENAI_BASE_URL": openai_url,
+            "OPENAI_API_KEY": "bench",
+            "OPENAI_REQUESTS_PER_MINUTE": "100000",
+            "OPENAI_STREAMING": "true" if args.streaming else "false",
+            "TELEGRAM_API_ID": "1",
+            "TELEGRAM_API_HASH": "bench",
+            "TELEGRAM_RATE_PER_SECOND": str(args.telegram_rate),
+            "TELEGRAM_MAX_RATE_PER_SECOND": str(args.telegram_rate),
+            "TELEGRAM_RATE_BURST": str(max(1, int(args.telegram_rate))),
+            "OUTREACH_BATCH_SIZE": str(args.batch_size),
+            "REPLY_DEBOUNCE_SECONDS": str(args.reply_debounce),
+            "LEAD_LEASE_SECONDS": str(args.lease_seconds),
+            "LEASE_REAPER_INTERVAL": "1",
+            "CALENDLY_LINK": "https://calendly.com/bench",
+            "LLM_CACHE_ENABLED": "true" if args.llm_cache else "false",
+            "INTENT_BATCH_ENABLED": "true" if args.intent_batch else "false",
+        }
+    )
+    os.environ.pop("INGEST_SPOOL_PATH", None)
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    faults = FaultProfile(
+        latency=args.telegram_latency,
+        flood_wait_rate=args.flood_wait_rate,
+        flood_wait_seconds=args.flood_wait_seconds,
+        failure_rate=args.telegram_failure_rate,
+        unknown_phone_rate=args.unknown_phone_rate,
+    )
+    telegram = FakeTelegramClient(faults, seed=args.seed)
+    openai = FakeOpenAI(
+        latency=args.openai_latency,
+        token_delay=args.openai_token_delay,
+        failure_rate=args.openai_failure_rate,
+        seed=args.seed,
+        cache_min_tokens=args.openai_cache_min_tokens,
+        prefill_per_1k=args.openai_prefill_per_1k,
+    )
+    workdir = tempfile.mkdtemp(prefix="lead-bench-")
+    configure_environment(args, workdir, await openai.start())
+
+    import httpx
+    from sqlalchemy import event, func
+    from sqlmodel import select
+
+    from app.db import get_async_engine, get_async_session, get_engine, init_db
+    from app.models import Lead, LeadStatus
+    from app.services.notify import LeadWakeup
+    from app.services.telegram import TelegramLeadService
+    from main import app, lifespan
+
+    queries: Counter[str] = Counter()
+
+    def count_query(*_args: Any) -> None:
+        queries[_phase.get()] += 1
+
+    init_db()
+    for target in (get_engine(), get_async_engine().sync_engine):
+        event.listen(target, "before_cursor_execute", count_query)
+
+    submissions: dict[int, Submission] = {}
+    greeting_latencies: list[float] = []
+    reply_started: dict[int, float] = {}
+    reply_latencies: list[float] = []
+    greeted: set[int] = set()
+    all_replied = asyncio.Event()
+    # --reply-during-outreach: лиды отвечают сразу после приветствия, пока рассылка ещё идёт.
+    early_repliers: list[int] = []
+    early_pending: set[int] = set()
+    early_latencies: list[float] = []
+    background: set[asyncio.Task[None]] = set()
+
+    async def reply(user_id: int, text: str) -> None:
+        _phase.set("reply")
+        reply_started[user_id] = time.monotonic()
+        await telegram.receive(user_id, text)
+
+    def on_sent(message: SentMessage) -> None:
+        if message.user_id in reply_started:
+            started = reply_started.pop(message.user_id)
+            reply_latencies.append(message.at - started)
+            if message.user_id in early_pending:
+                early_pending.discard(message.user_id)
+                early_latencies.append(message.at - started)
+            if not reply_started:
+                all_replied.set()
+            return
+        submission = submissions.pop(message.user_id, None)
+        if submission is None:
+            return
+        for user_id in submission.user_ids:
+            submissions.pop(user_id, None)
+        greeted.add(message.user_id)
+        greeting_latencies.append(message.at - submission.started_at)
+        if args.reply_during_outreach and int(len(greeted) * args.reply_share) > len(early_repliers):
+            early_repliers.append(message.user_id)
+            early_pending.add(message.user_id)
+            all_replied.clear()
+            task = asyncio.get_running_loop().create_task(
+                reply(message.user_id, REPLY_TEXTS[len(early_repliers) % len(REPLY_TEXTS)])
+            )
+            background.add(task)
+            task.add_done_callback(background.discard)
+
+    telegram.listeners.append(on_sent)
+
+    service = TelegramLeadService(client=telegram)
+    wakeup = LeadWakeup()
+    stop_worker = asyncio.Event()
+
+    async def worker_loop() -> None:
+        _phase.set("outreach")
+        await service.start()
+        await wakeup.start()
+        while not stop_worker.is_set():
+            processed = await service.process_pending()
+            if processed < args.batch_size:
+                await wakeup.wait(0.5)
+
+    async def count_unfinished() -> int:
+        token = _phase.set("harness")
+        try:
+            async with get_async_session() as session:
+                return (
+                    await session.exec(
+                        select(func.count())
+                        .select_from(Lead)
+                        .where(Lead.status.in_([LeadStatus.pending, LeadStatus.contact_in_progress]))
+                    )
+                ).one()
+        finally:
+            _phase.reset(token)
+
+    payloads = load_payloads(args.payloads)
+    run_id = f"{int(time.time())}"
+    response_times: list[float] = []
+    statuses: Counter[int] = Counter()
+
+    _phase.set("ingest")
+    async with lifespan(app):
+        worker = asyncio.create_task(worker_loop())
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            numbers = iter(range(args.leads))
+
+            async def generate() -> None:
+                for number in numbers:
+                    payload = payloads[number % len(payloads)]
+                    body, headers, phones, usernames = personalize(payload, number, run_id)
+                    started = time.monotonic()
+                    user_ids = tuple(
+                        [phone_user_id(phone) for phone in phones if telegram.is_registered(phone)]
+                        + [username_user_id(username) for username in usernames]
+                    )
+                    submission = Submission(started, user_ids)
+                    for user_id in user_ids:
+                        submissions[user_id] = submission
+                    response = await client.post(payload.path, content=body, headers=headers)
+                    response_times.append(time.monotonic() - started)
+                    statuses[response.status_code] += 1
+
+            ingest_started = time.monotonic()
+            await asyncio.gather(*(generate() for _ in range(args.concurrency)))
+            ingest_seconds = time.monotonic() - ingest_started
+
+        deadline = time.monotonic() + args.timeout
+        while await count_unfinished() and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        outreach_seconds = time.monotonic() - ingest_started
+        unfinished = await count_unfinished()
+
+        if early_repliers:
+            # Первый раунд ответов прошёл во время рассылки — ждём, пока на него ответят.
+            try:
+                await asyncio.wait_for(all_replied.wait(), args.timeout)
+            except asyncio.TimeoutError:
+                pass
+            await asyncio.sleep(args.reply_debounce + 0.2)
+            repliers = early_repliers
+        else:
+            repliers = sorted(greeted)[: int(len(greeted) * args.reply_share)]
+        for round_number in range(1 if early_repliers else 0, args.reply_rounds if repliers else 0):
+            texts = REPLY_TEXTS if round_number == 0 else FOLLOW_UP_TEXTS
+            all_replied.clear()
+            await asyncio.gather(
+                *(
+                    reply(user_id, texts[(index + round_number) % len(texts)])
+                    for index, user_id in enumerate(repliers)
+                )
+            )
+            try:
+                await asyncio.wait_for(all_replied.wait(), args.timeout)
+            except asyncio.TimeoutError:
+                pass
+            # Запись статуса и истории идёт после отправки ответа — даём ей завершиться.
+            await asyncio.sleep(args.reply_debounce + 0.2)
+
+        stop_worker.set()
+        wakeup.set()
+        await worker
+        await wakeup.stop()
+        await service.stop()
+    await openai.stop()
+
+    created = args.leads
+    return {
+        "leads": created,
+        "ingest_rps": round(args.leads / ingest_seconds, 1),
+        "ingest_errors": sum(count for code, count in statuses.items() if code >= 400),
+        **percentiles(response_times, "webhook"),
+        "greeted": len(greeted),
+        "unfinished": unfinished,
+        "outreach_seconds": round(outreach_seconds, 3),
+        **percentiles(greeting_latencies, "webhook_to_greeting"),
+        "replies": len(reply_latencies),
+        "replies_missing": len(reply_started),
+        **percentiles(reply_latencies, "reply"),
+        **percentiles(early_latencies, "reply_during_outreach"),
+        "db_queries_per_lead_ingest": round(queries["ingest"] / created, 2),
+        "db_queries_per_lead_outreach": round(queries["outreach"] / created, 2),
+        "db_queries_per_reply": (
+            round(queries["reply"] / (len(repliers) * args.reply_rounds), 2) if repliers and args.reply_rounds else None
+        ),
+        "telegram_calls": dict(telegram.calls),
+        "telegram_faults": dict(telegram.injected),
+        "openai_requests": dict(openai.requests),
+        "openai_input_tokens_per_request": round(openai.tokens["input"] / max(1, openai.requests["create"] + openai.requests["stream"]), 1),
+        "openai_cached_input_share": round(openai.tokens["cached"] / max(1, openai.tokens["input"]), 3),
+    }
+
+
+def compare(results: dict[str, Any], baseline: dict[str, Any], tolerance: float) -> list[str]:
+    """Печатает изменения относительно baseline и возвращает ухудшившиеся метрики."""
+    regressions = []
+    old_results = baseline.get("results", {})
+    print(f"\nCompared with baseline {baseline.get('commit') or '?'} ({baseline.get('created_at', '?')}):")
+    for key, value in results.items():
+        old = old_results.get(key)
+        if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or isinstance(value, bool):
+            continue
+        if old:
+            change = (value - old) / old
+        else:
+            change = float("inf") if value else 0.0
+        worse = -change if key in HIGHER_IS_BETTER else change
+        marker = ""
+        if worse > tolerance:
+            marker = "  ← regression"
+            regressions.append(key)
+        print(f"{key:>32}: {old} → {value} ({change:+.1%}){marker}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--leads", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20, help="одновременных вебхуков")
+    parser.add_argument("--payloads", type=Path, default=DEFAULT_PAYLOADS)
+    parser.add_argument("--database-url", help="по умолчанию — временная SQLite")
+    parser.add_argument("--batch-size", type=int, default=50, help="OUTREACH_BATCH_SIZE воркера")
+    parser.add_argument("--telegram-latency", type=float, default=0.05)
+    parser.add_argument("--telegram-rate", type=float, default=1000.0, help="лимит вызовов Telegram в секунду")
+    parser.add_argument("--flood-wait-rate", type=float, default=0.0)
+    parser.add_argument("--flood-wait-seconds", type=int, default=1)
+    parser.add_argument("--telegram-failure-rate", type=float, default=0.0)
+    parser.add_argument("--unknown-phone-rate", type=float, default=0.05)
+    parser.add_argument("--openai-latency", type=float, default=0.2, help="задержка до первого токена")
+    parser.add_argument("--openai-token-delay", type=float, default=0.01)
+    parser.add_argument("--openai-failure-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--openai-prefill-per-1k", type=float, default=0.05, help="задержка на 1000 некэшированных входных токенов"
+    )
+    parser.add_argument("--openai-cache-min-tokens", type=int, default=1024, help="минимальный кэшируемый промпт")
+    parser.add_argument("--no-streaming", dest="streaming", action="store_false")
+    parser.add_argument("--llm-cache", action="store_true", help="включить кэш ответов LLM")
+    parser.add_argument("--intent-batch", action="store_true", help="классифицировать неуверенные сообщения пачками")
+    parser.add_argument("--reply-share", type=float, default=1.0, help="доля лидов, отвечающих на приветствие")
+    parser.add_argument("--reply-debounce", type=float, default=0.2)
+    parser.add_argument("--reply-rounds", type=int, default=2, help="сколько раз каждый лид пишет в диалог")
+    parser.add_argument(
+        "--reply-during-outreach",
+        action="store_true",
+        help="первый ответ лида — сразу после приветствия, пока идёт рассылка",
+    )
+    parser.add_argument("--lease-seconds", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", type=Path, help="сохранить результат как baseline (JSON)")
+    parser.add_argument("--compare", type=Path, help="сравнить с сохранённым baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="допустимое ухудшение при сравнении")
+    parser.add_argument("--json", action="store_true", help="вывести результат одной JSON-строкой")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    config = {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()}
+    for key in ("save", "compare", "json", "timeout"):
+        config.pop(key)
+    report = {
+        "benchmark": "pipeline",
+        "commit": git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "config": config,
+        "results": results,
+    }
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False))
+    else:
+        for key, value in results.items():
+            print(f"{key:>32}: {value}")
+    if args.save:
+        args.save.write_text(json.dumps(report, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))
+        if baseline.get("config") != config:
+            print("\nWarning: baseline was recorded with a different configuration.")
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
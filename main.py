@@ -1,18 +1,34 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
 
-from app.db import init_db
+from fastapi import FastAPI, Response
+
+from app.container import get_container
 from app.routes.leads import router as leads_router
+from app.services.metrics import CONTENT_TYPE, REGISTRY
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI) -> AsyncIterator[None]:
+    container = get_container()
+    await container.start()
+    yield
+    await container.stop()
 
 
 def create_app() -> FastAPI:
-    init_db()
-    app = FastAPI(title="GordoveCode Lead Assistant")
+    # Схему создаёт `python -m app.manage init-db` (в Docker — entrypoint), а не импорт приложения.
+    app = FastAPI(title="GordoveCode Lead Assistant", lifespan=lifespan)
     app.include_router(leads_router)
 
     @app.get("/health", tags=["system"])
     def health() -> dict[str, str]:
         return {"status": "ok"}
 
+    @app.get("/metrics", tags=["system"], include_in_schema=False)
+    async def metrics() -> Response:
+        return Response(await REGISTRY.render(), media_type=CONTENT_TYPE)
+
     return app
 
 
@@ -1,6 +1,6 @@
 #!/bin/sh
 set -e
 
-python -c "from app.db import init_db; init_db()"
+python -m app.manage init-db
 
 exec "$@"
@@ -0,0 +1,28 @@
+import pytest
+
+from app import db
+from app.config import get_settings
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch, tmp_path):
+    """Настройки из окружения теста, а не из .env разработчика."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'leads.db'}")
+    monkeypatch.setenv("TELEGRAM_API_ID", "1")
+    monkeypatch.setenv("TELEGRAM_API_HASH", "test")
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("CALENDLY_LINK", "https://calendly.com/test")
+    get_settings.cache_clear()
+    yield get_settings()
+    get_settings.cache_clear()
+
+
+@pytest.fixture
+def database(settings):
+    """Пустая SQLite-база во временном каталоге."""
+    db.init_db()
+    yield
+    db.get_engine().dispose()
+    db.get_engine.cache_clear()
+    db.get_async_engine.cache_clear()
@@ -0,0 +1,77 @@
+import asyncio
+import glob
+
+from sqlmodel import select
+
+from app.db import close_db, get_async_session
+from app.models import Lead
+from app.services.dedupe import LeadDeduplicator
+from app.services.ingest import LeadIngestQueue, PendingLead
+
+
+def make_queue(spool_path: str) -> LeadIngestQueue:
+    # Пачка не уходит в БД сама: заявки остаются только в спуле.
+    return LeadIngestQueue(LeadDeduplicator(), batch_size=100, flush_interval=60, spool_path=spool_path)
+
+
+def crash(queue: LeadIngestQueue) -> None:
+    """Процесс умер: задача остановлена, файл спула закрыт без очистки."""
+    queue._task.cancel()
+    queue._spool.close()
+
+
+async def lead_names() -> list[str]:
+    async with get_async_session() as session:
+        return sorted((await session.exec(select(Lead.name))).all())
+
+
+def test_spool_round_trip(database, tmp_path):
+    spool = str(tmp_path / "ingest.spool")
+
+    async def scenario():
+        crashed = make_queue(spool)
+        await crashed.start()
+        assert await crashed.submit(PendingLead("Иван", "+79001234567", None))
+        assert await crashed.submit(PendingLead("Пётр", None, "petr", idempotency_key="form-1"))
+        crash(crashed)
+        with open(glob.glob(spool + ".*")[0], "a", encoding="utf-8") as orphan:
+            orphan.write("не json\n")
+        assert await lead_names() == []
+
+        queue = make_queue(spool)
+        await queue.start()
+        # Заявки из спула упавшего процесса пишутся до новых.
+        for _ in range(100):
+            if await lead_names():
+                break
+            await asyncio.sleep(0.01)
+        assert await lead_names() == ["Иван", "Пётр"]
+        assert glob.glob(spool + ".*") == [queue._spool.name]
+
+        await queue.stop()
+        assert glob.glob(spool + ".*") == []
+        await close_db()
+
+    asyncio.run(scenario())
+
+
+def test_live_spool_is_not_adopted(database, tmp_path):
+    spool = str(tmp_path / "ingest.spool")
+
+    async def scenario():
+        first = make_queue(spool)
+        await first.start()
+        assert await first.submit(PendingLead("Иван", "+79001234567", None))
+        # Второй процесс стартует рядом с живым: чужой спул под блокировкой.
+        second = make_queue(spool)
+        await second.start()
+        await asyncio.sleep(0.05)
+        assert await lead_names() == []
+
+        await first.stop()
+        await second.stop()
+        assert await lead_names() == ["Иван"]
+        assert glob.glob(spool + ".*") == []
+        await close_db()
+
+    asyncio.run(scenario())
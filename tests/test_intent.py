@@ -0,0 +1,80 @@
+import pytest
+
+from app.services.intent import IntentClassifier, IntentLabel
+
+
+@pytest.fixture(scope="module")
+def classifier():
+    return IntentClassifier()
+
+
+@pytest.mark.parametrize(
+    ("message", "label"),
+    [
+        ("Да", IntentLabel.accept),
+        ("да, готов", IntentLabel.accept),
+        ("Я готова созвониться", IntentLabel.accept),
+        ("давайте", IntentLabel.accept),
+        ("Интересно", IntentLabel.accept),
+        ("не против", IntentLabel.accept),
+        ("Нет", IntentLabel.reject),
+        ("не готов", IntentLabel.reject),
+        ("не интересно", IntentLabel.reject),
+        ("Больше не пишите", IntentLabel.reject),
+        ("Заявку не оставлял", IntentLabel.reject),
+        ("стоимость", IntentLabel.question),
+        ("Какая стоимость?", IntentLabel.question),
+        ("запись", IntentLabel.question),
+        ("Не получается записаться", IntentLabel.question),
+    ],
+)
+def test_classify(classifier, message, label):
+    assert classifier.classify(message).label == label
+
+
+@pytest.mark.parametrize("message", ["готов", "готовы", "готово"])
+def test_prefix_matches_forms_the_stemmer_would_cut(classifier, message):
+    # Стеммер режет «готов» до «гот»: префикс сравнивается с исходным словом.
+    result = classifier.classify(message)
+    assert result.label == IntentLabel.accept
+    assert result.scores[IntentLabel.accept] == 1.0
+
+
+def test_prefix_does_not_match_inside_a_word(classifier):
+    assert classifier.classify("приготовить").scores[IntentLabel.accept] == 0.0
+
+
+def test_longer_pattern_absorbs_nested_one(classifier):
+    # «не оставлял» поглощает «оставлял», а не складывается с ним.
+    scores = classifier.classify("не оставлял").scores
+    assert scores[IntentLabel.accept] == 0.0
+    assert scores[IntentLabel.reject] == 1.5
+
+
+def test_negation_flips_accept(classifier):
+    scores = classifier.classify("мне не очень удобно").scores
+    assert scores[IntentLabel.accept] == 0.0
+    assert scores[IntentLabel.reject] == 0.6
+
+
+def test_negation_outside_window_is_ignored(classifier):
+    result = classifier.classify("не знаю почему, но да")
+    assert result.scores[IntentLabel.accept] == 1.0
+
+
+@pytest.mark.parametrize("message", ["", "   ", "🙂"])
+def test_empty_message_is_ambiguous(classifier, message):
+    result = classifier.classify(message)
+    assert result.label == IntentLabel.ambiguous
+    assert result.confidence == 0.0
+
+
+def test_mixed_signals_lower_confidence(classifier):
+    assert classifier.classify("да").confidence > classifier.classify("да, а сколько стоит?").confidence
+
+
+def test_custom_patterns():
+    classifier = IntentClassifier({IntentLabel.accept: {"погнали": 1.0}, IntentLabel.reject: {"стоп*": 1.0}})
+    assert classifier.classify("Погнали!").label == IntentLabel.accept
+    assert classifier.classify("стопэ").label == IntentLabel.reject
+    assert classifier.classify("да").label == IntentLabel.ambiguous
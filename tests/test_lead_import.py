@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from app.services.lead_import import FORMAT_CSV, FORMAT_JSON, FORMAT_NDJSON, ImportFormatError, detect_format, iter_rows
+
+
+def parse(body: str | bytes, content_type: str | None = None, *, chunk_size: int = 3) -> list[tuple]:
+    """Разбирает тело, нарезанное на мелкие чанки, как его отдаёт request.stream()."""
+    data = body.encode("utf-8") if isinstance(body, str) else body
+
+    async def chunks():
+        for start in range(0, len(data), chunk_size):
+            yield data[start:start + chunk_size]
+
+    async def collect():
+        return [(row.number, row.fields, row.error) for row in [row async for row in iter_rows(chunks(), content_type)]]
+
+    return asyncio.run(collect())
+
+
+@pytest.mark.parametrize(
+    ("content_type", "head", "expected"),
+    [
+        ("application/json; charset=utf-8", "", FORMAT_JSON),
+        ("application/x-ndjson", "", FORMAT_NDJSON),
+        ("text/csv", "[", FORMAT_CSV),
+        (None, "  [{}]", FORMAT_JSON),
+        (None, '{"name": "a"}', FORMAT_NDJSON),
+        ("application/octet-stream", "name,phone", FORMAT_CSV),
+    ],
+)
+def test_detect_format(content_type, head, expected):
+    assert detect_format(content_type, head) == expected
+
+
+def test_csv_quoted_multiline_value():
+    body = 'name,phone,comment\n"Иван",+79001234567,"первая строка\nвторая, с запятой"\nПётр,+79007654321,\n'
+    assert parse(body, "text/csv") == [
+        (1, {"name": "Иван", "phone": "+79001234567", "comment": "первая строка\nвторая, с запятой"}, None),
+        (2, {"name": "Пётр", "phone": "+79007654321"}, None),
+    ]
+
+
+def test_csv_escaped_quotes_do_not_open_a_record():
+    body = 'name,comment\n"Анна","сказала ""перезвоните"""\n'
+    assert parse(body) == [(1, {"name": "Анна", "comment": 'сказала "перезвоните"'}, None)]
+
+
+def test_csv_semicolon_bom_and_crlf():
+    body = "\ufeffName;Phone\r\nИван;+79001234567\r\n\r\nПётр;\r\n".encode("utf-8")
+    assert parse(body) == [
+        (1, {"name": "Иван", "phone": "+79001234567"}, None),
+        (2, {"name": "Пётр"}, None),
+    ]
+
+
+def test_csv_bad_rows_do_not_stop_parsing():
+    body = 'name,phone\nИван,+7900,лишнее\nПётр,+7901\n"Анна,+7902\n'
+    rows = parse(body)
+    assert rows[0] == (1, None, "В строке больше значений, чем колонок в заголовке.")
+    assert rows[1] == (2, {"name": "Пётр", "phone": "+7901"}, None)
+    assert rows[2] == (3, None, "Незакрытая кавычка в CSV.")
+
+
+def test_csv_without_header():
+    with pytest.raises(ImportFormatError):
+        parse("\n\n", "text/csv")
+
+
+def test_ndjson_bad_rows():
+    body = '{"name": "Иван"}\n\nне json\n[1, 2]\n{"name": "Пётр"}'
+    rows = parse(body, "application/x-ndjson")
+    assert [(number, fields) for number, fields, _ in rows] == [
+        (1, {"name": "Иван"}),
+        (2, None),
+        (3, None),
+        (4, {"name": "Пётр"}),
+    ]
+    assert rows[1][2].startswith("Некорректный JSON")
+    assert rows[2][2] == "Запись должна быть JSON-объектом."
+
+
+def test_json_array_split_across_chunks():
+    body = '[{"name": "Иван", "comment": "a, b ]"}, 5 ,\n {"name": "Пётр"}]'
+    assert parse(body, chunk_size=1) == [
+        (1, {"name": "Иван", "comment": "a, b ]"}, None),
+        (2, None, "Запись должна быть JSON-объектом."),
+        (3, {"name": "Пётр"}, None),
+    ]
+
+
+def test_json_array_not_closed():
+    rows = parse('[{"name": "Иван"}, {"name": ')
+    assert rows == [(1, {"name": "Иван"}, None), (2, None, "Некорректный JSON или массив не закрыт.")]
+
+
+def test_json_not_an_array():
+    with pytest.raises(ImportFormatError):
+        parse('{"name": "Иван"}', "application/json")
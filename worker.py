@@ -1,22 +1,43 @@
 import asyncio
 import logging
 
-from app.db import init_db
+from app.config import get_settings
+from app.db import close_db
+from app.services.metrics import serve_metrics
+from app.services.notify import LeadWakeup
 from app.services.telegram import TelegramLeadService
+from app.startup import StartupReport
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+logger = logging.getLogger("worker")
 
 
 async def main() -> None:
-    init_db()
-    service = TelegramLeadService()
-    await service.start()
+    settings = get_settings()
+    # Схему создаёт `python -m app.manage init-db` (в Docker — entrypoint).
+    report = StartupReport()
+    with report.measure("telegram_service"):
+        service = TelegramLeadService()
+    wakeup = LeadWakeup(settings.database_url)
+    with report.measure("telegram_start"):
+        await service.start()
+    with report.measure("wakeup"):
+        await wakeup.start()
+    logger.info("Worker started: %s", report.render())
+    metrics_server = await serve_metrics(settings.worker_metrics_port) if settings.worker_metrics_port else None
     try:
         while True:
-            await service.process_pending()
-            await asyncio.sleep(15)
+            processed = await service.process_pending()
+            # Полная пачка — значит, в очереди есть ещё лиды, берём следующую сразу.
+            if processed < settings.outreach_batch_size:
+                await wakeup.wait(settings.outreach_poll_interval)
     finally:
+        if metrics_server:
+            metrics_server.close()
+            await metrics_server.wait_closed()
+        await wakeup.stop()
         await service.stop()
+        await close_db()
 
 
 if __name__ == "__main__":